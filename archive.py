@@ -0,0 +1,129 @@
+"""
+Hot/cold partitioning of the maintenances.
+
+Maintenances dated before the cutoff are moved from Maintenance to MaintenanceArchive, which has the
+same columns and indexes, so the hot table and its indexes only grow with recent bookings. The
+read paths query Maintenance alone when the requested range starts at or after the published
+cutoff, and both tables otherwise. The GarageOccupancy rollup keeps counting archived bookings, the
+reports built on it are the same before and after archiving.
+
+    python archive.py run --days 365
+    python archive.py status
+
+A new cutoff is published ARCHIVE_GRACE_SECONDS before the first row moves, so a request that read
+the previous cutoff has finished before any row it could be looking for leaves the hot table.
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import delete, func, insert, select, union_all, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from constants import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_PAUSE, ARCHIVE_BATCH_SIZE, ARCHIVE_GRACE_SECONDS, engine
+from models import ArchiveCutoff, Maintenance, MaintenanceArchive
+
+ARCHIVED_COLUMNS = ("id", "carId", "garageId", "serviceType", "scheduledDate")
+
+
+def archive_cutoff(db: Session | Connection) -> date | None:
+    return db.scalar(select(ArchiveCutoff.cutoff).where(ArchiveCutoff.tableName == Maintenance.__tablename__))
+
+
+def reaches_archive(db: Session, start_date: date | None) -> bool:
+    """Whether a date range starting at `start_date`, None for no lower bound, may hold archived maintenances."""
+    cutoff = archive_cutoff(db)
+    return cutoff is not None and (start_date is None or start_date < cutoff)
+
+
+def all_maintenances(*columns):
+    """UNION ALL of the same columns of Maintenance and MaintenanceArchive, as a subquery."""
+    return union_all(
+        select(*(getattr(Maintenance, name) for name in columns)),
+        select(*(getattr(MaintenanceArchive, name) for name in columns)),
+    ).subquery()
+
+
+def is_archived(db: Session, maintenance_id: int) -> bool:
+    return db.get(MaintenanceArchive, maintenance_id) is not None
+
+
+def publish_cutoff(connection: Connection, cutoff: date) -> date:
+    """Stores `cutoff` unless a later one is already published, returns the published cutoff."""
+    published = archive_cutoff(connection)
+    if published is None:
+        connection.execute(insert(ArchiveCutoff).values(tableName=Maintenance.__tablename__, cutoff=cutoff))
+    elif cutoff > published:
+        connection.execute(
+            update(ArchiveCutoff).where(ArchiveCutoff.tableName == Maintenance.__tablename__).values(cutoff=cutoff)
+        )
+    else:
+        cutoff = published
+    return cutoff
+
+
+def archive_batch(connection: Connection, cutoff: date, batch_size: int) -> int:
+    """Moves up to `batch_size` maintenances dated before `cutoff` in the caller's transaction, returns how many."""
+    ids = connection.execute(
+        select(Maintenance.id).where(Maintenance.scheduledDate < cutoff).order_by(Maintenance.scheduledDate).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return 0
+    # The date is checked again, a request may have moved one of them past the cutoff since
+    moving = (Maintenance.id.in_(ids), Maintenance.scheduledDate < cutoff)
+    connection.execute(insert(MaintenanceArchive).from_select(
+        ARCHIVED_COLUMNS, select(*(getattr(Maintenance, name) for name in ARCHIVED_COLUMNS)).where(*moving)
+    ))
+    return connection.execute(delete(Maintenance).where(*moving)).rowcount
+
+
+def archive_maintenances(
+    engine: Engine,
+    cutoff: date,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    pause: float = ARCHIVE_BATCH_PAUSE,
+    grace: float = ARCHIVE_GRACE_SECONDS,
+) -> int:
+    """
+    Moves every maintenance dated before `cutoff` to the archive, returns how many were moved.
+
+    Each batch is its own short write transaction, the pause between two lets the other writers in.
+    """
+    with engine.begin() as connection:
+        previous = archive_cutoff(connection)
+        cutoff = publish_cutoff(connection, cutoff)
+    if cutoff != previous:
+        time.sleep(grace)
+
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            count = archive_batch(connection, cutoff, batch_size)
+        moved += count
+        if count < batch_size:
+            return moved
+        time.sleep(pause)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old maintenances to MaintenanceArchive.")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Archive maintenances older than this")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        cutoff = date.today() - timedelta(days=args.days)
+        started = time.perf_counter()
+        moved = archive_maintenances(engine, cutoff, args.batch_size)
+        print(f"Archived {moved} maintenances dated before {cutoff} in {time.perf_counter() - started:.1f}s")
+    else:
+        with engine.connect() as connection:
+            hot = connection.scalar(select(func.count()).select_from(Maintenance))
+            archived = connection.scalar(select(func.count()).select_from(MaintenanceArchive))
+            print(f"Cutoff {archive_cutoff(connection)}, {hot} hot and {archived} archived maintenances")
+
+
+if __name__ == "__main__":
+    main()
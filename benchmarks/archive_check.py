@@ -0,0 +1,169 @@
+"""
+Checks that archiving old maintenances changes no response, and times the hot and archive paths.
+
+    python -m benchmarks.archive_check --database dataset.db --cutoff 2024-01-01
+
+A copy of the dataset is archived up to --cutoff in-process. Before and after, the same seeded GET
+requests are sent (every GET endpoint of benchmarks.endpoints, get_maintenances walked page by page
+over the cutoff, single maintenances on both sides of it) with the response cache off. Any
+different response, or a GarageOccupancy row that no longer matches the maintenances, exits with
+status 1. So does a page over both tables whose query plan sorts in a temp B-tree, each table must
+be paged on its own index, and the unfiltered first page is timed before and after.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+def requests_for(fixtures: dict, cutoff: date, seed: int) -> list[str]:
+    from benchmarks.endpoints import build_endpoints
+
+    rng = random.Random(seed)
+    urls = [endpoint.request(i)[0] for endpoint in build_endpoints(fixtures, seed) if endpoint.method == "GET" for i in range(5)]
+    for start, end in ((cutoff - timedelta(days=30), cutoff + timedelta(days=30)), (cutoff, cutoff + timedelta(days=60))):
+        garage = rng.choice(fixtures["busiest"])
+        urls += [
+            f"/maintenance/?startDate={start}&endDate={end}",
+            f"/maintenance/?garageId={garage}&startDate={start}&endDate={end}",
+            f"/maintenance/?garageId={garage}&startDate={start}",
+            f"/garages/dailyAvailabilityReport?garageId={garage}&startDate={start}&endDate={end}",
+        ]
+    urls += [f"/maintenance/?carId={rng.randint(1, fixtures['cars'])}" for _ in range(20)]
+    urls += [f"/maintenance/{rng.randint(1, fixtures['maintenances'])}" for _ in range(200)]
+    return urls
+
+
+def walk(client, url: str, pages: int) -> list[bytes]:
+    """The bodies of up to `pages` pages of a paginated list."""
+    from routes.pagination import NEXT_CURSOR_HEADER
+
+    bodies = []
+    cursor = None
+    for _ in range(pages):
+        response = client.get(url + (f"&after={cursor}" if cursor else ""))
+        bodies.append(f"{response.status_code} ".encode() + response.content)
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+    return bodies
+
+
+def snapshot(client, urls: list[str], walks: list[str]) -> dict:
+    responses = {url: client.get(url) for url in urls}
+    results = {url: f"{r.status_code} ".encode() + r.content for url, r in responses.items()}
+    results.update({f"walk {url}": b"|".join(walk(client, url, 20)) for url in walks})
+    return results
+
+
+def timed(client, url: str, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.get(url)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies) * 1000
+
+
+def sorting_pages(connection, fixtures: dict, cutoff: date) -> list[str]:
+    """The per-table page queries of get_maintenances over the cutoff whose plan sorts in a temp B-tree."""
+    from migrations import explain
+    from models import Maintenance, MaintenanceArchive
+    from routes.maintenance import maintenance_page_rows
+    from routes.pagination import encode_cursor
+
+    cursor = encode_cursor(cutoff - timedelta(days=1), 1)
+    filters = {
+        "unfiltered": (None, None, None, None),
+        "garageId": (None, fixtures["busiest"][0], None, None),
+        "carId": (fixtures["links"][0][0], None, None, None),
+        "startDate": (None, None, cutoff - timedelta(days=30), None),
+    }
+    sorting = []
+    for name, (car_id, garage_id, start, end) in filters.items():
+        for model in (Maintenance, MaintenanceArchive):
+            for after in (None, cursor):
+                statement = maintenance_page_rows(model, car_id, garage_id, start, end, after).limit(101)
+                plan = explain(connection, statement)
+                if any("TEMP B-TREE" in line for line in plan):
+                    sorting.append(f"{name} {model.__tablename__} after={after}: " + "; ".join(plan))
+    return sorting
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--cutoff", type=date.fromisoformat, help="Archive before this day, the middle of the data by default")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "archive_check.db")
+    shutil.copyfile(args.database, database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+
+    try:
+        from fastapi.testclient import TestClient
+
+        from archive import archive_maintenances
+        from benchmarks.endpoints import load_fixtures
+        from constants import engine, session
+        from main import app
+        from migrations import run_migrations
+        from occupancy import verify_occupancy
+        from report_engines import report_snapshot
+
+        run_migrations(engine)
+        fixtures = load_fixtures(database, args.seed)
+        cutoff = args.cutoff or fixtures["last_day"] - timedelta(days=5 * 365)
+        client = TestClient(app)
+        urls = requests_for(fixtures, cutoff, args.seed)
+        walks = [
+            f"/maintenance/?startDate={cutoff - timedelta(days=3)}&limit=100",
+            f"/maintenance/?garageId={fixtures['busiest'][0]}&limit=100",
+            f"/async/maintenance/?carId={fixtures['links'][0][0]}&limit=5",
+        ]
+        hot_url = f"/maintenance/?garageId={fixtures['busiest'][0]}&startDate={fixtures['last_day'] - timedelta(days=30)}"
+        crossing_url = f"/maintenance/?garageId={fixtures['busiest'][0]}&startDate={cutoff - timedelta(days=30)}"
+
+        page_url = "/maintenance/?limit=100"
+        before = snapshot(client, urls, walks)
+        before_times = timed(client, hot_url, 50), timed(client, crossing_url, 50), timed(client, page_url, 20)
+
+        started = time.perf_counter()
+        moved = archive_maintenances(engine, cutoff, args.batch_size, pause=0, grace=0)
+        print(f"Archived {moved} maintenances dated before {cutoff} in {time.perf_counter() - started:.1f}s")
+        report_snapshot.clear()
+
+        after = snapshot(client, urls, walks)
+        after_times = timed(client, hot_url, 50), timed(client, crossing_url, 50), timed(client, page_url, 20)
+        with session() as db:
+            mismatches = verify_occupancy(db)
+        with engine.connect() as connection:
+            sorting = sorting_pages(connection, fixtures, cutoff)
+
+        different = [url for url in before if before[url] != after[url]]
+        for url in different:
+            print(f"DIFFERENT {url}")
+        print(f"{len(before)} responses compared, {len(different)} differ, {len(mismatches)} rollup mismatches")
+        print(f"Hot range p50 {before_times[0]:.2f}ms -> {after_times[0]:.2f}ms, "
+              f"range over the cutoff p50 {before_times[1]:.2f}ms -> {after_times[1]:.2f}ms, "
+              f"unfiltered first page p50 {before_times[2]:.2f}ms -> {after_times[2]:.2f}ms")
+        for plan in sorting:
+            print(f"SORTS {plan}")
+        print(f"{len(sorting)} page queries over both tables sort in a temp B-tree")
+        raise SystemExit(1 if different or mismatches or sorting else 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Concurrency stress test of maintenance booking: many clients race for the last places of a few days.
+
+    python -m benchmarks.booking_stress --requests 2000 --threads 32 --capacity 20 --days 5
+    python -m benchmarks.booking_stress --url http://127.0.0.1:8088 --database database.db
+
+A fresh database gets one garage with `capacity` places and cars registered at it. Every request
+books (POST) or moves (PUT) a maintenance to one of `days` days, far more than fit. Afterwards no
+day may hold more maintenances than the capacity, the GarageOccupancy rollup must match the
+Maintenance table and every request must have been answered with 200 or 409. Exits with status 1
+otherwise. With --url the requests go to a running server, e.g. uvicorn with several workers, which
+must use the file given as --database.
+
+In process, all --async requests share one event loop, a writer holding the SQLite lock waits for
+its turn on the loop, so high --threads may need a longer SQLITE_BUSY_TIMEOUT_MS to avoid 500s.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+
+def setup(capacity: int, cars: int) -> int:
+    """Creates the garage and its cars, returns the garage id."""
+    from constants import engine, session
+    from migrations import run_migrations
+    from models import Car, Garage
+
+    run_migrations(engine)
+    db = session()
+    try:
+        garage = Garage(city="Stress", location="Stress", name="StressGarage", capacity=capacity)
+        db.add(garage)
+        db.add_all(
+            Car(make="Stress", model="Stress", productionYear=2020, licensePlate=f"STRESS-{os.getpid()}-{i}", garages=[garage])
+            for i in range(cars)
+        )
+        db.commit()
+        return garage.id
+    finally:
+        db.close()
+
+
+def check(garage_id: int, capacity: int) -> tuple[dict, list]:
+    """Maintenances per day of the garage, and the rollup rows that disagree with them."""
+    from sqlalchemy import func, select
+
+    from constants import session
+    from models import Maintenance
+    from occupancy import verify_occupancy
+
+    db = session()
+    try:
+        per_day = dict(db.execute(
+            select(Maintenance.scheduledDate, func.count())
+            .where(Maintenance.garageId == garage_id)
+            .group_by(Maintenance.scheduledDate)
+        ).all())
+        return per_day, verify_occupancy(db, garage_id)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--capacity", type=int, default=20)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--moves", type=float, default=0.3, help="Share of the requests that are PUT moves")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the /async routers")
+    parser.add_argument("--url", help="Send the requests to a running server")
+    parser.add_argument("--database", help="SQLite file, a temporary one by default")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), "booking_stress.db")
+    # The app binds its engine at import time, point it at the database first
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+
+    garage_id = setup(args.capacity, args.cars)
+    from constants import session
+    from models import Car
+
+    with session() as db:
+        car_ids = [car.id for car in db.query(Car).filter(Car.licensePlate.like(f"STRESS-{os.getpid()}-%"))]
+
+    if args.url:
+        import httpx
+
+        client = httpx.Client(base_url=args.url, timeout=60, limits=httpx.Limits(max_connections=args.threads))
+    else:
+        from fastapi.testclient import TestClient
+
+        from main import app
+
+        # Entered, the client runs every request on one event loop, otherwise each thread would start
+        # its own and the async engine's pooled connections would be awaited from the wrong loop
+        client = TestClient(app, raise_server_exceptions=False).__enter__()
+
+    prefix = "/async" if args.use_async else ""
+    first_day = date(2030, 1, 1)
+    rng = random.Random(args.seed)
+    plan = [
+        ("PUT" if rng.random() < args.moves else "POST", rng.choice(car_ids), first_day + timedelta(days=rng.randrange(args.days)))
+        for _ in range(args.requests)
+    ]
+    booked = []
+
+    def send(item):
+        method, car_id, day = item
+        body = {"carId": car_id, "garageId": garage_id, "serviceType": "Stress", "scheduledDate": str(day)}
+        if method == "PUT" and booked:
+            response = client.put(f"{prefix}/maintenance/{random.choice(booked)}", json=body)
+        else:
+            method = "POST"
+            response = client.post(f"{prefix}/maintenance/", json=body)
+            if response.status_code == 200:
+                booked.append(response.json()["id"])
+        return method, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = Counter(pool.map(send, plan))
+    elapsed = time.perf_counter() - started
+
+    per_day, mismatches = check(garage_id, args.capacity)
+    overbooked = {str(day): count for day, count in per_day.items() if count > args.capacity}
+    unexpected = {key: count for key, count in statuses.items() if key[1] not in (200, 409)}
+
+    print(f"{args.requests} requests in {elapsed:.1f}s ({args.requests / elapsed:.0f} req/s), {args.threads} threads")
+    for (method, status), count in sorted(statuses.items()):
+        print(f"  {method:4} {status}: {count}")
+    print(f"Maintenances per day (capacity {args.capacity}): {dict(sorted((str(d), c) for d, c in per_day.items()))}")
+    print(f"Overbooked days: {len(overbooked)}, rollup mismatches: {len(mismatches)}, unexpected statuses: {len(unexpected)}")
+    if not args.database:
+        shutil.rmtree(os.path.dirname(database), ignore_errors=True)
+    raise SystemExit(1 if overbooked or mismatches or unexpected else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cost of keeping a client copy current: polling GET /changes against listing every table again.
+
+    python -m benchmarks.change_feed --database dataset.db --writes 500
+
+On a copy of the dataset the cursor of GET /changes is taken, then --writes maintenances are
+booked and every fifth one is moved and every tenth one deleted again. The feed is polled from the
+cursor until it has no more changes, and /garages/, /cars/ and /maintenance/ are listed completely
+with pages of 1000 rows, as the clients did before the feed. Time, pages and bytes of both are
+printed. Every booked maintenance must be in the feed as it is now, or as deleted, otherwise the
+exit status is 1.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def read_all(client, url: str, next_page) -> tuple[int, int]:
+    """Follows `next_page(response, url)` from `url` until it returns None, returns the pages and bytes read."""
+    pages = size = 0
+    while url:
+        response = client.get(url)
+        response.raise_for_status()
+        pages += 1
+        size += len(response.content)
+        url = next_page(response, url)
+    return pages, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "change_feed.db")
+    shutil.copyfile(args.database, database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    os.environ["FAST_SERIALIZATION"] = "1"
+
+    try:
+        from fastapi.testclient import TestClient
+
+        from benchmarks.endpoints import build_write_endpoints, load_fixtures
+        from constants import engine
+        from main import app
+        from migrations import run_migrations
+        from routes.pagination import NEXT_CURSOR_HEADER
+
+        run_migrations(engine)
+        fixtures = load_fixtures(database, args.seed)
+        post = build_write_endpoints(fixtures, args.seed, {})[0]
+        client = TestClient(app)
+
+        cursor = client.get("/changes/").json()["cursor"]
+        booked = []
+        for i in range(args.writes):
+            url, body = post.request(i)
+            response = client.post(url, json=body)
+            if response.status_code != 200:
+                continue
+            booked.append(response.json()["id"])
+            if i % 5 == 0:
+                client.put(f"/maintenance/{booked[-1]}", json=post.request(i)[1])
+            if i % 10 == 0:
+                client.delete(f"/maintenance/{booked[-1]}")
+
+        changes = {}
+
+        def next_changes(response, url):
+            feed = response.json()
+            changes.update(((change["entity"], change["id"]), change) for change in feed["changes"])
+            return f"/changes/?since={feed['cursor']}&limit=1000" if feed["hasMore"] else None
+
+        started = time.perf_counter()
+        pages, size = read_all(client, f"/changes/?since={cursor}&limit=1000", next_changes)
+        poll_time = time.perf_counter() - started
+
+        def next_rows(response, url):
+            after = response.headers.get(NEXT_CURSOR_HEADER)
+            return f"{url.split('&after=')[0]}&after={after}" if after else None
+
+        started = time.perf_counter()
+        listing = [read_all(client, f"/{path}/?limit=1000", next_rows) for path in ("garages", "cars", "maintenance")]
+        list_time = time.perf_counter() - started
+
+        missing = 0
+        for maintenance_id in booked:
+            change = changes.get(("maintenance", maintenance_id))
+            response = client.get(f"/maintenance/{maintenance_id}")
+            expected = response.json() if response.status_code == 200 else None
+            missing += change is None or change["data"] != expected
+
+        print(f"{len(booked)} bookings, {len(changes)} changed rows")
+        print(f"Polling /changes:   {poll_time * 1000:9.1f}ms, {pages:5} pages, {size / 1024:10.1f} KiB")
+        print(f"Listing everything: {list_time * 1000:9.1f}ms, {sum(p for p, _ in listing):5} pages, "
+              f"{sum(s for _, s in listing) / 1024:10.1f} KiB")
+        print(f"Bookings missing from the feed or out of date: {missing}")
+        raise SystemExit(1 if missing else 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Time to delete a busy garage, and how long it keeps the other writers waiting.
+
+    python -m benchmarks.delete_garage --database dataset.db --chunk-size 1000
+
+The busiest garage of a copy of the dataset is deleted in-process with DELETE /garages/{id}, while
+a writer thread books and cancels maintenances at random garages. The deletion time, its affected
+rows and the writer's worst latency are printed. Afterwards no row may still reference the
+garage, otherwise the exit status is 1.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--chunk-size", type=int, help="DELETE_CHUNK_SIZE for this run")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "delete_garage.db")
+    shutil.copyfile(args.database, database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    if args.chunk_size:
+        os.environ["DELETE_CHUNK_SIZE"] = str(args.chunk_size)
+
+    try:
+        from fastapi.testclient import TestClient
+        from sqlalchemy import func, select
+
+        from benchmarks.endpoints import build_write_endpoints, load_fixtures
+        from constants import DELETE_CHUNK_SIZE, engine, session
+        from main import app
+        from migrations import run_migrations
+        from models import GarageCar, GarageOccupancy, Maintenance, MaintenanceArchive
+        from occupancy import verify_occupancy
+
+        run_migrations(engine)
+        fixtures = load_fixtures(database, args.seed)
+        garage_id = fixtures["busiest"][0]
+        post = next(endpoint for endpoint in build_write_endpoints(fixtures, args.seed, {}) if endpoint.method == "POST")
+        with session() as db:
+            cars = db.scalar(select(func.count()).where(GarageCar.garageId == garage_id))
+
+        client = TestClient(app)
+        stop = threading.Event()
+        latencies = []
+
+        def writer():
+            i = 0
+            while not stop.is_set():
+                url, body = post.request(i)
+                started = time.perf_counter()
+                response = client.post(url, json=body)
+                if response.status_code == 200:
+                    client.delete(f"/maintenance/{response.json()['id']}")
+                latencies.append(time.perf_counter() - started)
+                i += 1
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        started = time.perf_counter()
+        response = client.delete(f"/garages/{garage_id}")
+        elapsed = time.perf_counter() - started
+        stop.set()
+        thread.join()
+
+        with session() as db:
+            left = {
+                model.__tablename__: db.scalar(select(func.count()).where(model.garageId == garage_id))
+                for model in (Maintenance, MaintenanceArchive, GarageOccupancy, GarageCar)
+            }
+            mismatches = verify_occupancy(db, garage_id)
+        print(f"DELETE /garages/{garage_id} ({cars} cars) with chunks of {DELETE_CHUNK_SIZE}: "
+              f"{response.status_code} in {elapsed:.2f}s, {response.json().get('affectedRows')}")
+        if latencies:
+            print(f"Concurrent writer: {len(latencies)} bookings, worst {max(latencies) * 1000:.0f}ms")
+        print(f"Rows left referencing the garage: {left}, rollup mismatches: {len(mismatches)}")
+        raise SystemExit(1 if response.status_code != 200 or any(left.values()) or mismatches else 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
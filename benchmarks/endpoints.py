@@ -0,0 +1,412 @@
+"""
+Endpoint benchmarks over a generated dataset.
+
+    python -m benchmarks.endpoints run --maintenances 1000000 --output bench.json
+    python -m benchmarks.endpoints run --baseline bench.json
+    python -m benchmarks.endpoints compare baseline.json current.json
+
+The app from main.py runs in-process through the TestClient, or pass --url to benchmark a running
+uvicorn. In-process runs also report the SQL statements and the peak Python memory of one request.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+
+@dataclass
+class Endpoint:
+    name: str
+    method: str
+    # Returns (url, json body) for the i-th request
+    request: Callable[[int], tuple[str, dict | None]]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def load_fixtures(database: str, seed: int) -> dict:
+    """Ids the generated requests can refer to, read straight from the dataset."""
+    import sqlite3
+
+    connection = sqlite3.connect(database)
+    try:
+        rng = random.Random(seed)
+        garage_count = connection.execute('SELECT MAX(id) FROM "Garage"').fetchone()[0]
+        car_count = connection.execute('SELECT MAX(id) FROM "Car"').fetchone()[0]
+        maintenance_count = connection.execute('SELECT MAX(id) FROM "Maintenance"').fetchone()[0]
+        busiest = [row[0] for row in connection.execute(
+            'SELECT "garageId" FROM "GarageOccupancy" GROUP BY "garageId" ORDER BY SUM(requests) DESC LIMIT 20'
+        )]
+        links = connection.execute(
+            'SELECT "carId", "garageId" FROM "GarageCar" WHERE "carId" IN (%s)'
+            % ",".join(str(rng.randint(1, car_count)) for _ in range(500))
+        ).fetchall()
+        cities = [row[0] for row in connection.execute('SELECT DISTINCT city FROM "Garage"')]
+        makes = [row[0] for row in connection.execute('SELECT DISTINCT make FROM "Car"')]
+        last_day = date.fromisoformat(connection.execute('SELECT MAX("scheduledDate") FROM "Maintenance"').fetchone()[0])
+    finally:
+        connection.close()
+    return {
+        "garages": garage_count, "cars": car_count, "maintenances": maintenance_count, "busiest": busiest,
+        "links": links, "cities": cities, "makes": makes, "last_day": last_day,
+    }
+
+
+def build_endpoints(fixtures: dict, seed: int, prefix: str = "") -> list[Endpoint]:
+    """Every endpoint of the API, list_cars with each filter combination."""
+    rng = random.Random(seed)
+    garage = lambda: rng.randint(1, fixtures["garages"])
+    busy_garage = lambda: rng.choice(fixtures["busiest"])
+    car = lambda: rng.randint(1, fixtures["cars"])
+    maintenance = lambda: rng.randint(1, fixtures["maintenances"])
+    last_day = fixtures["last_day"]
+    endpoints = []
+
+    car_filters = {
+        "car_make": lambda: rng.choice(fixtures["makes"]),
+        "garage_id": garage,
+        "from_year": lambda: rng.randint(1995, 2020),
+        "to_year": lambda: rng.randint(2010, 2025),
+    }
+    for mask in range(1 << len(car_filters)):
+        names = [name for bit, name in enumerate(car_filters) if mask & (1 << bit)]
+        endpoints.append(Endpoint(
+            "list_cars" + ("?" + "&".join(names) if names else ""), "GET",
+            lambda i, names=names: (f"{prefix}/cars/?" + "&".join(f"{n}={car_filters[n]()}" for n in names), None),
+        ))
+
+    def maintenances(params: Callable[[], str]):
+        return lambda i: (f"{prefix}/maintenance/?{params()}", None)
+
+    endpoints += [
+        Endpoint("get_maintenances", "GET", maintenances(lambda: "")),
+        Endpoint("get_maintenances?carId", "GET", maintenances(lambda: f"carId={car()}")),
+        Endpoint("get_maintenances?garageId", "GET", maintenances(lambda: f"garageId={busy_garage()}")),
+        Endpoint("get_maintenances?startDate&endDate", "GET", maintenances(
+            lambda: f"startDate={last_day - timedelta(days=30)}&endDate={last_day}"
+        )),
+        Endpoint("get_maintenances?garageId&startDate&endDate", "GET", maintenances(
+            lambda: f"garageId={busy_garage()}&startDate={last_day - timedelta(days=365)}&endDate={last_day}"
+        )),
+        Endpoint("list_garages", "GET", lambda i: (f"{prefix}/garages/", None)),
+        Endpoint("list_garages?city", "GET", lambda i: (f"{prefix}/garages/?city={rng.choice(fixtures['cities'])}", None)),
+        Endpoint("dailyAvailabilityReport 1 month", "GET", lambda i: (
+            f"{prefix}/garages/dailyAvailabilityReport?garageId={busy_garage()}"
+            f"&startDate={last_day - timedelta(days=30)}&endDate={last_day}", None,
+        )),
+        Endpoint("dailyAvailabilityReport 1 year", "GET", lambda i: (
+            f"{prefix}/garages/dailyAvailabilityReport?garageId={busy_garage()}"
+            f"&startDate={last_day - timedelta(days=365)}&endDate={last_day}", None,
+        )),
+        Endpoint("availabilityMatrix 1 year", "GET", lambda i: (
+            f"{prefix}/garages/availabilityMatrix?startDate={last_day - timedelta(days=365)}&endDate={last_day}", None,
+        )),
+        Endpoint("availabilityMatrix?city 1 year", "GET", lambda i: (
+            f"{prefix}/garages/availabilityMatrix?city={rng.choice(fixtures['cities'])}"
+            f"&startDate={last_day - timedelta(days=365)}&endDate={last_day}", None,
+        )),
+        Endpoint("nextAvailable", "GET", lambda i: (
+            f"{prefix}/garages/nextAvailable?startDate={last_day - timedelta(days=rng.randint(0, 365))}&count=3", None,
+        )),
+        Endpoint("monthlyRequestsReport 1 year", "GET", lambda i: (
+            f"{prefix}/maintenance/monthlyRequestsReport?garageId={busy_garage()}"
+            f"&startMonth={last_day.year}-01&endMonth={last_day.year}-12", None,
+        )),
+        Endpoint("monthlyRequestsReport 5 years", "GET", lambda i: (
+            f"{prefix}/maintenance/monthlyRequestsReport?garageId={busy_garage()}"
+            f"&startMonth={last_day.year - 4}-01&endMonth={last_day.year}-12", None,
+        )),
+        Endpoint("search_cars?q=make", "GET", lambda i: (f"{prefix}/cars/search?q={rng.choice(fixtures['makes'])[:4]}", None)),
+        Endpoint("search_cars?q=plate", "GET", lambda i: (f"{prefix}/cars/search?q={rng.randint(0, 9999):04d}", None)),
+        Endpoint("retrieve_car", "GET", lambda i: (f"{prefix}/cars/{car()}", None)),
+        Endpoint("retrieve_garage", "GET", lambda i: (f"{prefix}/garages/{garage()}", None)),
+        Endpoint("get_maintenance", "GET", lambda i: (f"{prefix}/maintenance/{maintenance()}", None)),
+    ]
+    return endpoints
+
+
+def build_write_endpoints(fixtures: dict, seed: int, created: dict, prefix: str = "") -> list[Endpoint]:
+    """
+    POST, PUT and DELETE endpoints. The PUT and DELETE requests work on the rows created by the POST
+    requests, so a benchmark run leaves the dataset as it found it.
+    """
+    rng = random.Random(seed)
+    links = fixtures["links"]
+    last_day = fixtures["last_day"]
+
+    def maintenance_body():
+        car_id, garage_id = rng.choice(links)
+        return {
+            "carId": car_id, "garageId": garage_id, "serviceType": "Benchmark",
+            "scheduledDate": str(last_day - timedelta(days=rng.randint(0, 365))),
+        }
+
+    def garage_body(i):
+        return {"city": "Benchmark", "location": "Benchmark", "name": f"Benchmark{i}", "capacity": 10}
+
+    def car_body(i, tag):
+        return {
+            "make": "Benchmark", "model": "Benchmark", "productionYear": 2020,
+            "licensePlate": f"BENCH{tag}{seed}-{i}", "garageIds": [rng.randint(1, fixtures["garages"])],
+        }
+
+    created_id = lambda kind, i: created[kind][i % len(created[kind])]
+    return [
+        Endpoint("post_maintenance", "POST", lambda i: (f"{prefix}/maintenance/", maintenance_body())),
+        Endpoint("update_maintenance", "PUT", lambda i: (
+            f"{prefix}/maintenance/{created_id('post_maintenance', i)}", maintenance_body()
+        )),
+        Endpoint("delete_maintenance", "DELETE", lambda i: (f"{prefix}/maintenance/{created_id('post_maintenance', i)}", None)),
+        Endpoint("create_garage", "POST", lambda i: (f"{prefix}/garages/", garage_body(i))),
+        Endpoint("update_garage", "PUT", lambda i: (f"{prefix}/garages/{created_id('create_garage', i)}", garage_body(i))),
+        Endpoint("create_car", "POST", lambda i: (f"{prefix}/cars/", car_body(i, "C"))),
+        Endpoint("update_car", "PUT", lambda i: (f"{prefix}/cars/{created_id('create_car', i)}", car_body(i, "U"))),
+        Endpoint("delete_car", "DELETE", lambda i: (f"{prefix}/cars/{created_id('create_car', i)}", None)),
+        Endpoint("remove_garage", "DELETE", lambda i: (f"{prefix}/garages/{created_id('create_garage', i)}", None)),
+    ]
+
+
+class Runner:
+    def __init__(self, client, engines=(), profile=True):
+        self.client = client
+        self.engines = engines
+        self.profile = profile
+
+    def send(self, endpoint: Endpoint, i: int):
+        url, body = endpoint.request(i)
+        return self.client.request(endpoint.method, url, json=body)
+
+    def measure(self, endpoint: Endpoint, requests: int, concurrency: int, start_index: int = 0) -> dict:
+        latencies = []
+        errors = 0
+        responses = []
+
+        def timed(i):
+            started = time.perf_counter()
+            response = self.send(endpoint, i)
+            return time.perf_counter() - started, response
+
+        started = time.perf_counter()
+        if concurrency == 1:
+            results = [timed(start_index + i) for i in range(requests)]
+        else:
+            # Deletes consume ids, each index has to be sent exactly once
+            with ThreadPoolExecutor(concurrency) as pool:
+                results = list(pool.map(timed, range(start_index, start_index + requests)))
+        elapsed = time.perf_counter() - started
+
+        for latency, response in results:
+            latencies.append(latency * 1000)
+            responses.append(response)
+            if response.status_code >= 400:
+                errors += 1
+
+        result = {
+            "requests": requests,
+            "errors": errors,
+            "throughput_rps": round(requests / elapsed, 1),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "response_bytes": round(statistics.fmean(len(r.content) for r in responses)),
+        }
+        return result, responses
+
+    def profile_one(self, endpoint: Endpoint, i: int) -> dict:
+        """SQL statements and peak traced memory of a single request."""
+        from query_counter import count_queries
+
+        if not self.profile:
+            return {}
+        counters = []
+        contexts = [count_queries(engine) for engine in self.engines]
+        for context in contexts:
+            counters.append(context.__enter__())
+        tracemalloc.start()
+        try:
+            response = self.send(endpoint, i)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            for context in contexts:
+                context.__exit__(None, None, None)
+        return {
+            "sql_statements": sum(counter.count for counter in counters),
+            "peak_memory_kb": round(peak / 1024, 1),
+            "profile_status": response.status_code,
+        }
+
+
+def run(args) -> dict:
+    from populateDB import ensure_dataset
+
+    params = dict(garages=args.garages, cars=args.cars, maintenances=args.maintenances, seed=args.seed)
+    started = time.perf_counter()
+    built = ensure_dataset(args.database, **params)
+    print(f"Dataset {args.database} {'built' if built else 'reused'} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    if args.url:
+        import httpx
+
+        client = httpx.Client(base_url=args.url, timeout=60)
+        runner = Runner(client, profile=False)
+    else:
+        from fastapi.testclient import TestClient
+
+        from constants import async_engine, async_read_engine, engine, read_engine
+        from main import app
+
+        client = TestClient(app)
+        # Without a separate reader the read engines are the writers, each is counted once
+        engines = dict.fromkeys((engine, async_engine.sync_engine, read_engine, async_read_engine.sync_engine))
+        runner = Runner(client, engines=tuple(engines))
+
+    prefix = "/async" if args.use_async else ""
+    fixtures = load_fixtures(args.database, args.seed)
+    selected = lambda endpoint: not args.only or any(part in endpoint.name for part in args.only)
+    results = {}
+
+    for endpoint in filter(selected, build_endpoints(fixtures, args.seed, prefix)):
+        for i in range(args.warmup):
+            runner.send(endpoint, i)
+        result, _ = runner.measure(endpoint, args.requests, args.concurrency)
+        result.update(runner.profile_one(endpoint, args.requests))
+        results[endpoint.name] = result
+        print(f"{endpoint.name:55} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+              f"{result['throughput_rps']:8.1f} req/s  sql {result.get('sql_statements', '-')}", file=sys.stderr)
+
+    if args.writes:
+        created = {}
+        for endpoint in filter(selected, build_write_endpoints(fixtures, args.seed, created, prefix)):
+            # The profiled request goes first so deletes still have an id left to consume
+            profile = runner.profile_one(endpoint, 0) if endpoint.method == "POST" else {}
+            result, responses = runner.measure(endpoint, args.requests, args.concurrency, start_index=1)
+            if endpoint.method == "POST":
+                created[endpoint.name] = [r.json()["id"] for r in responses if r.status_code < 400]
+            elif endpoint.method == "PUT":
+                profile = runner.profile_one(endpoint, 0)
+            result.update(profile)
+            results[endpoint.name] = result
+            print(f"{endpoint.name:55} p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                  f"{result['throughput_rps']:8.1f} req/s  errors {result['errors']}", file=sys.stderr)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "dataset": {**params, "database": args.database},
+            "target": args.url or "in-process",
+            "async": args.use_async,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "endpoints": results,
+    }
+
+
+# metric -> the direction in which a change is a regression
+COMPARED_METRICS = {
+    "p50_ms": "higher",
+    "p95_ms": "higher",
+    "p99_ms": "higher",
+    "throughput_rps": "lower",
+    "peak_memory_kb": "higher",
+    "sql_statements": "higher",
+}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Lists the metrics of `current` that regressed by more than `threshold` against `baseline`."""
+    regressions = []
+    for name, old in baseline["endpoints"].items():
+        new = current["endpoints"].get(name)
+        if new is None:
+            continue
+        if new.get("errors", 0) > old.get("errors", 0):
+            regressions.append(f"{name}: errors {old.get('errors', 0)} -> {new['errors']}")
+        for metric, worse in COMPARED_METRICS.items():
+            if metric not in old or metric not in new:
+                continue
+            before, after = old[metric], new[metric]
+            if metric == "sql_statements":
+                # Statement counts are deterministic, any growth is a regression
+                regressed = after > before
+            elif worse == "higher":
+                regressed = after > before * (1 + threshold)
+            else:
+                regressed = after < before * (1 - threshold)
+            if regressed:
+                regressions.append(f"{name}: {metric} {before} -> {after}")
+    return regressions
+
+
+def print_regressions(regressions: list[str]) -> int:
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Benchmark every endpoint")
+    run_parser.add_argument("--database", default="dataset.db", help="Dataset file, generated if missing")
+    run_parser.add_argument("--garages", type=int, default=1000)
+    run_parser.add_argument("--cars", type=int, default=100_000)
+    run_parser.add_argument("--maintenances", type=int, default=2_000_000)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--requests", type=int, default=200, help="Timed requests per endpoint")
+    run_parser.add_argument("--warmup", type=int, default=10, help="Untimed requests per endpoint")
+    run_parser.add_argument("--concurrency", type=int, default=1, help="Client threads sending requests")
+    run_parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    run_parser.add_argument("--async", dest="use_async", action="store_true", help="Use the /async routers")
+    run_parser.add_argument("--no-writes", dest="writes", action="store_false", help="Skip POST/PUT/DELETE")
+    run_parser.add_argument("--only", nargs="*", help="Only endpoints whose name contains one of these")
+    run_parser.add_argument("--output", help="Write the results as JSON to this file")
+    run_parser.add_argument("--baseline", help="Compare the results against this earlier JSON output")
+    run_parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown")
+
+    compare_parser = commands.add_parser("compare", help="Compare two JSON outputs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as baseline, open(args.current) as current:
+            raise SystemExit(print_regressions(compare(json.load(baseline), json.load(current), args.threshold)))
+
+    # The app binds its engine at import time, point it at the dataset first
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.database)}"
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            raise SystemExit(print_regressions(compare(json.load(baseline), results, args.threshold)))
+
+
+if __name__ == "__main__":
+    main()
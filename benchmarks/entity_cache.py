@@ -0,0 +1,108 @@
+"""
+Booking throughput with and without the entity cache.
+
+    python -m benchmarks.entity_cache --database dataset.db --requests 2000 --concurrency 4
+
+Two processes, one with ENTITY_CACHE_ENABLED=0 and one with ENTITY_CACHE_ENABLED=1 (the flag is
+read at import time), each book the same seeded maintenances through POST /maintenance and POST
+/async/maintenance on their own copy of the dataset. Throughput, latencies, SQL statements per
+booking and the hit rate of the cache are printed. Both runs must answer every request with the
+same status, otherwise the exit status is 1.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.endpoints import Runner, build_write_endpoints, load_fixtures
+
+
+def dump(args):
+    """Child process: books the maintenances and writes the results to args.output."""
+    from fastapi.testclient import TestClient
+
+    from constants import async_engine, engine
+    from entity_cache import entity_cache
+    from main import app
+    from migrations import run_migrations
+    from query_counter import count_queries
+
+    run_migrations(engine)
+    fixtures = load_fixtures(args.database, args.seed)
+    results = {}
+    # One event loop for every request, the pooled aiosqlite connections cannot move between loops
+    with TestClient(app) as client:
+        runner = Runner(client, profile=False)
+        for prefix in ("", "/async"):
+            post = build_write_endpoints(fixtures, args.seed, {}, prefix)[0]
+            with count_queries(engine) as sync_queries, count_queries(async_engine.sync_engine) as async_queries:
+                result, responses = runner.measure(post, args.requests, args.concurrency)
+            results[f"POST {prefix}/maintenance"] = {
+                **result,
+                "sql_statements": round((sync_queries.count + async_queries.count) / args.requests, 2),
+                "statuses": [response.status_code for response in responses],
+            }
+    results["cache"] = entity_cache.stats()
+    with open(args.output, "w") as output:
+        json.dump(results, output)
+
+
+def run_child(args, enabled: bool) -> dict:
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "entity_cache.db")
+    shutil.copyfile(args.database, database)
+    path = os.path.join(directory, "results.json")
+    env = {
+        **os.environ,
+        "ENTITY_CACHE_ENABLED": "1" if enabled else "0",
+        "DATABASE_URL": f"sqlite:///{database}",
+        "METRICS_ENABLED": "0",
+    }
+    command = [
+        sys.executable, "-m", "benchmarks.entity_cache", "--dump", path, "--database", database,
+        "--seed", str(args.seed), "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+    ]
+    try:
+        subprocess.run(command, env=env, check=True)
+        with open(path) as output:
+            return json.load(output)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=2000, help="Bookings per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dump", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dump:
+        args.output = args.dump
+        return dump(args)
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+
+    uncached, cached = run_child(args, enabled=False), run_child(args, enabled=True)
+    different = 0
+    for name, result in uncached.items():
+        if name == "cache":
+            continue
+        with_cache = cached[name]
+        different += sum(a != b for a, b in zip(result["statuses"], with_cache["statuses"]))
+        for label, run in (("without cache", result), ("with cache", with_cache)):
+            print(f"{name:24} {label:14} {run['throughput_rps']:8.1f} bookings/s  p50 {run['p50_ms']:7.2f}ms  "
+                  f"p99 {run['p99_ms']:7.2f}ms  {run['sql_statements']} SQL statements per booking")
+    print(f"Entity cache: {cached['cache']}")
+    print(f"{different} bookings answered differently")
+    raise SystemExit(1 if different else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Checks that the list and detail endpoints issue the same number of SQL statements for any number of rows.
+
+    python -m benchmarks.query_counts --database dataset.db --small 10 --large 100
+    FAST_SERIALIZATION=1 python -m benchmarks.query_counts --database dataset.db
+
+On a copy of the dataset with the response cache off, GET /cars/ and GET /maintenance/ of the
+sync and async routers are requested with limit=--small, then with limit=--large. GET /cars/{id}
+is requested for a car registered at one garage, then at --garages garages. Every pair goes
+through query_counter.assert_constant_query_count: a statement count that grows with the rows,
+an N+1 query, is printed with its statements and the exit status is 1. The maintenance and garage
+details embed no list and are not checked.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--small", type=int, default=10, help="Page size of the first request")
+    parser.add_argument("--large", type=int, default=100, help="Page size of the second request")
+    parser.add_argument("--garages", type=int, default=5, help="Garages of the car of the second detail request")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "query_counts.db")
+    shutil.copyfile(args.database, database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+
+    try:
+        from fastapi.testclient import TestClient
+
+        from constants import FAST_SERIALIZATION, async_read_engine, engine, read_engine
+        from main import app
+        from migrations import run_migrations
+        from query_counter import assert_constant_query_count
+
+        run_migrations(engine)
+        failures = 0
+        with TestClient(app) as client:
+            garage_ids = [garage["id"] for garage in client.get(f"/garages/?limit={args.garages}").json()]
+            car = client.get("/cars/?limit=1").json()[0]
+            body = {key: car[key] for key in ("make", "model", "productionYear", "licensePlate")}
+
+            for prefix, read in (("", read_engine), ("/async", async_read_engine.sync_engine)):
+                checks = []
+                for url in (f"{prefix}/cars/?limit=", f"{prefix}/maintenance/?limit="):
+                    page_size = {"limit": args.small}
+
+                    def run(url=url, page_size=page_size):
+                        return len(client.get(f"{url}{page_size['limit']}").json())
+
+                    def grow(page_size=page_size):
+                        page_size["limit"] = args.large
+
+                    checks.append((url + "N", run, grow))
+
+                client.put(f"/cars/{car['id']}", json={**body, "garageIds": garage_ids[:1]}).raise_for_status()
+
+                def run_detail(prefix=prefix):
+                    return len(client.get(f"{prefix}/cars/{car['id']}").json()["garages"])
+
+                def add_garages():
+                    client.put(f"/cars/{car['id']}", json={**body, "garageIds": garage_ids}).raise_for_status()
+
+                checks.append((f"{prefix}/cars/{{id}}", run_detail, add_garages))
+
+                for name, run, grow in checks:
+                    try:
+                        count = assert_constant_query_count(read, run, grow)
+                        print(f"GET {name:28} {count} SQL statements")
+                    except AssertionError as error:
+                        failures += 1
+                        print(f"GET {name:28} {error}")
+        print(f"FAST_SERIALIZATION={int(FAST_SERIALIZATION)}, {failures} endpoints with N+1 queries")
+        raise SystemExit(1 if failures else 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Read throughput against the number of uvicorn workers, while maintenances keep being booked.
+
+    python -m benchmarks.read_scaling --database dataset.db --workers 1 2 4 --seconds 20
+
+For every worker count a uvicorn server is started on a copy of the dataset (the response cache is
+off, every read reaches SQLite). Reader threads send the GET endpoints of benchmarks.endpoints in a
+loop, one writer thread books a maintenance and deletes it again, for --seconds. Read and write
+requests per second are printed per worker count; any failed read or write exits with status 1.
+
+Reads only scale with workers up to the number of CPU cores of the machine.
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import count
+
+from benchmarks.endpoints import build_endpoints, build_write_endpoints, load_fixtures
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(database: str, workers: int, port: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.abspath(database)}",
+        "RESPONSE_CACHE_ENABLED": "0",
+        "REQUEST_LOG_ENABLED": "0",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env, stderr=subprocess.DEVNULL,
+    )
+    import httpx
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/info").status_code == 200:
+                return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("The server did not start")
+
+
+def measure(url: str, fixtures: dict, args) -> dict:
+    import httpx
+
+    reads = [endpoint for endpoint in build_endpoints(fixtures, args.seed) if endpoint.method == "GET"]
+    post = build_write_endpoints(fixtures, args.seed, {})[0]
+    stop = threading.Event()
+    totals = {"reads": 0, "read_errors": 0, "writes": 0, "write_errors": 0}
+    lock = threading.Lock()
+
+    def reader(index: int):
+        client = httpx.Client(base_url=url, timeout=60)
+        done = errors = 0
+        for i in count(index):
+            if stop.is_set():
+                break
+            endpoint = reads[i % len(reads)]
+            read_url, _ = endpoint.request(i)
+            errors += client.get(read_url).status_code >= 400
+            done += 1
+        with lock:
+            totals["reads"] += done
+            totals["read_errors"] += errors
+
+    def writer():
+        client = httpx.Client(base_url=url, timeout=60)
+        done = errors = 0
+        for i in count():
+            if stop.is_set():
+                break
+            post_url, body = post.request(i)
+            response = client.post(post_url, json=body)
+            done += 1
+            # A full day answers 409, that is a booking decision and not a failure
+            if response.status_code == 200:
+                errors += client.delete(f"/maintenance/{response.json()['id']}").status_code >= 400
+                done += 1
+            elif response.status_code != 409:
+                errors += 1
+        with lock:
+            totals["writes"] += done
+            totals["write_errors"] += errors
+
+    threads = [threading.Thread(target=reader, args=(i * 1000,)) for i in range(args.readers)]
+    threads.append(threading.Thread(target=writer))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {**totals, "read_rps": totals["reads"] / elapsed, "write_rps": totals["writes"] / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--readers", type=int, default=16, help="Client threads sending GET requests")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    fixtures = load_fixtures(args.database, args.seed)
+    print(f"{os.cpu_count()} CPUs, {args.readers} reader threads, 1 writer thread, {args.seconds:.0f}s per run")
+
+    failures = 0
+    baseline = None
+    for workers in args.workers:
+        directory = tempfile.mkdtemp()
+        database = os.path.join(directory, "read_scaling.db")
+        shutil.copyfile(args.database, database)
+        port = free_port()
+        server = start_server(database, workers, port)
+        try:
+            result = measure(f"http://127.0.0.1:{port}", fixtures, args)
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(directory, ignore_errors=True)
+        baseline = baseline or result["read_rps"]
+        failures += result["read_errors"] + result["write_errors"]
+        print(f"{workers:2} workers  reads {result['read_rps']:8.1f} req/s (x{result['read_rps'] / baseline:4.2f}, "
+              f"{result['read_errors']} errors)  writes {result['write_rps']:7.1f} req/s ({result['write_errors']} errors)")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
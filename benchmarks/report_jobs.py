@@ -0,0 +1,91 @@
+"""
+A fleet report as a job on the process pool, against looping over the garages in requests.
+
+    python -m benchmarks.report_jobs --database dataset.db --processes 4 --start 2016-01-01 --end 2025-12-31
+
+On a copy of the dataset the monthly report of every garage is requested one garage after the
+other from GET /maintenance/monthlyRequestsReport, as clients built fleet reports before, then
+submitted as one fleet job to POST /reports/jobs with REPORT_JOB_PROCESSES=--processes and polled
+until it is done. Both times are printed. Every garage of the job result must equal its GET
+response, and a second submission of the running job must return the same job, otherwise the
+exit status is 1.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="REPORT_JOB_PROCESSES for this run")
+    parser.add_argument("--start", default="2016-01-01", help="First day of the report, the first of a month")
+    parser.add_argument("--end", default="2025-12-31", help="Last day of the report, the last of a month")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, "report_jobs.db")
+    shutil.copyfile(args.database, database)
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    os.environ["REPORT_JOB_PROCESSES"] = str(args.processes)
+    os.environ["REPORT_JOB_DIR"] = os.path.join(directory, "results")
+
+    try:
+        from fastapi.testclient import TestClient
+
+        from constants import engine
+        from main import app
+        from migrations import run_migrations
+
+        run_migrations(engine)
+        client = TestClient(app)
+        garages = []
+        url = "/garages/?limit=1000"
+        while url:
+            response = client.get(url)
+            garages += response.json()
+            after = response.headers.get("X-Next-Cursor")
+            url = f"/garages/?limit=1000&after={after}" if after else None
+
+        started = time.perf_counter()
+        expected = {
+            garage["id"]: client.get(
+                f"/maintenance/monthlyRequestsReport?garageId={garage['id']}&startMonth={args.start[:7]}&endMonth={args.end[:7]}"
+            ).json()
+            for garage in garages
+        }
+        loop_time = time.perf_counter() - started
+
+        body = {"report": "fleet", "startDate": args.start, "endDate": args.end}
+        started = time.perf_counter()
+        response = client.post("/reports/jobs/", json=body)
+        if response.status_code != 202:
+            raise SystemExit(f"POST /reports/jobs: {response.status_code} {response.text}")
+        job = response.json()
+        joined = client.post("/reports/jobs/", json=body).json()
+        while job["status"] == "running":
+            time.sleep(0.05)
+            job = client.get(f"/reports/jobs/{job['id']}").json()
+        result = client.get(f"/reports/jobs/{job['id']}/result")
+        job_time = time.perf_counter() - started
+
+        rows = result.json() if job["status"] == "done" else []
+        different = sum(row["months"] != expected.get(row["id"]) for row in rows) + len(expected) - len(rows)
+        print(f"{len(garages)} garages, {args.start} to {args.end}")
+        print(f"GET per garage:              {loop_time:8.2f}s")
+        print(f"Fleet job, {args.processes} processes:     {job_time:8.2f}s, {job['partitions']} partitions, "
+              f"{len(result.content) / 1024:.0f} KiB, status {job['status']}")
+        print(f"Second submission joined the running job: {joined['id'] == job['id']}")
+        print(f"Garages different from their GET report: {different}")
+        raise SystemExit(1 if different or joined["id"] != job["id"] or job["status"] != "done" else 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Checks that the numpy report engine gives the same results as the Python one, and how much faster it is.
+
+    python -m benchmarks.reports --rows 10000000 --garages 1000 --years 5
+    python -m benchmarks.reports --database dataset.db
+
+Both engines get the same maintenances, synthetic ones (one group per maintenance) or the groups of
+--database, and compute every report of the /reports router over the whole range. Results must be
+equal, utilization values within 1e-9, any difference exits with status 1.
+"""
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import numpy
+
+SERVICE_TYPES = ["Air conditioning", "Bodywork", "Brakes", "Diagnostics", "Maintenance", "Oil change", "Tyre change", "Yearly checkup"]
+
+
+def synthetic_data(rows: int, garages: int, start_date: date, days: int, seed: int):
+    """Uniformly spread maintenances, as numpy MaintenanceData and as its Python lists copy."""
+    from report_engines import MaintenanceData
+
+    rng = numpy.random.default_rng(seed)
+    arrays = MaintenanceData(
+        garage_ids=rng.integers(1, garages + 1, rows, dtype=numpy.int32),
+        days=(rng.integers(0, days, rows) + start_date.toordinal()).astype(numpy.int32),
+        services=rng.integers(0, len(SERVICE_TYPES), rows, dtype=numpy.int16),
+        counts=numpy.ones(rows, dtype=numpy.int32),
+        service_types=list(SERVICE_TYPES),
+    )
+    lists = MaintenanceData(
+        arrays.garage_ids.tolist(), arrays.days.tolist(), arrays.services.tolist(), arrays.counts.tolist(), list(SERVICE_TYPES)
+    )
+    capacities = {garage_id: int(capacity) for garage_id, capacity in enumerate(rng.integers(0, 40, garages), start=1)}
+    return {"numpy": arrays, "python": lists}, capacities
+
+
+def database_data(database: str):
+    """The snapshot of `database` prepared by each engine, and its garage capacities."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+    from sqlalchemy import select
+
+    from constants import session
+    from models import Garage
+    from report_engines import NumpyReportEngine, PythonReportEngine, load_maintenance_groups
+
+    with session() as db:
+        started = time.perf_counter()
+        batches = list(load_maintenance_groups(db))
+        print(f"Loaded {sum(map(len, batches))} groups in {time.perf_counter() - started:.2f}s")
+        data = {}
+        for engine in (PythonReportEngine(), NumpyReportEngine()):
+            started = time.perf_counter()
+            data[engine.name] = engine.prepare(batches)
+            print(f"Prepared by {engine.name} in {time.perf_counter() - started:.2f}s")
+        capacities = dict(db.execute(select(Garage.id, Garage.capacity)).all())
+    days = data["numpy"].days
+    return data, capacities, date.fromordinal(int(days.min())), date.fromordinal(int(days.max()))
+
+
+def same(a, b) -> bool:
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and abs(a - b) <= 1e-9
+    return a == b
+
+
+def timed(function, *args, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Synthetic maintenances")
+    parser.add_argument("--garages", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per report, the fastest counts")
+    parser.add_argument("--database", help="Use the maintenances of this dataset instead")
+    args = parser.parse_args()
+
+    from report_engines import DEFAULT_PERCENTILES, NumpyReportEngine, PythonReportEngine
+
+    if args.database:
+        data, capacities, start_date, end_date = database_data(args.database)
+    else:
+        start_date = date(2020, 1, 1)
+        end_date = start_date + timedelta(days=365 * args.years - 1)
+        data, capacities = synthetic_data(args.rows, args.garages, start_date, (end_date - start_date).days + 1, args.seed)
+        print(f"{args.rows} synthetic maintenances, {args.garages} garages, {start_date} to {end_date}")
+
+    some_garages = set(list(capacities)[:10])
+    reports = [
+        ("daily", "daily", (start_date, end_date)),
+        ("daily 10 garages", "daily", (start_date, end_date, some_garages)),
+        ("monthly", "monthly", (start_date, end_date)),
+        ("utilization", "utilization", (capacities, start_date, end_date)),
+        ("utilizationPercentiles", "utilization_percentiles", (capacities, start_date, end_date, DEFAULT_PERCENTILES)),
+    ]
+    engines = {"python": PythonReportEngine(), "numpy": NumpyReportEngine()}
+    differences = 0
+    for name, method, report_args in reports:
+        python_time, python_result = timed(getattr(engines["python"], method), data["python"], *report_args, repeat=args.repeat)
+        numpy_time, numpy_result = timed(getattr(engines["numpy"], method), data["numpy"], *report_args, repeat=args.repeat)
+        equal = same(python_result, numpy_result)
+        differences += not equal
+        print(f"{name:25} python {python_time * 1000:9.1f}ms  numpy {numpy_time * 1000:8.1f}ms  "
+              f"x{python_time / numpy_time:6.1f}  {'identical' if equal else 'DIFFERENT'}")
+    print(f"{differences} reports differ")
+    raise SystemExit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
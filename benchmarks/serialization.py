@@ -0,0 +1,109 @@
+"""
+Checks that FAST_SERIALIZATION returns byte-identical responses, and how much faster it is.
+
+    python -m benchmarks.serialization --database dataset.db --limit 1000
+
+Every GET endpoint of benchmarks.endpoints is sent the same seeded requests by two processes, one
+with FAST_SERIALIZATION=0 and one with FAST_SERIALIZATION=1 (the flag is read at import time).
+Response bodies and X-Next-Cursor headers must match exactly, any difference exits with status 1.
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.endpoints import Runner, build_endpoints, load_fixtures
+
+
+def with_limit(request, limit: int):
+    def limited(i):
+        url, body = request(i)
+        return url + ("&" if "?" in url else "?") + f"limit={limit}", body
+    return limited
+
+
+def dump(args):
+    """Child process: sends the requests and writes latencies and response digests to args.output."""
+    from fastapi.testclient import TestClient
+
+    from main import app
+    from routes.pagination import NEXT_CURSOR_HEADER
+
+    runner = Runner(TestClient(app), profile=False)
+    fixtures = load_fixtures(args.database, args.seed)
+    results = {}
+    for endpoint in build_endpoints(fixtures, args.seed):
+        if endpoint.method != "GET":
+            continue
+        endpoint.request = with_limit(endpoint.request, args.limit)
+        result, responses = runner.measure(endpoint, args.requests, concurrency=1)
+        results[endpoint.name] = {
+            "p50_ms": result["p50_ms"],
+            "response_bytes": result["response_bytes"],
+            "digests": [
+                hashlib.blake2b(
+                    f"{r.status_code} {r.headers.get(NEXT_CURSOR_HEADER)} ".encode() + r.content, digest_size=16
+                ).hexdigest()
+                for r in responses
+            ],
+        }
+    with open(args.output, "w") as output:
+        json.dump(results, output)
+
+
+def run_child(args, fast: bool) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as output:
+        path = output.name
+    env = {
+        **os.environ,
+        "FAST_SERIALIZATION": "1" if fast else "0",
+        # Reports would be answered from the cache after the first request
+        "RESPONSE_CACHE_ENABLED": "0",
+        "DATABASE_URL": f"sqlite:///{os.path.abspath(args.database)}",
+    }
+    command = [
+        sys.executable, "-m", "benchmarks.serialization", "--dump", path, "--database", args.database,
+        "--seed", str(args.seed), "--requests", str(args.requests), "--limit", str(args.limit),
+    ]
+    try:
+        subprocess.run(command, env=env, check=True)
+        with open(path) as output:
+            return json.load(output)
+    finally:
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="dataset.db", help="Dataset file, see populateDB.py")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint")
+    parser.add_argument("--limit", type=int, default=1000, help="Page size of the list endpoints")
+    parser.add_argument("--dump", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.dump:
+        args.output = args.dump
+        return dump(args)
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} does not exist, generate it with populateDB.py first")
+
+    default, fast = run_child(args, fast=False), run_child(args, fast=True)
+    mismatches = 0
+    for name, result in default.items():
+        fast_result = fast[name]
+        different = sum(a != b for a, b in zip(result["digests"], fast_result["digests"]))
+        mismatches += different
+        speedup = result["p50_ms"] / fast_result["p50_ms"] if fast_result["p50_ms"] else float("inf")
+        print(f"{name:50} p50 {result['p50_ms']:8.2f}ms -> {fast_result['p50_ms']:8.2f}ms  x{speedup:5.2f}  "
+              f"{result['response_bytes']:8} bytes  {'identical' if not different else f'{different} DIFFERENT'}")
+    print(f"{mismatches} responses differ")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Startup time of the application: importing main, and starting a worker until its first response.
+
+    python -m benchmarks.startup --runs 5 --output startup.json
+    python -m benchmarks.startup --baseline startup.json
+
+Every run is a fresh process on a migrated temporary database. "import main" is the time the import
+takes inside the process, "first request" the time from spawning uvicorn (one worker, the prestart
+step skipped) until it answers GET /garages/ and "first report" the same until GET /reports/monthly.
+The output has the format of benchmarks.endpoints, its compare command works on it too.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.endpoints import compare, print_regressions
+from benchmarks.read_scaling import free_port
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def time_import(env: dict) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def time_first_response(env: dict, path: str) -> float:
+    import httpx
+
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--skip-prestart", "--workers", "1", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}{path}", timeout=60).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                time.sleep(0.01)
+        raise SystemExit(f"No response to {path} within 60s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summary(values: list[float]) -> dict:
+    milliseconds = [value * 1000 for value in values]
+    return {
+        "runs": len(values),
+        "p50_ms": round(statistics.median(milliseconds), 3),
+        "min_ms": round(min(milliseconds), 3),
+        "max_ms": round(max(milliseconds), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare the results against this earlier JSON output")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'startup.db')}"}
+        subprocess.run([sys.executable, "migrations.py", "upgrade"], env=env, check=True, stdout=subprocess.DEVNULL)
+        timings = {"import main": [], "first request": [], "first report": []}
+        for _ in range(args.runs):
+            timings["import main"].append(time_import(env))
+            timings["first request"].append(time_first_response(env, "/garages/"))
+            timings["first report"].append(time_first_response(env, "/reports/monthly?startDate=2024-01-01&endDate=2024-12-31"))
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "runs": args.runs,
+        },
+        "endpoints": {name: summary(values) for name, values in timings.items()},
+    }
+    for name, result in results["endpoints"].items():
+        print(f"{name:15} p50 {result['p50_ms']:8.1f}ms  min {result['min_ms']:8.1f}ms  max {result['max_ms']:8.1f}ms",
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            raise SystemExit(print_regressions(compare(json.load(baseline), results, args.threshold)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Awaitable, Callable
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from changes import CAR, CREATED, GARAGE, MAINTENANCE, latest_change
+from constants import (
+    FAST_SERIALIZATION, RESPONSE_CACHE_CHECK_SECONDS, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_SHARED, RESPONSE_CACHE_TTL, read_session,
+)
+from entity_cache import entity_cache
+from models import ChangeLog, Maintenance
+from serialization import dumps
+
+TAG_HISTORY_SIZE = 100_000
+
+# Changes read by one check of the other workers' writes, when more were written the cache is cleared
+CHANGE_BATCH_SIZE = 1000
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    expires_at: float
+    # tag -> (first day, last day) the entry covers, or None when any change of the tag affects it
+    tags: dict = field(default_factory=dict)
+
+
+@dataclass
+class CacheValue:
+    """What a cached handler produces: the JSON content and the tags that invalidate it."""
+    content: object
+    tags: dict
+
+
+class ResponseCache:
+    """
+    In-process LRU of rendered JSON responses, bounded by entry count, total bytes and TTL.
+
+    Entries are tagged, e.g. ("garage", 3) or ("occupancy", 3) with the date range of a report,
+    so a write only drops the entries it can change instead of flushing everything.
+
+    The write handlers drop the entries of this worker. With `shared`, the writes of the other
+    workers are followed through ChangeLog, see follow_changes: at most every `check_seconds` the
+    changes recorded since the last check are read and their tags invalidated before an entry is
+    served.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, check_seconds: float = 0, shared: bool = False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.check_seconds = check_seconds
+        self.shared = shared
+        # Id of the last ChangeLog row applied, None until the first check
+        self.change_id = None
+        self._checked_at = float("-inf")
+        self._entries: OrderedDict = OrderedDict()
+        self._by_tag: dict = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, each tag remembers the generation it was last invalidated at
+        self.generation = 0
+        self._tag_generations: dict = {}
+        self._forgotten_before = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key) -> CacheEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body: bytes, tags: dict, generation: int) -> CacheEntry:
+        """
+        Stores a rendered response.
+
+        `generation` is the value of self.generation read before the data was queried. If one of the
+        entry's tags was invalidated in between, the data may already be stale and is returned uncached.
+        """
+        entry = CacheEntry(body=body, etag=make_etag(body), expires_at=time.monotonic() + self.ttl, tags=tags)
+        with self._lock:
+            stale = generation < self._forgotten_before or any(
+                self._tag_generations.get(tag, 0) > generation for tag in tags
+            )
+            if stale or len(body) > self.max_bytes:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, tag, day: date | None = None):
+        """Drops the entries with `tag`, only those whose date range contains `day` when it is given."""
+        with self._lock:
+            self.generation += 1
+            self._tag_generations[tag] = self.generation
+            if len(self._tag_generations) > TAG_HISTORY_SIZE:
+                # Keep the history bounded, puts that started before this point are not cached
+                self._tag_generations.clear()
+                self._forgotten_before = self.generation
+            for key in list(self._by_tag.get(tag, ())):
+                covered = self._entries[key].tags[tag]
+                if day is None or covered is None or covered[0] <= day <= covered[1]:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_kind(self, kind: str):
+        """Drops every entry with a tag of `kind`, e.g. every report for "occupancy"."""
+        with self._lock:
+            self.generation += 1
+            # The tags of the puts in progress are unknown, none of them is cached
+            self._forgotten_before = self.generation
+            for tag in [tag for tag in self._by_tag if tag[0] == kind]:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def changes_due(self) -> bool:
+        """Whether the other workers' writes should be read now, claims the check for the caller."""
+        if not self.shared:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self.check_seconds:
+                return False
+            self._checked_at = now
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._tag_generations.clear()
+            self._forgotten_before = self.generation
+            self._entries.clear()
+            self._by_tag.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_CHECK_SECONDS,
+    RESPONSE_CACHE_SHARED,
+)
+
+
+def follow_changes():
+    """
+    Invalidates the tags of the changes recorded since the last check, by any worker.
+
+    A garage or car change drops its tag. A created maintenance drops its maintenance and the
+    reports of the day it is booked on. The garage and day a maintenance was moved from or deleted
+    on are no longer known, so an updated or deleted one drops every report. On SQLite the ids grow
+    in commit order, see changes.py, so no change is skipped.
+    """
+    with read_session() as db:
+        if response_cache.change_id is None:
+            response_cache.change_id = latest_change(db)
+            return
+        changes = db.execute(
+            select(ChangeLog.id, ChangeLog.entity, ChangeLog.entityId, ChangeLog.operation)
+            .where(ChangeLog.id > response_cache.change_id)
+            .order_by(ChangeLog.id)
+            .limit(CHANGE_BATCH_SIZE + 1)
+        ).all()
+        if len(changes) > CHANGE_BATCH_SIZE:
+            response_cache.change_id = latest_change(db)
+            response_cache.clear()
+            return
+        created = [change.entityId for change in changes if change.entity == MAINTENANCE and change.operation == CREATED]
+        bookings = {
+            row.id: (row.garageId, row.scheduledDate)
+            for row in db.execute(
+                select(Maintenance.id, Maintenance.garageId, Maintenance.scheduledDate).where(Maintenance.id.in_(created))
+            )
+        } if created else {}
+
+    for change in changes:
+        if change.entity in (GARAGE, CAR):
+            response_cache.invalidate((change.entity, change.entityId))
+        elif change.entityId in bookings and change.operation == CREATED:
+            response_cache.invalidate((MAINTENANCE, change.entityId))
+            invalidate_occupancy(*bookings[change.entityId])
+        else:
+            response_cache.invalidate((MAINTENANCE, change.entityId))
+            response_cache.invalidate_kind("occupancy")
+    if changes:
+        response_cache.change_id = changes[-1].id
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def render_json(content) -> bytes:
+    """Same bytes as fastapi.responses.JSONResponse.render."""
+    if FAST_SERIALIZATION:
+        return dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def uncached_entry(value: CacheValue) -> CacheEntry:
+    body = render_json(value.content)
+    return CacheEntry(body=body, etag=make_etag(body), expires_at=0, tags=value.tags)
+
+
+def etag_response(request: Request, entry: CacheEntry) -> Response:
+    """200 with the cached body, or 304 when the client already has this version."""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def cached_response(request: Request, key, build: Callable[[], CacheValue]) -> Response:
+    """
+    Serves `key` from the cache, calling `build` (which queries the database) only on a miss.
+
+    A matching If-None-Match on a cached entry is answered with 304 without touching the database,
+    except for the check of the other workers' writes every RESPONSE_CACHE_CHECK_SECONDS.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return etag_response(request, uncached_entry(build()))
+
+    if response_cache.changes_due():
+        follow_changes()
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        value = build()
+        entry = response_cache.put(key, render_json(value.content), value.tags, generation)
+    return etag_response(request, entry)
+
+
+async def cached_response_async(request: Request, key, build: Callable[[], Awaitable[CacheValue]]) -> Response:
+    """cached_response for the async routers, the cache itself is shared with the sync ones."""
+    if not RESPONSE_CACHE_ENABLED:
+        return etag_response(request, uncached_entry(await build()))
+
+    if response_cache.changes_due():
+        await run_in_threadpool(follow_changes)
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        value = await build()
+        entry = response_cache.put(key, render_json(value.content), value.tags, generation)
+    return etag_response(request, entry)
+
+
+# Invalidation hooks called by the write handlers after they commit
+
+def invalidate_occupancy(garage_id: int, day: date):
+    """A maintenance of the garage on `day` was created, moved or deleted."""
+    response_cache.invalidate(("occupancy", garage_id), day)
+
+
+def invalidate_occupancy_days(days):
+    """invalidate_occupancy for every (garageId, day) of a bulk write."""
+    for garage_id, day in days:
+        invalidate_occupancy(garage_id, day)
+
+
+def invalidate_garage(garage_id: int):
+    """The garage row changed: its reports (capacity), its cars and its maintenances (garageName)."""
+    response_cache.invalidate(("garage", garage_id))
+    entity_cache.invalidate(("garage", garage_id))
+
+
+def invalidate_car(car_id: int):
+    """The car row or its garages changed, this includes the carName of its maintenances."""
+    response_cache.invalidate(("car", car_id))
+    entity_cache.invalidate(("car", car_id))
+
+
+def invalidate_maintenance(maintenance_id: int):
+    response_cache.invalidate(("maintenance", maintenance_id))
+
+
+# Tags of the cached responses
+
+def report_tags(garage_id: int, start_date: date, end_date: date) -> dict:
+    return {("occupancy", garage_id): (start_date, end_date), ("garage", garage_id): None}
+
+
+def garage_tags(garage) -> dict:
+    return {("garage", garage.id): None}
+
+
+def car_tags(car) -> dict:
+    return {("car", car.id): None, **{("garage", garage.id): None for garage in car.garages}}
+
+
+def maintenance_tags(maintenance) -> dict:
+    return {
+        ("maintenance", maintenance.id): None,
+        ("car", maintenance.carId): None,
+        ("garage", maintenance.garageId): None,
+    }
@@ -0,0 +1,134 @@
+"""
+Substring search over the license plate, make and model of the cars.
+
+On SQLite the CarSearch FTS5 table indexes every trigram of the three columns, so a term matches
+anywhere inside them. Like the GarageOccupancy rollup it is kept in sync by the car routes, inside
+their transactions. Other databases scan the Car table with LIKE instead.
+
+bm25 has to score every match before the best ones are known, which takes ~100ms for a make that
+matches 70k cars, all with the same score. So results are ranked only when at most RANKED_MATCHES
+cars match, broader queries list their matches by id, which the index returns without sorting.
+The first page decides, the following ones keep its order: their cursor is the (rank, id) of the
+last row, the rank None for a search listed by id. A write between two pages can shift the ranks
+of the other matches, a page then repeats or skips the cars that moved across its cursor.
+"""
+from sqlalchemy import and_, column, delete, func, insert, or_, select, table
+from sqlalchemy.orm import Session
+
+from models import Car
+
+SEARCH_TABLE = "CarSearch"
+# The trigram tokenizer cannot match shorter terms
+MIN_TERM_LENGTH = 3
+# bm25 weights of licensePlate, make and model: a plate match ranks above a make match
+SEARCH_RANK = "bm25(10.0, 1.0, 2.0)"
+SEARCH_COLUMNS = (Car.licensePlate, Car.make, Car.model)
+RANKED_MATCHES = 1000
+# Key of the rank in the rows of a ranked search, for the cursor of the next page
+RANK_KEY = "searchRank"
+
+# The virtual table is created by the migration, it is not part of Base.metadata
+car_search = table(
+    SEARCH_TABLE, column("rowid"), column(SEARCH_TABLE), column("rank"),
+    column("licensePlate"), column("make"), column("model"),
+)
+
+
+def has_search_table(db) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def create_search_table(connection):
+    """Migration step creating the FTS5 table and indexing the existing cars."""
+    if connection.dialect.name != "sqlite":
+        return
+    connection.exec_driver_sql(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS "{SEARCH_TABLE}" '
+        "USING fts5(licensePlate, make, model, tokenize='trigram')"
+    )
+    connection.exec_driver_sql(f"""INSERT INTO "{SEARCH_TABLE}"("{SEARCH_TABLE}", rank) VALUES ('rank', '{SEARCH_RANK}')""")
+    refill_car_search(connection)
+
+
+def refill_car_search(connection):
+    """Rebuilds the whole index from the Car table, for bulk loads that bypass the routes."""
+    if connection.dialect.name != "sqlite":
+        return
+    connection.execute(delete(car_search))
+    connection.execute(insert(car_search).from_select(
+        ["rowid", "licensePlate", "make", "model"], select(Car.id, *SEARCH_COLUMNS)
+    ))
+
+
+def index_cars(db: Session, cars: list[dict]):
+    """(Re)indexes car rows with id, licensePlate, make and model, inside the caller's transaction."""
+    if not cars or not has_search_table(db):
+        return
+    unindex_cars(db, [car["id"] for car in cars])
+    db.execute(insert(car_search), [
+        {"rowid": car["id"], "licensePlate": car["licensePlate"], "make": car["make"], "model": car["model"]}
+        for car in cars
+    ])
+
+
+def index_car(db: Session, car: Car):
+    index_cars(db, [{"id": car.id, "licensePlate": car.licensePlate, "make": car.make, "model": car.model}])
+
+
+def unindex_cars(db: Session, car_ids: list[int]):
+    if car_ids and has_search_table(db):
+        db.execute(delete(car_search).where(car_search.c.rowid.in_(car_ids)))
+
+
+def search_terms(q: str) -> list[str]:
+    """The whitespace separated terms of `q` long enough to be searched."""
+    return [term for term in q.split() if len(term) >= MIN_TERM_LENGTH]
+
+
+def match_expression(terms: list[str]) -> str:
+    # Every term is an FTS5 string, a substring of any column, and all of them must match
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def like_pattern(term: str) -> str:
+    escaped = term.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def is_ranked(db: Session, terms: list[str]) -> bool:
+    """Whether a search for `terms` is ordered by rank, that is at most RANKED_MATCHES cars match."""
+    if not has_search_table(db):
+        return False
+    match = car_search.c[SEARCH_TABLE].match(match_expression(terms))
+    # Counting stops after RANKED_MATCHES + 1 matches, a few ms at most
+    probe = select(car_search.c.rowid).where(match).limit(RANKED_MATCHES + 1).subquery()
+    return db.scalar(select(func.count()).select_from(probe)) <= RANKED_MATCHES
+
+
+def match_cars(db: Session, statement, terms: list[str], ranked: bool, after: tuple | None = None):
+    """
+    Restricts a select() of Car columns to the cars matching all `terms`, after the (rank, id) `after`.
+
+    Ranked, the matches are ordered by (rank, id) and the rank is selected as RANK_KEY, otherwise
+    by id and the rank of `after` is None.
+    """
+    if has_search_table(db):
+        match = car_search.c[SEARCH_TABLE].match(match_expression(terms))
+        statement = statement.select_from(car_search).join(Car, Car.id == car_search.c.rowid).where(match)
+        if not ranked:
+            if after:
+                statement = statement.where(car_search.c.rowid > after[1])
+            return statement.order_by(car_search.c.rowid)
+        rank = car_search.c.rank
+        if after:
+            last_rank, last_id = after
+            statement = statement.where(or_(rank > last_rank, and_(rank == last_rank, car_search.c.rowid > last_id)))
+        return statement.add_columns(rank.label(RANK_KEY)).order_by(rank, car_search.c.rowid)
+
+    # Generic fallback, case-insensitive LIKE over the Car table, unranked
+    for term in terms:
+        pattern = like_pattern(term)
+        statement = statement.where(or_(*(func.lower(field).like(pattern, escape="\\") for field in SEARCH_COLUMNS)))
+    if after:
+        statement = statement.where(Car.id > after[1])
+    return statement.order_by(Car.id)
@@ -0,0 +1,100 @@
+"""
+Change feed of the garages, cars and maintenances, served by GET /changes.
+
+Every write endpoint records the rows it creates, updates or deletes in ChangeLog, inside its own
+transaction, so a change becomes visible together with the data. The ChangeLog ids must grow in
+commit order, so that a client that read up to an id has seen every change committed before it.
+SQLite serializes the writers. Other databases run transactions concurrently, one could commit
+id 11 while id 10 is still pending and a client reading 11 would never see 10. There
+record_changes first updates the CHANGE_LOCK row of EntityVersion, whose row lock is held until
+commit: the transactions that record changes take their ids and commit one after the other.
+
+Only the row itself is recorded: renaming a garage is one garage change, the cars and
+maintenances that embed its name are not repeated. Garage and car changes also bump the version
+stamp of the entity caches, see entity_cache.py. Archiving moves no visible data and is not
+recorded, and neither are the bulk loads of populateDB.py, clients list everything once first.
+
+    python changes.py prune --days 30
+    python changes.py status
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from constants import CHANGE_LOG_RETENTION_DAYS, engine
+from entity_cache import bump_version
+from models import ChangeLog
+
+GARAGE = "garage"
+CAR = "car"
+MAINTENANCE = "maintenance"
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# EntityVersion row serializing the writers of ChangeLog on databases other than SQLite
+CHANGE_LOCK = "changes"
+
+
+def record_changes(db: Session, entity: str, operation: str, entity_ids: list[int]):
+    """Adds a change of every id to the caller's transaction."""
+    if entity_ids:
+        if db.get_bind().dialect.name != "sqlite":
+            # Taken before the ids are, see the module docstring
+            bump_version(db, CHANGE_LOCK)
+        changed_at = datetime.now()
+        db.execute(insert(ChangeLog), [
+            {"entity": entity, "entityId": entity_id, "operation": operation, "changedAt": changed_at}
+            for entity_id in entity_ids
+        ])
+        if entity != MAINTENANCE:
+            bump_version(db)
+
+
+def record_change(db: Session, entity: str, operation: str, entity_id: int):
+    record_changes(db, entity, operation, [entity_id])
+
+
+def latest_change(db: Session) -> int:
+    return db.scalar(select(func.max(ChangeLog.id))) or 0
+
+
+def oldest_change(db: Session) -> int | None:
+    return db.scalar(select(func.min(ChangeLog.id)))
+
+
+def prune_changes(connection, before: datetime) -> int:
+    """
+    Deletes the changes recorded before `before`, returns how many.
+
+    The newest change is always kept, it tells GET /changes which cursors lost changes to pruning.
+    """
+    newest = connection.scalar(select(func.max(ChangeLog.id)))
+    if newest is None:
+        return 0
+    return connection.execute(delete(ChangeLog).where(ChangeLog.changedAt < before, ChangeLog.id < newest)).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune or inspect the change feed.")
+    parser.add_argument("command", choices=["prune", "status"])
+    parser.add_argument("--days", type=int, default=CHANGE_LOG_RETENTION_DAYS, help="Keep the changes of this many days")
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        with engine.begin() as connection:
+            pruned = prune_changes(connection, datetime.now() - timedelta(days=args.days))
+        print(f"Pruned {pruned} changes older than {args.days} days")
+    else:
+        with engine.connect() as connection:
+            oldest, newest, count = connection.execute(
+                select(func.min(ChangeLog.id), func.max(ChangeLog.id), func.count())
+            ).one()
+        print(f"{count} changes, ids {oldest} to {newest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
-from sqlalchemy import create_engine
+import os
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 MONTHS = {
     1: "JANUARY",
@@ -16,14 +22,222 @@ MONTHS = {
     12: "DECEMBER",
 }
 
-DATABASE_URL = "sqlite:///./database.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Database settings, every value can be overridden from the environment
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# The GET routes read through their own engine, see read_database_url. Set this to a replica for
+# backends other than SQLite, where the same file is opened read-only by default.
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+# Async drivers used for DATABASE_URL when ASYNC_DATABASE_URL is not set
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+# In-process cache of report and single item responses, see cache.py
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# With RESPONSE_CACHE_SHARED each worker reads the ChangeLog rows written since its last check at most
+# every RESPONSE_CACHE_CHECK_SECONDS and drops the responses they change, turn it off when a single
+# process serves the database.
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "1") == "1"
+RESPONSE_CACHE_CHECK_SECONDS = float(os.getenv("RESPONSE_CACHE_CHECK_SECONDS", "1"))
+
+# In-process cache of the garage and car rows of the booking checks, see entity_cache.py. With
+# ENTITY_CACHE_SHARED each worker reads the version stamp of the garage and car writes at most every
+# ENTITY_CACHE_CHECK_SECONDS, turn it off when a single process serves the database.
+ENTITY_CACHE_ENABLED = os.getenv("ENTITY_CACHE_ENABLED", "1") == "1"
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "100000"))
+ENTITY_CACHE_SHARED = os.getenv("ENTITY_CACHE_SHARED", "1") == "1"
+ENTITY_CACHE_CHECK_SECONDS = float(os.getenv("ENTITY_CACHE_CHECK_SECONDS", "1"))
+
+# List endpoints select plain columns and render them with orjson instead of hydrating ORM objects
+# and validating them into the response models. The JSON bytes are the same either way.
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "0") == "1"
+
+# Per-request instrumentation, see instrumentation.py
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+REQUEST_LOG_ENABLED = os.getenv("REQUEST_LOG_ENABLED", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Production server, see serve.py. Each worker is a separate process with its own engines and caches.
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8088"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1)))
+
+# Fleet-wide analytics of the /reports router, see report_engines.py. The maintenances are loaded at most
+# once per REPORT_SNAPSHOT_TTL seconds, the reports lag the writes by up to that long.
+REPORT_ENGINE = os.getenv("REPORT_ENGINE", "numpy")
+REPORT_SNAPSHOT_TTL = float(os.getenv("REPORT_SNAPSHOT_TTL", "300"))
+
+# Maintenances dated more than ARCHIVE_AFTER_DAYS ago are moved to MaintenanceArchive by archive.py,
+# ARCHIVE_BATCH_SIZE rows per short write transaction with a pause between batches for the other writers
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.05"))
+# Time between publishing a new cutoff and moving the first row, longer than any request takes
+ARCHIVE_GRACE_SECONDS = float(os.getenv("ARCHIVE_GRACE_SECONDS", "5"))
+
+# Deleting a garage or car purges its maintenances DELETE_CHUNK_SIZE rows per write transaction
+DELETE_CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "1000"))
+
+# `python changes.py prune` drops the change feed entries older than this
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+
+# Report jobs of POST /reports/jobs, see report_jobs.py. Each server worker builds them on its own pool of
+# REPORT_JOB_PROCESSES processes, over all workers at most REPORT_JOB_MAX_ACTIVE jobs run at a time.
+# Results are kept in REPORT_JOB_DIR for REPORT_JOB_TTL seconds after the job finished.
+REPORT_JOB_PROCESSES = int(os.getenv("REPORT_JOB_PROCESSES", str(os.cpu_count() or 1)))
+REPORT_JOB_MAX_ACTIVE = int(os.getenv("REPORT_JOB_MAX_ACTIVE", "8"))
+REPORT_JOB_DIR = os.getenv("REPORT_JOB_DIR", "report_jobs")
+REPORT_JOB_TTL = float(os.getenv("REPORT_JOB_TTL", "3600"))
+# A job still running after this long is given up, e.g. the worker that ran it was restarted
+REPORT_JOB_TIMEOUT = float(os.getenv("REPORT_JOB_TIMEOUT", "600"))
+
+# Applied to every new SQLite connection. WAL lets readers run while a writer commits,
+# busy_timeout makes writers wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+# journal_mode and synchronous belong to the writer, a read-only connection cannot change them
+SQLITE_READ_PRAGMAS = {name: value for name, value in SQLITE_PRAGMAS.items() if name not in ("journal_mode", "synchronous")}
+
+
+def engine_options(database_url) -> dict:
+    """Pool and connect options for the engine of a URL."""
+    options = {"pool_pre_ping": True, "pool_recycle": DB_POOL_RECYCLE}
+
+    if database_url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if database_url.database in (None, "", ":memory:"):
+            # In-memory databases live in a single connection, a sized pool does not apply
+            options = {"connect_args": options["connect_args"]}
+        else:
+            options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    else:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+def create_db_engine(url: str = DATABASE_URL, pragmas: dict | None = None, **kwargs):
+    """
+    Creates an engine with the configured pool, SQLite URLs also get SQLITE_PRAGMAS
+    set on every connection the pool opens.
+    """
+    database_url = make_url(url)
+    new_engine = create_engine(database_url, **{**engine_options(database_url), **kwargs})
+
+    if new_engine.dialect.name == "sqlite":
+        set_sqlite_pragmas(new_engine, SQLITE_PRAGMAS if pragmas is None else pragmas)
+    return new_engine
+
+
+def read_database_url(url: str = DATABASE_URL) -> str | None:
+    """
+    The URL of the readers: DATABASE_READ_URL, or the SQLite file of `url` opened read-only (mode=ro).
+
+    None when there is nothing to split, for in-memory SQLite and for other backends without a
+    replica, the readers then share the writer engine.
+    """
+    if DATABASE_READ_URL:
+        return DATABASE_READ_URL
+    database_url = make_url(url)
+    if database_url.get_backend_name() != "sqlite" or database_url.database in (None, "", ":memory:"):
+        return None
+    if database_url.query.get("uri") == "true":
+        # Already a URI filename, only add the read-only mode
+        return database_url.update_query_dict({"mode": "ro"}).render_as_string(hide_password=False)
+    return database_url.set(
+        database=f"file:{quote(os.path.abspath(database_url.database))}",
+        query={**database_url.query, "mode": "ro", "uri": "true"},
+    ).render_as_string(hide_password=False)
+
+
+def async_database_url(url: str = DATABASE_URL) -> str:
+    """The URL of `url` with the async driver of its backend."""
+    database_url = make_url(url)
+    backend = database_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}', set ASYNC_DATABASE_URL")
+    return database_url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def create_async_db_engine(url: str | None = None, pragmas: dict | None = None, **kwargs):
+    """Async counterpart of create_db_engine, with the same pool settings and SQLite pragmas."""
+    database_url = make_url(url or async_database_url())
+    options = engine_options(database_url)
+    if "pool_size" in options:
+        # aiosqlite defaults to NullPool, which would open a new connection per request
+        options["poolclass"] = AsyncAdaptedQueuePool
+    new_engine = create_async_engine(database_url, **{**options, **kwargs})
+
+    if new_engine.dialect.name == "sqlite":
+        set_sqlite_pragmas(new_engine.sync_engine, SQLITE_PRAGMAS if pragmas is None else pragmas)
+    return new_engine
+
+
+def set_sqlite_pragmas(sqlite_engine, pragmas: dict):
+    """Runs the PRAGMA statements on each new DBAPI connection of the engine."""
+    @event.listens_for(sqlite_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+# The one writer engine and session factory shared by the application, the models and the scripts
+engine = create_db_engine()
 session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Readers of the GET routes. Reports and exports then never hold a connection the writers are
+# waiting for, and in WAL mode the read-only connections do not block the writer or each other.
+READ_URL = read_database_url()
+read_engine = create_db_engine(READ_URL, pragmas=SQLITE_READ_PRAGMAS) if READ_URL else engine
+read_session = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Async engines over the same database for the routers under /async
+async_engine = create_async_db_engine(os.getenv("ASYNC_DATABASE_URL"))
+async_session = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+ASYNC_READ_URL = os.getenv("ASYNC_DATABASE_READ_URL") or (READ_URL and async_database_url(READ_URL))
+async_read_engine = create_async_db_engine(ASYNC_READ_URL, pragmas=SQLITE_READ_PRAGMAS) if ASYNC_READ_URL else async_engine
+async_read_session = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
-    """Connect to the db"""
+    """Connect to the db, for the routes that write"""
     db = session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db():
+    """Connect to the db through the read engine, for the GET routes"""
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """Connect to the db with an AsyncSession, for the routes that write"""
+    async with async_session() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """Connect to the db with an AsyncSession of the read engine, for the GET routes"""
+    async with async_read_session() as db:
+        yield db
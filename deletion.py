@@ -0,0 +1,108 @@
+"""
+Set-based deletes of garages and cars.
+
+Deleting first soft deletes: deletedAt is set and the GarageCar links are removed, so the garage
+and car endpoints, the car search and new bookings stop seeing the row, while its maintenance
+history stays in the lists and reports. A hard delete then purges the maintenances (hot and
+archived) and their rollup rows with bulk DELETE statements, DELETE_CHUNK_SIZE maintenances per
+short transaction so the other writers get the lock in between, and removes the row itself last.
+An interrupted purge leaves the row soft deleted, deleting it again resumes the purge.
+
+The tables have no ON DELETE CASCADE rules on purpose: SQLite can only add them by rebuilding the
+tables, and a single cascading DELETE would hold the write lock until the last row is gone.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from cache import invalidate_car, invalidate_garage, invalidate_occupancy_days
+from car_search import unindex_cars
+from changes import CAR, DELETED, GARAGE, MAINTENANCE, record_change, record_changes
+from constants import DELETE_CHUNK_SIZE
+from models import Car, Garage, GarageCar, GarageOccupancy, Maintenance, MaintenanceArchive
+from occupancy import apply_occupancy_deltas
+
+HISTORY_MODELS = (Maintenance, MaintenanceArchive)
+
+
+def soft_delete(db: Session, model, entity: str, entity_id: int, link_column) -> dict:
+    """Sets deletedAt of a garage or car and removes its GarageCar links, returns the affected rows."""
+    deleted = db.execute(
+        update(model).where(model.id == entity_id, model.deletedAt.is_(None)).values(deletedAt=datetime.now())
+    ).rowcount
+    if deleted:
+        record_change(db, entity, DELETED, entity_id)
+    return {
+        model.__tablename__: deleted,
+        "GarageCar": db.execute(delete(GarageCar).where(link_column == entity_id)).rowcount,
+    }
+
+
+def delete_in_chunks(db: Session, model, condition, chunk_size: int, before_delete=None) -> int:
+    """
+    Deletes the rows of `model` matching `condition`, committing every `chunk_size` rows, returns how many.
+
+    `before_delete(ids)` runs in the transaction of each chunk, before its rows are deleted. The rows
+    are all maintenances, their deletes are recorded in the change feed.
+    """
+    deleted = 0
+    while True:
+        ids = db.scalars(select(model.id).where(condition).limit(chunk_size)).all()
+        if not ids:
+            return deleted
+        if before_delete is not None:
+            before_delete(ids)
+        record_changes(db, MAINTENANCE, DELETED, ids)
+        statement = delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False)
+        deleted += db.execute(statement).rowcount
+        db.commit()
+
+
+def delete_garage_rows(db: Session, garage_id: int, soft: bool = False, chunk_size: int = DELETE_CHUNK_SIZE) -> dict:
+    """Soft deletes the garage and, unless `soft`, purges it. Returns the affected rows per table."""
+    affected = soft_delete(db, Garage, GARAGE, garage_id, GarageCar.garageId)
+    db.commit()
+    invalidate_garage(garage_id)
+    if soft:
+        return affected
+
+    # Its whole rollup goes at the end, its days cannot be booked anymore
+    for model in HISTORY_MODELS:
+        affected[model.__tablename__] = delete_in_chunks(db, model, model.garageId == garage_id, chunk_size)
+    affected["GarageOccupancy"] = db.execute(delete(GarageOccupancy).where(GarageOccupancy.garageId == garage_id)).rowcount
+    affected["Garage"] = db.execute(delete(Garage).where(Garage.id == garage_id)).rowcount
+    db.commit()
+    invalidate_garage(garage_id)
+    return affected
+
+
+def delete_car_rows(db: Session, car_id: int, soft: bool = False, chunk_size: int = DELETE_CHUNK_SIZE) -> dict:
+    """Soft deletes the car and, unless `soft`, purges it. Returns the affected rows per table."""
+    affected = soft_delete(db, Car, CAR, car_id, GarageCar.carId)
+    unindex_cars(db, [car_id])
+    db.commit()
+    invalidate_car(car_id)
+    if soft:
+        return affected
+
+    # The car's bookings leave the rollup of their garages together with each chunk
+    for model in HISTORY_MODELS:
+        released = {}
+
+        def release(ids, model=model):
+            counts = db.execute(
+                select(model.garageId, model.scheduledDate, func.count())
+                .where(model.id.in_(ids))
+                .group_by(model.garageId, model.scheduledDate)
+            )
+            deltas = {(garage_id, day): -count for garage_id, day, count in counts}
+            apply_occupancy_deltas(db, deltas)
+            released.update(deltas)
+
+        affected[model.__tablename__] = delete_in_chunks(db, model, model.carId == car_id, chunk_size, release)
+        invalidate_occupancy_days(released)
+    affected["Car"] = db.execute(delete(Car).where(Car.id == car_id)).rowcount
+    db.commit()
+    invalidate_car(car_id)
+    return affected
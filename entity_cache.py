@@ -0,0 +1,226 @@
+"""
+In-process cache of the garage and car rows read on the booking path.
+
+Every booking checks that the car and the garage exist and that the car is registered at the
+garage, and the daily availability report needs the garage's capacity. These rows change rarely,
+so each worker keeps them in a bounded LRU: a garage as (name, capacity), a car as (model, ids of
+its garages). Lookups of ids that do not exist are not cached.
+
+The write handlers of the worker that changed a row drop it through cache.invalidate_garage and
+cache.invalidate_car. The other workers learn about the write from the EntityVersion row, which
+record_changes bumps in the writing transaction: each worker reads it in the query of every miss,
+and on hits when no miss read it for ENTITY_CACHE_CHECK_SECONDS, and clears its whole cache when
+it moved. Until then another worker
+may accept a booking for a car that was just moved to another garage; capacity is not taken from
+the cache, reserve_capacity checks it in the database, so no day is overbooked.
+
+    python entity_cache.py status
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from constants import ENTITY_CACHE_CHECK_SECONDS, ENTITY_CACHE_MAX_ENTRIES, ENTITY_CACHE_SHARED, engine
+from models import Car, EntityVersion, Garage, GarageCar
+
+VERSION_NAME = "entities"
+
+
+@dataclass(frozen=True)
+class GarageEntry:
+    name: str
+    capacity: int
+    deleted: bool
+
+
+@dataclass(frozen=True)
+class CarEntry:
+    model: str
+    garageIds: frozenset
+    deleted: bool
+
+
+def load_garage(db: Session, garage_id: int) -> tuple[int | None, dict]:
+    """The entity version and the garage, in one query."""
+    row = db.execute(
+        select(EntityVersion.version, Garage.name, Garage.capacity, Garage.deletedAt)
+        .select_from(Garage)
+        .outerjoin(EntityVersion, EntityVersion.name == VERSION_NAME)
+        .where(Garage.id == garage_id)
+    ).first()
+    if row is None:
+        return None, {}
+    return row.version or 0, {("garage", garage_id): GarageEntry(row.name, row.capacity, row.deletedAt is not None)}
+
+
+def load_car(db: Session, car_id: int, garage_id: int) -> tuple[int | None, dict]:
+    """
+    The entity version, the car with the ids of its garages and the garage of a booking, in one query.
+
+    The query returns one row per garage of the car, the garage of the booking is joined to each.
+    """
+    rows = db.execute(
+        select(
+            EntityVersion.version, Car.model, Car.deletedAt, GarageCar.garageId,
+            Garage.name, Garage.capacity, Garage.deletedAt.label("garageDeletedAt"),
+        )
+        .select_from(Car)
+        .outerjoin(GarageCar, GarageCar.carId == Car.id)
+        .outerjoin(Garage, Garage.id == garage_id)
+        .outerjoin(EntityVersion, EntityVersion.name == VERSION_NAME)
+        .where(Car.id == car_id)
+    ).all()
+    if not rows:
+        return None, {}
+    row = rows[0]
+    garage_ids = frozenset(link.garageId for link in rows if link.garageId is not None)
+    entries = {("car", car_id): CarEntry(row.model, garage_ids, row.deletedAt is not None)}
+    if row.name is not None:
+        entries[("garage", garage_id)] = GarageEntry(row.name, row.capacity, row.garageDeletedAt is not None)
+    return row.version or 0, entries
+
+
+def read_version(db) -> int:
+    return db.scalar(select(EntityVersion.version).where(EntityVersion.name == VERSION_NAME)) or 0
+
+
+def bump_version(db, name: str = VERSION_NAME):
+    """Marks the cached entities of every worker stale, inside the caller's transaction."""
+    result = db.execute(
+        update(EntityVersion).where(EntityVersion.name == name).values(version=EntityVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        db.add(EntityVersion(name=name, version=1))
+        db.flush()
+
+
+class EntityCache:
+    """
+    LRU of GarageEntry and CarEntry keyed by ("garage", id) and ("car", id), bounded by entry count.
+
+    A lookup that misses loads the row with the caller's session. Like ResponseCache.put, the
+    loaded entry is only stored when nothing was invalidated while it was read.
+    """
+
+    def __init__(self, max_entries: int, check_seconds: float, shared: bool):
+        self.max_entries = max_entries
+        self.check_seconds = check_seconds
+        self.shared = shared
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self._version = None
+        self._checked_at = float("-inf")
+        self.hits = self.misses = self.evictions = self.invalidations = self.version_clears = 0
+
+    def garage(self, db: Session, garage_id: int) -> GarageEntry | None:
+        key = ("garage", garage_id)
+        entry, generation = self._get(db, key)
+        if generation is None:
+            return entry
+        return self._store(generation, *load_garage(db, garage_id)).get(key)
+
+    def booking(self, db: Session, car_id: int, garage_id: int) -> tuple[CarEntry | None, GarageEntry | None]:
+        """The car and the garage of a booking. A miss of the car loads both with one query."""
+        car, generation = self._get(db, ("car", car_id))
+        if generation is not None:
+            entries = self._store(generation, *load_car(db, car_id, garage_id))
+            return entries.get(("car", car_id)), entries.get(("garage", garage_id))
+        return car, self.garage(db, garage_id)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "versionClears": self.version_clears,
+            }
+
+    def _get(self, db: Session, key) -> tuple:
+        """The cached entry and None, or None and the generation to store the loaded entry with."""
+        if self.shared and time.monotonic() - self._checked_at >= self.check_seconds:
+            # No load refreshed the version for check_seconds, hits alone read it at most this often
+            self._check_version(read_version(db))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, None
+            self.misses += 1
+            return None, self.generation
+
+    def _store(self, generation: int, version: int | None, entries: dict) -> dict:
+        """
+        Stores the loaded entries, unless something was invalidated while they were read.
+
+        The version was read in the same query, so the entries are current even when it moved and
+        the older entries are cleared.
+        """
+        if self.shared and version is not None:
+            generation = self._check_version(version, generation)
+        with self._lock:
+            if generation == self.generation:
+                for key, entry in entries.items():
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return entries
+
+    def _check_version(self, version: int, generation: int | None = None) -> int | None:
+        """
+        Clears the cache when another worker changed a garage or car since the version was last read.
+
+        Returns `generation`, or the generation after the clear when nothing else was invalidated
+        since `generation`.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._version is not None and version != self._version:
+                unchanged = generation == self.generation
+                self.generation += 1
+                self._entries.clear()
+                self.version_clears += 1
+                if unchanged:
+                    generation = self.generation
+            self._version = version
+            return generation
+
+
+entity_cache = EntityCache(ENTITY_CACHE_MAX_ENTRIES, ENTITY_CACHE_CHECK_SECONDS, ENTITY_CACHE_SHARED)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the version stamp of the entity caches.")
+    parser.add_argument("command", choices=["status"])
+    parser.parse_args()
+
+    with engine.connect() as connection:
+        print(f"Entity version {read_version(connection)}")
+
+
+if __name__ == "__main__":
+    main()
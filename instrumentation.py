@@ -0,0 +1,285 @@
+"""
+Per-request performance instrumentation.
+
+MetricsMiddleware opens a RequestMetrics for every HTTP request. The engine event hooks add each SQL
+statement to it, and InstrumentedRoute marks when the endpoint returned, so the time spent turning
+its result into JSON is known. The totals go out as a Server-Timing header, optionally as a
+structured log line, and into the per-route histograms served by /metrics in the Prometheus format.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from constants import METRICS_ENABLED, REQUEST_LOG_ENABLED, SLOW_QUERY_MS
+
+logger = logging.getLogger("carmanagement.requests")
+slow_query_logger = logging.getLogger("carmanagement.slow_queries")
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+@dataclass
+class RequestMetrics:
+    started: float
+    sql_statements: int = 0
+    db_time: float = 0.0
+    slowest_time: float = 0.0
+    slowest_statement: str | None = None
+    # Set by InstrumentedRoute when the endpoint function returns
+    endpoint_done: float | None = None
+    serialization_time: float = 0.0
+    response_bytes: int = 0
+
+    def add_statement(self, statement: str, elapsed: float):
+        self.sql_statements += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def server_timing(self, total: float) -> str:
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.sql_statements} statements"',
+            f"db-slowest;dur={self.slowest_time * 1000:.2f}",
+            f"serialize;dur={self.serialization_time * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ])
+
+
+current_request: ContextVar[RequestMetrics | None] = ContextVar("current_request", default=None)
+
+
+# SQLAlchemy hooks
+
+def instrument_engine(engine: Engine):
+    """Times every statement of `engine`, for an AsyncEngine pass its sync_engine."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.add_statement(statement, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        registry.record_slow_query()
+        slow_query_logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split()))
+
+
+# Routes
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute that records when its endpoint returns, what follows is response serialization."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint_done(endpoint), **kwargs)
+
+
+def _mark_endpoint_done(endpoint):
+    # wraps keeps the signature FastAPI reads the parameters from
+    if iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def timed(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _endpoint_done()
+    else:
+        @wraps(endpoint)
+        def timed(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _endpoint_done()
+    return timed
+
+
+def _endpoint_done():
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.endpoint_done = time.perf_counter()
+
+
+# Aggregation
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.series: dict = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            base = _labels(label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series: dict = {}
+
+    def inc(self, labels: tuple = (), amount: int = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(label_names, labels)}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+class MetricsRegistry:
+    ROUTE_LABELS = ("method", "route")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter("http_requests_total", "Requests by route and status code.")
+        self.duration = Histogram("http_request_duration_seconds", "Time until the last body byte was sent.", SECONDS_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent executing SQL.", SECONDS_BUCKETS)
+        self.sql_statements = Histogram("http_request_sql_statements", "SQL statements sent.", COUNT_BUCKETS)
+        self.serialization = Histogram(
+            "http_request_serialization_seconds", "Time from the endpoint returning to the response start.", SECONDS_BUCKETS
+        )
+        self.response_size = Histogram("http_response_size_bytes", "Response body size.", BYTES_BUCKETS)
+        self.slow_queries = Counter("sql_slow_queries_total", f"Statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS} ms).")
+
+    def record(self, method: str, route: str, status: int, metrics: RequestMetrics, duration: float):
+        labels = (method, route)
+        with self._lock:
+            self.requests.inc((method, route, status))
+            self.duration.observe(labels, duration)
+            self.db_time.observe(labels, metrics.db_time)
+            self.sql_statements.observe(labels, metrics.sql_statements)
+            self.serialization.observe(labels, metrics.serialization_time)
+            self.response_size.observe(labels, metrics.response_bytes)
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries.inc()
+
+    def render(self) -> str:
+        from cache import response_cache
+        from entity_cache import entity_cache
+
+        with self._lock:
+            lines = self.requests.render(self.ROUTE_LABELS + ("status",))
+            for histogram in (self.duration, self.db_time, self.sql_statements, self.serialization, self.response_size):
+                lines += histogram.render(self.ROUTE_LABELS)
+            lines += self.slow_queries.render(())
+
+        stats = response_cache.stats()
+        for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+            lines += [f"# TYPE response_cache_{name}_total counter", f"response_cache_{name}_total {stats[name]}"]
+        for name in ("entries", "bytes"):
+            lines += [f"# TYPE response_cache_{name} gauge", f"response_cache_{name} {stats[name]}"]
+
+        stats = entity_cache.stats()
+        for name, key in (("hits", "hits"), ("misses", "misses"), ("evictions", "evictions"),
+                          ("invalidations", "invalidations"), ("version_clears", "versionClears")):
+            lines += [f"# TYPE entity_cache_{name}_total counter", f"entity_cache_{name}_total {stats[key]}"]
+        lines += ["# TYPE entity_cache_entries gauge", f"entity_cache_entries {stats['entries']}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# Middleware
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, unlike BaseHTTPMiddleware it keeps contextvars and streaming bodies intact."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        metrics = RequestMetrics(started=time.perf_counter())
+        token = current_request.set(metrics)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                status = message["status"]
+                if metrics.endpoint_done is not None:
+                    metrics.serialization_time = now - metrics.endpoint_done
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", metrics.server_timing(now - metrics.started).encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                metrics.response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            duration = time.perf_counter() - metrics.started
+            # FastAPI puts the matched route in the scope, its path template keeps the label count bounded.
+            # Plain Starlette routes (/docs, /openapi.json) have no parameters, their path is used as is.
+            route = scope.get("route")
+            if route is not None:
+                route_path = route.path
+            else:
+                route_path = scope["path"] if "endpoint" in scope else "unmatched"
+            registry.record(scope["method"], route_path, status, metrics, duration)
+            if REQUEST_LOG_ENABLED:
+                logger.info(json.dumps({
+                    "method": scope["method"],
+                    "route": route_path,
+                    "path": scope["path"],
+                    "status": status,
+                    "durationMs": round(duration * 1000, 3),
+                    "sqlStatements": metrics.sql_statements,
+                    "dbMs": round(metrics.db_time * 1000, 3),
+                    "slowestSqlMs": round(metrics.slowest_time * 1000, 3),
+                    "slowestSql": metrics.slowest_statement and " ".join(metrics.slowest_statement.split()),
+                    "serializationMs": round(metrics.serialization_time * 1000, 3),
+                    "responseBytes": metrics.response_bytes,
+                }))
@@ -1,9 +1,16 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
 from fastapi.middleware.cors import CORSMiddleware
-from routes import garages, cars, maintenance
+from cache import response_cache
+from entity_cache import entity_cache
+from constants import async_engine, async_read_engine, engine, read_engine
+from instrumentation import InstrumentedRoute, MetricsMiddleware, instrument_engine, registry
+from routes import analytics, changes, report_jobs, garages, cars, maintenance, garages_async, cars_async, maintenance_async
+from routes.pagination import NEXT_CURSOR_HEADER
 
 app=FastAPI()
+app.router.route_class = InstrumentedRoute
 
 # Moved middleware first for clarity
 app.add_middleware(
@@ -12,12 +19,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Browsers only let scripts read the response headers listed here, the next page cursor included
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+# Outermost, so its timings include the other middleware
+app.add_middleware(MetricsMiddleware)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+# The same engines again when there is no separate reader, instrument_engine skips them
+instrument_engine(read_engine)
+instrument_engine(async_read_engine.sync_engine)
 
 @app.get("/info")
 def info():
     return{"version": "0.1"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    return response_cache.stats()
+
+@app.get("/cache/entities/stats")
+def entity_cache_stats():
+    return entity_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def home():
     return {"message": "Home page, test"}
@@ -25,8 +55,17 @@ def home():
 app.include_router(garages.router, prefix="/garages", tags=["Garages"])
 app.include_router(cars.router, prefix="/cars", tags=["Cars"])
 app.include_router(maintenance.router, prefix="/maintenance", tags=["Maintenances"])
+app.include_router(analytics.router, prefix="/reports", tags=["Reports"])
+app.include_router(report_jobs.router, prefix="/reports/jobs", tags=["Reports"])
+app.include_router(changes.router, prefix="/changes", tags=["Changes"])
+
+# Same API on AsyncSession, mounted side by side so the two paths can be benchmarked under the same load
+app.include_router(garages_async.router, prefix="/async/garages", tags=["Garages (async)"])
+app.include_router(cars_async.router, prefix="/async/cars", tags=["Cars (async)"])
+app.include_router(maintenance_async.router, prefix="/async/maintenance", tags=["Maintenances (async)"])
 
 if __name__ == "__main__":
-    import uvicorn
+    # Development server, see serve.py for the production one
+    import serve
 
-    uvicorn.run("main:app", host="127.0.0.1", port=8088, reload=True)
\ No newline at end of file
+    serve.main(["--reload"])
@@ -0,0 +1,227 @@
+import argparse
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+from car_search import create_search_table
+from changes import CHANGE_LOCK
+from constants import engine
+from models import Base, Car, EntityVersion, Garage, GarageCar, Maintenance
+from occupancy import refill_occupancy
+from routes.reports import daily_counts_query, monthly_counts_query
+
+migration_metadata = MetaData()
+
+schema_version = Table(
+    "SchemaVersion",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("appliedAt", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+class MigrationError(Exception):
+    """The data in the database keeps a migration from running, it has to be fixed by hand first."""
+
+
+def run_steps(*steps):
+    """Migration made of several steps, run in order in the migration's transaction."""
+    def apply(connection: Connection):
+        for step in steps:
+            step(connection)
+    return apply
+
+
+def require_unique_plates(connection: Connection):
+    """Fails with the duplicated license plates, ux_Car_licensePlate cannot be created over them."""
+    duplicates = connection.execute(
+        select(Car.licensePlate, func.count())
+        .group_by(Car.licensePlate)
+        .having(func.count() > 1)
+        .order_by(Car.licensePlate)
+    ).all()
+    if duplicates:
+        shown = ", ".join(f"{plate} ({count} cars)" for plate, count in duplicates[:10])
+        raise MigrationError(
+            f"{len(duplicates)} license plates belong to more than one car: {shown}. The unique index "
+            "ux_Car_licensePlate needs them unique, change the plates or delete the duplicate cars and upgrade again."
+        )
+
+
+def create_indexes(*tables):
+    """Migration step creating the indexes declared in models.py that the database is missing."""
+    def apply(connection: Connection):
+        for table in tables:
+            for index in table.__table__.indexes:
+                index.create(connection, checkfirst=True)
+    return apply
+
+
+def add_columns(*columns):
+    """Migration step adding nullable columns declared in models.py to tables created without them."""
+    def apply(connection: Connection):
+        for column in columns:
+            existing = {c["name"] for c in inspect(connection).get_columns(column.table.name)}
+            if column.name not in existing:
+                column_type = column.type.compile(connection.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE "{column.table.name}" ADD COLUMN "{column.name}" {column_type}')
+    return apply
+
+
+# Append new migrations at the end, never renumber or edit one that was already released.
+def add_change_lock(connection: Connection):
+    """The EntityVersion row record_changes locks, created up front so two first writers do not both insert it."""
+    if connection.scalar(select(EntityVersion.name).where(EntityVersion.name == CHANGE_LOCK)) is None:
+        connection.execute(insert(EntityVersion).values(name=CHANGE_LOCK, version=0))
+
+
+MIGRATIONS = [
+    Migration(1, "Backfill the GarageOccupancy rollup", refill_occupancy),
+    Migration(2, "Indexes for the hot filter columns", run_steps(
+        require_unique_plates, create_indexes(Garage, Car, GarageCar, Maintenance),
+    )),
+    Migration(3, "Trigram search index of the cars", create_search_table),
+    Migration(4, "Soft delete of garages and cars", add_columns(Garage.__table__.c.deletedAt, Car.__table__.c.deletedAt)),
+    Migration(5, "Lock row of the change feed writers", add_change_lock),
+]
+
+
+def current_version(connection: Connection) -> int:
+    versions = connection.execute(select(schema_version.c.version)).scalars().all()
+    return max(versions, default=0)
+
+
+def run_migrations(engine: Engine) -> list[Migration]:
+    """
+    Brings the database up to the latest schema version.
+
+    Missing tables are created first, then every pending migration runs in its own transaction
+    together with its SchemaVersion row, so an interrupted upgrade resumes where it stopped.
+    """
+    Base.metadata.create_all(bind=engine)
+    migration_metadata.create_all(bind=engine)
+
+    with engine.connect() as connection:
+        version = current_version(connection)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(insert(schema_version).values(
+                version=migration.version,
+                description=migration.description,
+                appliedAt=datetime.now(),
+            ))
+        applied.append(migration)
+    return applied
+
+
+def plan_check_queries() -> dict:
+    """The statements behind the list and report endpoints, with the index each one must use."""
+    day = date(2020, 1, 1)
+    return {
+        "dailyAvailabilityReport": (daily_counts_query(1, day, day), "sqlite_autoindex_GarageOccupancy_1"),
+        "monthlyRequestsReport": (monthly_counts_query(1, day, day), "sqlite_autoindex_GarageOccupancy_1"),
+        "list_cars?car_make": (
+            select(Car.id).where(Car.make == "BMW", Car.productionYear >= 2000).order_by(Car.id),
+            "ix_Car_make_productionYear",
+        ),
+        "list_cars?from_year": (
+            select(Car.id).where(Car.productionYear >= 2000, Car.productionYear <= 2010).order_by(Car.id),
+            "ix_Car_productionYear",
+        ),
+        "list_cars?garage_id": (
+            select(Car.id).join(GarageCar).where(GarageCar.garageId == 1).order_by(Car.id),
+            "ix_GarageCar_garageId_carId",
+        ),
+        "Car.garages selectinload": (
+            select(GarageCar.garageId).where(GarageCar.carId.in_([1, 2, 3])),
+            "ix_GarageCar_carId_garageId",
+        ),
+        "list_garages?city": (select(Garage.id).where(Garage.city == "Sofiq").order_by(Garage.id), "ix_Garage_city"),
+        "get_maintenances?garageId": (
+            select(Maintenance.id)
+            .where(Maintenance.garageId == 1, Maintenance.scheduledDate >= day)
+            .order_by(Maintenance.scheduledDate, Maintenance.id),
+            "ix_Maintenance_garageId_scheduledDate",
+        ),
+        "get_maintenances?carId": (
+            select(Maintenance.id)
+            .where(Maintenance.carId == 1, Maintenance.scheduledDate >= day)
+            .order_by(Maintenance.scheduledDate, Maintenance.id),
+            "ix_Maintenance_carId_scheduledDate",
+        ),
+        "get_maintenances": (
+            select(Maintenance.id).order_by(Maintenance.scheduledDate, Maintenance.id),
+            "ix_Maintenance_scheduledDate",
+        ),
+    }
+
+
+def explain(connection: Connection, statement) -> list[str]:
+    """Returns the EXPLAIN QUERY PLAN detail lines of a statement (SQLite only)."""
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", parameters)
+    return [row[-1] for row in rows]
+
+
+def check_query_plans(engine: Engine) -> dict:
+    """Maps every check query whose plan does not use the expected index to its plan."""
+    if engine.dialect.name != "sqlite":
+        raise RuntimeError("Query plan checks are only implemented for SQLite")
+
+    failures = {}
+    with engine.connect() as connection:
+        for name, (statement, index_name) in plan_check_queries().items():
+            plan = explain(connection, statement)
+            if not any(index_name in line for line in plan):
+                failures[name] = plan
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations and check query plans.")
+    parser.add_argument("command", choices=["upgrade", "status", "check-plans"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        try:
+            applied = run_migrations(engine)
+        except MigrationError as error:
+            raise SystemExit(f"Upgrade stopped: {error}")
+        for migration in applied:
+            print(f"Applied {migration.version}: {migration.description}")
+        print(f"Database at version {MIGRATIONS[-1].version}")
+    elif args.command == "status":
+        migration_metadata.create_all(bind=engine)
+        with engine.connect() as connection:
+            version = current_version(connection)
+        pending = [m for m in MIGRATIONS if m.version > version]
+        print(f"Database at version {version}, {len(pending)} pending")
+        for migration in pending:
+            print(f"  {migration.version}: {migration.description}")
+    else:
+        failures = check_query_plans(engine)
+        for name, plan in failures.items():
+            print(f"{name} does not use its index:\n  " + "\n  ".join(plan))
+        print(f"{len(plan_check_queries()) - len(failures)}/{len(plan_check_queries())} queries use their index")
+        raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
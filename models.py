@@ -1,36 +1,49 @@
-from pyexpat import model
-from sqlalchemy import Column, Date, ForeignKey, Integer, String, create_engine
-from sqlalchemy.orm import relationship, declarative_base, sessionmaker
-from constants import DATABASE_URL
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
 
 class Garage(Base):
     __tablename__ = "Garage"
+    __table_args__ = (
+        Index("ix_Garage_city", "city"),
+    )
 
     id = Column(Integer, primary_key=True)
     city = Column(String, nullable=False)
     location = Column(String, nullable=False)
     name = Column(String, nullable=False)
     capacity = Column(Integer, nullable=False, default=0)
+    # Set by a soft delete, see deletion.py
+    deletedAt = Column(DateTime, nullable=True)
 
     cars = relationship("Car", secondary="GarageCar", back_populates="garages")
 
 
 class Car(Base):
     __tablename__ = "Car"
+    __table_args__ = (
+        Index("ix_Car_make_productionYear", "make", "productionYear"),
+        Index("ix_Car_productionYear", "productionYear"),
+        Index("ux_Car_licensePlate", "licensePlate", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     make = Column(String, nullable=False)
     model = Column(String, nullable=False)
     productionYear = Column(Integer, nullable=False)
     licensePlate = Column(String, nullable=False)
+    deletedAt = Column(DateTime, nullable=True)
 
     garages = relationship("Garage", secondary="GarageCar", back_populates="cars")
 
 
 class GarageCar(Base):
     __tablename__ = "GarageCar"
+    __table_args__ = (
+        Index("ix_GarageCar_garageId_carId", "garageId", "carId"),
+        Index("ix_GarageCar_carId_garageId", "carId", "garageId"),
+    )
 
     id = Column(Integer, primary_key=True)
     carId = Column(Integer, ForeignKey("Car.id"), nullable=False)
@@ -39,6 +52,13 @@ class GarageCar(Base):
 
 class Maintenance(Base):
     __tablename__ = "Maintenance"
+    __table_args__ = (
+        # The id is implicitly the last column of every SQLite index, so these also serve
+        # the (scheduledDate, id) keyset ordering of get_maintenances.
+        Index("ix_Maintenance_garageId_scheduledDate", "garageId", "scheduledDate"),
+        Index("ix_Maintenance_carId_scheduledDate", "carId", "scheduledDate"),
+        Index("ix_Maintenance_scheduledDate", "scheduledDate"),
+    )
 
     id = Column(Integer, primary_key=True)
     carId = Column(Integer, ForeignKey("Car.id"), nullable=False)
@@ -57,6 +77,79 @@ class Maintenance(Base):
     def carName(self) -> str:
         return self.car.model
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+class MaintenanceArchive(Base):
+    """Maintenances older than the archive cutoff, moved out of Maintenance by archive.py."""
+    __tablename__ = "MaintenanceArchive"
+    __table_args__ = (
+        Index("ix_MaintenanceArchive_garageId_scheduledDate", "garageId", "scheduledDate"),
+        Index("ix_MaintenanceArchive_carId_scheduledDate", "carId", "scheduledDate"),
+        Index("ix_MaintenanceArchive_scheduledDate", "scheduledDate"),
+    )
+
+    # Keeps the id the maintenance had in Maintenance
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    carId = Column(Integer, ForeignKey("Car.id"), nullable=False)
+    garageId = Column(Integer, ForeignKey("Garage.id"), nullable=False)
+    serviceType = Column(String, nullable=False)
+    scheduledDate = Column(Date, nullable=False)
+
+
+class ArchiveCutoff(Base):
+    """The archived table may hold rows dated before `cutoff`, later ones are all in the hot table."""
+    __tablename__ = "ArchiveCutoff"
+
+    tableName = Column(String, primary_key=True)
+    cutoff = Column(Date, nullable=False)
+
+
+class ChangeLog(Base):
+    """Rows created, updated or deleted by the write endpoints, in commit order, see changes.py."""
+    __tablename__ = "ChangeLog"
+    # AUTOINCREMENT: an id is never handed out twice, the ids are the cursors of GET /changes
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entityId = Column(Integer, nullable=False)
+    operation = Column(String, nullable=False)
+    changedAt = Column(DateTime, nullable=False)
+
+
+class EntityVersion(Base):
+    """Bumped by every garage and car write, the other workers then clear their entity cache, see entity_cache.py."""
+    __tablename__ = "EntityVersion"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+class ReportJob(Base):
+    """A report built in the background for POST /reports/jobs, its result is a file, see report_jobs.py."""
+    __tablename__ = "ReportJob"
+
+    id = Column(String, primary_key=True)
+    report = Column(String, nullable=False)
+    # The request as JSON
+    parameters = Column(String, nullable=False)
+    # Key of the request while the job runs, an identical request joins the job instead of starting one
+    activeKey = Column(String, unique=True, nullable=True)
+    status = Column(String, nullable=False)
+    partitions = Column(Integer, nullable=False)
+    progress = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    createdAt = Column(DateTime, nullable=False)
+    finishedAt = Column(DateTime, nullable=True)
+    expiresAt = Column(DateTime, nullable=True)
+
+
+class GarageOccupancy(Base):
+    """Number of maintenance requests per garage and day, kept in sync by the maintenance routes."""
+    __tablename__ = "GarageOccupancy"
+
+    garageId = Column(Integer, ForeignKey("Garage.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    requests = Column(Integer, nullable=False, default=0)
+
+
+# The tables are created by migrations.run_migrations, run once before the server starts (see serve.py)
@@ -0,0 +1,243 @@
+import argparse
+from datetime import date
+
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from archive import all_maintenances
+from constants import session
+from models import Garage, GarageOccupancy
+
+UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def change_occupancy(db: Session, garage_id: int, day: date, delta: int):
+    """
+    Adds `delta` requests to the (garage, day) rollup row inside the caller's transaction.
+
+    Rows that drop to zero are removed so the table only holds days with bookings.
+    """
+    if delta > 0:
+        _increment(db, garage_id, day, delta)
+    elif delta < 0:
+        db.execute(
+            update(GarageOccupancy)
+            .where(GarageOccupancy.garageId == garage_id, GarageOccupancy.date == day)
+            .values(requests=GarageOccupancy.requests + delta)
+        )
+        db.execute(
+            delete(GarageOccupancy).where(
+                GarageOccupancy.garageId == garage_id,
+                GarageOccupancy.date == day,
+                GarageOccupancy.requests <= 0,
+            )
+        )
+
+
+def reserve_capacity(db: Session, garage_id: int, day: date, count: int = 1) -> bool:
+    """
+    Books `count` requests of the garage on `day` if they fit in Garage.capacity, inside the caller's transaction.
+
+    Check and increment are one conditional upsert, so concurrent bookings cannot both take the
+    last free place: the database serializes the writes to the (garage, day) row and every one
+    of them re-evaluates the capacity condition. Returns False, changing nothing, when the day is full.
+    """
+    # A deleted garage has no capacity, the booking checks may still see it in a stale entity cache
+    capacity = select(Garage.capacity).where(Garage.id == garage_id, Garage.deletedAt.is_(None)).scalar_subquery()
+    dialect_insert = UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(GarageOccupancy).from_select(
+            ["garageId", "date", "requests"],
+            select(literal(garage_id), literal(day), literal(count)).where(
+                Garage.id == garage_id, Garage.deletedAt.is_(None), Garage.capacity >= count
+            ),
+        )
+        result = db.execute(statement.on_conflict_do_update(
+            index_elements=[GarageOccupancy.garageId, GarageOccupancy.date],
+            set_={"requests": GarageOccupancy.requests + statement.excluded.requests},
+            where=GarageOccupancy.requests + statement.excluded.requests <= capacity,
+        ))
+        return result.rowcount == 1
+
+    # Generic fallback, the conditional UPDATE is atomic, a concurrent first booking of the day
+    # makes the INSERT fail on the primary key instead of overbooking
+    result = db.execute(
+        update(GarageOccupancy)
+        .where(GarageOccupancy.garageId == garage_id, GarageOccupancy.date == day)
+        .where(GarageOccupancy.requests + count <= capacity)
+        .values(requests=GarageOccupancy.requests + count)
+    )
+    if result.rowcount == 1:
+        return True
+    exists = db.scalar(
+        select(func.count()).where(GarageOccupancy.garageId == garage_id, GarageOccupancy.date == day)
+    )
+    if exists:
+        return False
+    result = db.execute(
+        insert(GarageOccupancy).from_select(
+            ["garageId", "date", "requests"],
+            select(literal(garage_id), literal(day), literal(count)).where(
+                Garage.id == garage_id, Garage.deletedAt.is_(None), Garage.capacity >= count
+            ),
+        )
+    )
+    return result.rowcount == 1
+
+
+def reserve_capacity_for_items(db: Session, items_by_day: dict) -> set:
+    """
+    reserve_capacity for the items of a bulk request, `items_by_day` maps (garage_id, day) to item indexes.
+
+    All items of a day are reserved with one statement. When they do not all fit, they are
+    reserved one by one until the day is full. Returns the indexes that did not fit.
+    """
+    rejected = set()
+    for (garage_id, day), indexes in items_by_day.items():
+        if reserve_capacity(db, garage_id, day, len(indexes)):
+            continue
+        for position, index in enumerate(indexes):
+            if not reserve_capacity(db, garage_id, day):
+                rejected.update(indexes[position:])
+                break
+    return rejected
+
+
+def move_booking(db: Session, old_garage_id: int, old_day: date, new_garage_id: int, new_day: date) -> bool:
+    """
+    Moves one request between rollup rows when a maintenance changes garage or date.
+
+    The new day is reserved first, returns False, changing nothing, when it is full.
+    """
+    if (old_garage_id, old_day) == (new_garage_id, new_day):
+        return True
+    if not reserve_capacity(db, new_garage_id, new_day):
+        return False
+    change_occupancy(db, old_garage_id, old_day, -1)
+    return True
+
+
+def apply_occupancy_deltas(db: Session, deltas: dict):
+    """
+    change_occupancy for many rows at once, `deltas` maps (garage_id, day) to a delta.
+
+    Used by the bulk endpoints, the increments run as one executemany upsert.
+    """
+    increments = [
+        {"garageId": garage_id, "date": day, "requests": delta}
+        for (garage_id, day), delta in deltas.items() if delta > 0
+    ]
+    dialect_insert = UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if increments and dialect_insert is not None:
+        statement = dialect_insert(GarageOccupancy)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[GarageOccupancy.garageId, GarageOccupancy.date],
+                set_={"requests": GarageOccupancy.requests + statement.excluded.requests},
+            ),
+            increments,
+        )
+    else:
+        for row in increments:
+            _increment(db, row["garageId"], row["date"], row["requests"])
+
+    for (garage_id, day), delta in deltas.items():
+        if delta < 0:
+            change_occupancy(db, garage_id, day, delta)
+
+
+def _increment(db: Session, garage_id: int, day: date, delta: int):
+    dialect_insert = UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(GarageOccupancy).values(garageId=garage_id, date=day, requests=delta)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[GarageOccupancy.garageId, GarageOccupancy.date],
+            set_={"requests": GarageOccupancy.requests + statement.excluded.requests},
+        ))
+        return
+
+    # Generic fallback for databases without INSERT ... ON CONFLICT
+    result = db.execute(
+        update(GarageOccupancy)
+        .where(GarageOccupancy.garageId == garage_id, GarageOccupancy.date == day)
+        .values(requests=GarageOccupancy.requests + delta)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(GarageOccupancy).values(garageId=garage_id, date=day, requests=delta))
+
+
+def maintenance_counts_query(garage_id: int | None = None):
+    """The rollup as it should be, computed from the Maintenance table and its archive."""
+    rows = all_maintenances("id", "garageId", "scheduledDate")
+    query = select(rows.c.garageId, rows.c.scheduledDate, func.count(rows.c.id)).group_by(
+        rows.c.garageId, rows.c.scheduledDate
+    )
+    if garage_id is not None:
+        query = query.where(rows.c.garageId == garage_id)
+    return query
+
+
+def rebuild_occupancy(db: Session, garage_id: int | None = None):
+    """Recomputes the rollup from Maintenance in one transaction."""
+    refill_occupancy(db, garage_id)
+    db.commit()
+
+
+def refill_occupancy(connection, garage_id: int | None = None):
+    """Replaces the rollup rows with the Maintenance counts, without committing."""
+    clear = delete(GarageOccupancy)
+    if garage_id is not None:
+        clear = clear.where(GarageOccupancy.garageId == garage_id)
+    connection.execute(clear)
+    connection.execute(
+        insert(GarageOccupancy).from_select(
+            ["garageId", "date", "requests"], maintenance_counts_query(garage_id)
+        )
+    )
+
+
+def verify_occupancy(db: Session, garage_id: int | None = None) -> list[dict]:
+    """Returns every (garage, date) whose rollup count differs from the Maintenance table."""
+    expected = {(g, d): count for g, d, count in db.execute(maintenance_counts_query(garage_id))}
+
+    stored_query = select(GarageOccupancy.garageId, GarageOccupancy.date, GarageOccupancy.requests)
+    if garage_id is not None:
+        stored_query = stored_query.where(GarageOccupancy.garageId == garage_id)
+    stored = {(g, d): count for g, d, count in db.execute(stored_query)}
+
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        if expected.get(key, 0) != stored.get(key, 0):
+            mismatches.append({
+                "garageId": key[0],
+                "date": str(key[1]),
+                "expected": expected.get(key, 0),
+                "stored": stored.get(key, 0),
+            })
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify the GarageOccupancy rollup table.")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--garage-id", type=int, default=None, help="Only process this garage")
+    args = parser.parse_args()
+
+    db = session()
+    try:
+        if args.command == "rebuild":
+            rebuild_occupancy(db, args.garage_id)
+            print("GarageOccupancy rebuilt")
+        else:
+            mismatches = verify_occupancy(db, args.garage_id)
+            for mismatch in mismatches:
+                print(mismatch)
+            print(f"{len(mismatches)} mismatching (garage, date) rows")
+            raise SystemExit(1 if mismatches else 0)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from constants import DATABASE_URL
-from models import Car, Garage, Maintenance
-from datetime import date
+import argparse
+import inspect
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert, text
+
+from car_search import refill_car_search
+from constants import SQLITE_PRAGMAS, create_db_engine, engine, session
+from migrations import run_migrations
+from models import Car, Garage, GarageCar, Maintenance
+from occupancy import rebuild_occupancy, refill_occupancy
 
 def create_and_add_garages(db):
     # Create Garage instances
@@ -45,20 +55,285 @@ def create_and_add_maintenances(db, cars, garages):
     db.commit()
 
 
-def main():
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = Session()
+def populate_demo():
+    run_migrations(engine)
+    db = session()
 
     try:
         # Create and add garages, cars, and maintenances to the database
         garages = create_and_add_garages(db)
         cars = create_and_add_cars(db, garages)
         create_and_add_maintenances(db, cars, garages)
+        rebuild_occupancy(db)
+        refill_car_search(db.connection())
+        db.commit()
 
     finally:
         db.close()
 
 
+# Synthetic dataset generation for load tests and benchmarks
+
+# (city, relative share of garages)
+CITIES = [
+    ("Sofiq", 40), ("Plovdiv", 14), ("Varna", 12), ("Burgas", 8), ("Ruse", 5), ("Stara Zagora", 5),
+    ("Pleven", 3), ("Sliven", 3), ("Dobrich", 2), ("Shumen", 2), ("Pernik", 2), ("Blagoevgrad", 2),
+    ("Veliko Tarnovo", 2), ("Haskovo", 2), ("Yambol", 1), ("Pazardzhik", 1), ("Velingrad", 1), ("Vratsa", 1),
+]
+# (make, models, relative share of cars)
+MAKES = [
+    ("Volkswagen", ["Golf", "Passat", "Polo", "Tiguan"], 18), ("Toyota", ["Corolla", "Yaris", "RAV4", "Auris"], 14),
+    ("Opel", ["Astra", "Corsa", "Insignia"], 11), ("BMW", ["320", "520", "X3", "F26"], 10),
+    ("Mercedes-Benz", ["C200", "E220", "A180"], 9), ("Audi", ["A4", "A6", "Q5", "e-tron"], 9),
+    ("Renault", ["Clio", "Megane", "Captur"], 8), ("Skoda", ["Octavia", "Fabia", "Superb"], 8),
+    ("Dacia", ["Logan", "Sandero", "Duster"], 7), ("Ford", ["Focus", "Fiesta", "Mondeo"], 6),
+]
+# (service type, relative share of bookings)
+SERVICE_TYPES = [
+    ("Oil change", 30), ("Maintenance", 25), ("Yearly checkup", 20), ("Tyre change", 12), ("Brakes", 6),
+    ("Diagnostics", 4), ("Bodywork", 2), ("Air conditioning", 1),
+]
+PLATE_REGIONS = ["CA", "CB", "C", "PB", "B", "A", "E", "CO", "PK", "BT", "EB", "X", "H", "M", "P", "T"]
+PLATE_LETTERS = "ABEKMHOPCTYX"
+
+# The target file is thrown away if the load fails, so durability can be traded for speed
+LOAD_PRAGMAS = {**SQLITE_PRAGMAS, "journal_mode": "OFF", "synchronous": "OFF", "locking_mode": "EXCLUSIVE"}
+
+
+def zipf_weights(count: int, rng: random.Random, exponent: float = 1.1) -> list[float]:
+    """Popularity weights following Zipf's law, assigned to the items in random order."""
+    weights = [1 / (rank ** exponent) for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def license_plate(number: int) -> str:
+    """A unique, realistic looking plate for every car number."""
+    region = PLATE_REGIONS[number % len(PLATE_REGIONS)]
+    number //= len(PLATE_REGIONS)
+    digits = number % 10000
+    number //= 10000
+    letters = ""
+    for _ in range(2):
+        letters += PLATE_LETTERS[number % len(PLATE_LETTERS)]
+        number //= len(PLATE_LETTERS)
+    # Plates past the 2 letter space get extra letters so they stay unique
+    while number:
+        letters += PLATE_LETTERS[number % len(PLATE_LETTERS)]
+        number //= len(PLATE_LETTERS)
+    return f"{region}{digits:04d}{letters}"
+
+
+def insert_batches(load_engine, table, rows, batch_size: int) -> int:
+    """Inserts an iterable of row dicts with one executemany per batch, each batch in its own transaction."""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            with load_engine.begin() as connection:
+                connection.execute(insert(table), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with load_engine.begin() as connection:
+            connection.execute(insert(table), batch)
+        total += len(batch)
+    return total
+
+
+def generate_garages(rng: random.Random, count: int):
+    cities, city_weights = zip(*[(city, weight) for city, weight in CITIES])
+    for garage_id in range(1, count + 1):
+        city = rng.choices(cities, city_weights)[0]
+        yield {
+            "id": garage_id,
+            "city": city,
+            "location": f"{city}, {rng.randint(1, 300)} {rng.choice(['Vitosha', 'Tsarigradsko', 'Bulgaria', 'Maritsa'])} Blvd",
+            "name": f"Garage{garage_id:05d}",
+            # Most garages are small, a few large service centres take many cars a day
+            "capacity": max(5, int(rng.lognormvariate(3.2, 0.6))),
+        }
+
+
+def generate_cars(rng: random.Random, count: int, car_garages: list, garage_weights: list[float]):
+    garage_ids = range(1, len(garage_weights) + 1)
+    cum_weights = []
+    running = 0.0
+    for weight in garage_weights:
+        running += weight
+        cum_weights.append(running)
+
+    makes, make_weights = zip(*[((make, models), weight) for make, models, weight in MAKES])
+    for car_id in range(1, count + 1):
+        make, models = rng.choices(makes, make_weights)[0]
+        # Every car is linked to 1-3 garages, popular garages get more cars
+        garages = tuple(sorted(set(rng.choices(garage_ids, cum_weights=cum_weights, k=rng.choice((1, 1, 2, 2, 3))))))
+        car_garages.append(garages)
+        yield {
+            "id": car_id,
+            "make": make,
+            "model": rng.choice(models),
+            "productionYear": min(2025, int(rng.triangular(1995, 2026, 2017))),
+            "licensePlate": license_plate(car_id),
+        }
+
+
+def generate_garage_cars(car_garages: list):
+    for car_id, garages in enumerate(car_garages, start=1):
+        for garage_id in garages:
+            yield {"carId": car_id, "garageId": garage_id}
+
+
+def generate_maintenances(rng: random.Random, count: int, car_garages: list, start: date, end: date):
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    services, service_weights = zip(*SERVICE_TYPES)
+    service_cum_weights = []
+    running = 0
+    for weight in service_weights:
+        running += weight
+        service_cum_weights.append(running)
+
+    car_count = len(car_garages)
+    last_day = len(days) - 1
+    random_ = rng.random
+    for _ in range(count):
+        # A fifth of the cars get most of the bookings
+        car_index = int(car_count * random_() ** 2)
+        garages = car_garages[car_index]
+        # sqrt skews the dates towards the end of the range, i.e. recent bookings are more common
+        day = days[int(last_day * random_() ** 0.5)]
+        if day.weekday() == 6 and random_() < 0.8:
+            day = day - timedelta(days=1) if day > start else day + timedelta(days=1)
+        yield {
+            "carId": car_index + 1,
+            "garageId": garages[0] if len(garages) == 1 else garages[int(random_() * len(garages))],
+            "serviceType": rng.choices(services, cum_weights=service_cum_weights)[0],
+            "scheduledDate": day,
+        }
+
+
+def generate_dataset(path: str, garages: int, cars: int, maintenances: int, seed: int = 42,
+                     start: date = date(2015, 1, 1), end: date = date(2025, 12, 31), batch_size: int = 50_000):
+    """
+    Builds a SQLite database file with a synthetic dataset of the given scale.
+
+    Secondary indexes are dropped during the load and created once at the end, which is much
+    faster than maintaining them row by row. The same seed always produces the same data.
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    load_engine = create_db_engine(f"sqlite:///{path}", pragmas=LOAD_PRAGMAS, pool_size=1, max_overflow=0)
+    rng = random.Random(seed)
+    timings = {}
+
+    run_migrations(load_engine)
+    tables = [Garage, Car, GarageCar, Maintenance]
+    for model in tables:
+        for index in model.__table__.indexes:
+            index.drop(load_engine)
+
+    started = time.perf_counter()
+    garage_weights = zipf_weights(garages, rng)
+    car_garages = []
+    insert_batches(load_engine, Garage.__table__, generate_garages(rng, garages), batch_size)
+    insert_batches(load_engine, Car.__table__, generate_cars(rng, cars, car_garages, garage_weights), batch_size)
+    insert_batches(load_engine, GarageCar.__table__, generate_garage_cars(car_garages), batch_size)
+    timings["garages_and_cars"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    insert_batches(load_engine, Maintenance.__table__, generate_maintenances(rng, maintenances, car_garages, start, end), batch_size)
+    timings["maintenances"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for model in tables:
+        for index in model.__table__.indexes:
+            index.create(load_engine)
+    with load_engine.begin() as connection:
+        refill_occupancy(connection)
+        refill_car_search(connection)
+        # Popular garages must be able to hold their busiest day, as they would in reality
+        connection.execute(text(
+            'UPDATE "Garage" SET capacity = MAX(capacity, '
+            '(SELECT COALESCE(MAX(requests), 0) FROM "GarageOccupancy" WHERE "garageId" = "Garage".id))'
+        ))
+        connection.execute(text("ANALYZE"))
+    timings["indexes_and_rollup"] = time.perf_counter() - started
+    load_engine.dispose()
+
+    # Switch the finished file to the journal mode the application runs with, WAL is persistent
+    final_engine = create_db_engine(f"sqlite:///{path}")
+    with final_engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    final_engine.dispose()
+    return timings
+
+
+def dataset_info_path(path: str) -> str:
+    return f"{path}.json"
+
+
+def ensure_dataset(path: str, **params) -> bool:
+    """
+    Generates the dataset at `path` unless a file built with the same parameters already exists.
+
+    Returns True when the dataset was (re)built. Benchmarks call this so the data is built once.
+    """
+    info_path = dataset_info_path(path)
+    arguments = inspect.signature(generate_dataset).bind(path, **params)
+    arguments.apply_defaults()
+    wanted = {key: str(value) for key, value in arguments.arguments.items() if key != "path"}
+    if os.path.exists(path) and os.path.exists(info_path):
+        with open(info_path) as info_file:
+            if json.load(info_file).get("params") == wanted:
+                return False
+
+    timings = generate_dataset(path, **params)
+    with open(info_path, "w") as info_file:
+        json.dump({"params": wanted, "timings": timings}, info_file, indent=2)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fill the database. Without arguments the small demo dataset is added to DATABASE_URL, "
+                    "with --garages/--cars/--maintenances a synthetic dataset is generated into --database."
+    )
+    parser.add_argument("--garages", type=int, help="Number of garages to generate")
+    parser.add_argument("--cars", type=int, help="Number of cars to generate")
+    parser.add_argument("--maintenances", type=int, help="Number of maintenances to generate")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed produces the same data")
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date(2015, 1, 1))
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date(2025, 12, 31))
+    parser.add_argument("--batch-size", type=int, default=50_000, help="Rows per INSERT executemany")
+    parser.add_argument("--database", default="dataset.db", help="SQLite file the synthetic dataset is written to")
+    parser.add_argument("--reuse", action="store_true", help="Keep the file if it was built with the same parameters")
+    args = parser.parse_args()
+
+    scale = (args.garages, args.cars, args.maintenances)
+    if scale == (None, None, None):
+        populate_demo()
+        return
+    if None in scale or min(scale) < 1:
+        parser.error("--garages, --cars and --maintenances must all be given and positive")
+
+    params = dict(
+        garages=args.garages, cars=args.cars, maintenances=args.maintenances, seed=args.seed,
+        start=args.start_date, end=args.end_date, batch_size=args.batch_size,
+    )
+    if not args.reuse and os.path.exists(dataset_info_path(args.database)):
+        os.remove(dataset_info_path(args.database))
+
+    started = time.perf_counter()
+    built = ensure_dataset(args.database, **params)
+
+    if built:
+        print(f"Generated {args.database} in {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"Reusing {args.database}, it was built with the same parameters")
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,7 @@
+from typing import Literal
+
 from pydantic import BaseModel
-from datetime import date
+from datetime import date, datetime
 
 class GarageValidation(BaseModel):
     id: int = None
@@ -76,4 +78,126 @@ class YearMonth(BaseModel):
 
 class MaintenanceMonthlyRequestsReport(BaseModel):
     yearMonth: YearMonth
-    requests: int
\ No newline at end of file
+    requests: int
+
+class MaintenanceValidationBulkPUT(MaintenanceValidationPOST):
+    id: int
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: int | None = None
+    error: str | None = None
+
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[BulkItemResult]
+
+
+class GarageAvailabilityRow(BaseModel):
+    id: int
+    name: str
+    city: str
+    capacity: int
+    availableCapacity: list[int]
+
+
+class GarageAvailabilityMatrix(BaseModel):
+    startDate: date
+    endDate: date
+    dates: list[date]
+    garages: list[GarageAvailabilityRow]
+
+
+class AvailableDay(BaseModel):
+    date: date
+    availableCapacity: int
+
+
+class GarageNextAvailable(BaseModel):
+    id: int
+    name: str
+    city: str
+    capacity: int
+    slots: list[AvailableDay]
+
+
+class DailyRequestsReport(BaseModel):
+    startDate: date
+    endDate: date
+    dates: list[date]
+    requests: list[int]
+
+
+class GarageUtilization(BaseModel):
+    id: int
+    name: str
+    city: str
+    capacity: int
+    requests: list[int]
+    utilization: list[float | None]
+    services: list[int]
+
+
+class ServiceTypeRequests(BaseModel):
+    serviceType: str
+    requests: list[int]
+
+
+class GarageUtilizationReport(BaseModel):
+    months: list[str]
+    serviceTypes: list[str]
+    garages: list[GarageUtilization]
+    serviceRequests: list[ServiceTypeRequests]
+
+
+class MonthPercentiles(BaseModel):
+    month: str
+    values: list[float]
+
+
+class UtilizationPercentilesReport(BaseModel):
+    percentiles: list[float]
+    garages: int
+    overall: list[float]
+    months: list[MonthPercentiles]
+
+
+class Change(BaseModel):
+    entity: str
+    id: int
+    operation: str
+    # The row as its GET by id returns it now, None once it is deleted
+    data: dict | None
+
+
+class ChangeFeed(BaseModel):
+    changes: list[Change]
+    cursor: str
+    hasMore: bool
+
+
+class ReportJobRequest(BaseModel):
+    report: Literal["daily", "monthly", "fleet"]
+    startDate: date
+    endDate: date
+    # The garage of a daily or monthly report
+    garageId: int | None = None
+    # A fleet report of the garages of this city only
+    city: str | None = None
+
+
+class ReportJobStatus(BaseModel):
+    id: str
+    report: str
+    parameters: dict
+    status: str
+    # Partitions of garages done, a daily or monthly report has one
+    progress: int
+    partitions: int
+    error: str | None
+    createdAt: datetime
+    finishedAt: datetime | None
+    expiresAt: datetime | None
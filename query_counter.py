@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    """Collects the SQL statements an engine executes while it is active."""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    """Count every statement sent to the database inside the `with` block."""
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._before_cursor_execute)
+
+
+def assert_constant_query_count(engine, run, grow):
+    """
+    Fail when the number of statements issued by `run` depends on the number of rows.
+
+    `run` performs the request (e.g. a TestClient call) and returns the number of rows it got back,
+    `grow` makes the second run return more rows, by adding rows to the database or raising the
+    page size of `run`. See benchmarks/query_counts.py.
+    """
+    with count_queries(engine) as before:
+        rows_before = run()
+    grow()
+    with count_queries(engine) as after:
+        rows_after = run()
+
+    if rows_after <= rows_before:
+        raise AssertionError(f"grow() did not add rows to the response ({rows_before} -> {rows_after})")
+    if after.count != before.count:
+        raise AssertionError(
+            f"Query count grew with the number of rows: {before.count} queries for {rows_before} rows, "
+            f"{after.count} queries for {rows_after} rows:\n" + "\n".join(after.statements)
+        )
+    return after.count
@@ -0,0 +1,360 @@
+"""
+Fleet-wide maintenance analytics: daily and monthly requests, and garage utilization.
+
+The maintenances are loaded grouped by (garage, day, service type) into parallel columns, see
+MaintenanceData, and kept in memory as a snapshot for REPORT_SNAPSHOT_TTL seconds. Two engines
+compute the same reports from it. PythonReportEngine loops over the groups and is the reference,
+NumpyReportEngine does the same with bincount over compact arrays. benchmarks/reports.py checks
+that they agree.
+"""
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Iterable, Sequence
+
+from sqlalchemy import String, cast, func, select, union_all
+from sqlalchemy.orm import Session
+
+from constants import REPORT_ENGINE, REPORT_SNAPSHOT_TTL
+from models import Maintenance, MaintenanceArchive
+
+# Imported by load_numpy on first use, it is the slowest import of the application
+numpy = None
+
+logger = logging.getLogger(__name__)
+
+
+def load_numpy() -> bool:
+    """Imports numpy into this module, False when it is not installed."""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:  # the Python engine computes the same reports, only slower
+            return False
+        numpy = module
+    return True
+
+SNAPSHOT_BATCH_SIZE = 100_000
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class MaintenanceData:
+    """Maintenances grouped by garage, day and service type, one group per position of the columns."""
+    garage_ids: Sequence[int]
+    days: Sequence[int]  # date.toordinal() of the scheduledDate
+    services: Sequence[int]  # index into service_types
+    counts: Sequence[int]  # maintenances in the group
+    service_types: list[str]
+
+
+class DayOrdinals(dict):
+    """ISO date text -> date.toordinal(), every distinct day is parsed once."""
+
+    def __missing__(self, day: str) -> int:
+        ordinal = self[day] = date.fromisoformat(day).toordinal()
+        return ordinal
+
+
+def maintenance_groups_query():
+    """
+    Maintenance counts per (garage, day, service type), the date as ISO text.
+
+    Hot and archived maintenances are grouped separately, a group in both tables comes twice and
+    the engines add up its counts.
+    """
+    # serviceType first: no index has that order, so SQLite scans the table instead of walking
+    # ix_Maintenance_garageId_scheduledDate with a row lookup per maintenance, which is slower
+    return union_all(*(
+        select(model.garageId, cast(model.scheduledDate, String), model.serviceType, func.count())
+        .group_by(model.serviceType, model.garageId, model.scheduledDate)
+        for model in (Maintenance, MaintenanceArchive)
+    ))
+
+
+def load_maintenance_groups(db: Session, batch_size: int = SNAPSHOT_BATCH_SIZE) -> Iterable[list]:
+    """Yields the rows of maintenance_groups_query in batches of `batch_size`."""
+    result = db.execute(maintenance_groups_query().execution_options(yield_per=batch_size))
+    yield from result.partitions()
+
+
+def month_offsets(start_date: date, end_date: date) -> list[int]:
+    """For every day of the range, the index of its month counted from the month of start_date."""
+    first = start_date.year * 12 + start_date.month - 1
+    days = (end_date - start_date).days + 1
+    offsets = []
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        offsets.append(day.year * 12 + day.month - 1 - first)
+    return offsets
+
+
+def month_starts(start_date: date, end_date: date) -> list[date]:
+    """The first day of every month touched by the range."""
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Linear interpolation between the closest ranks, numpy.percentile's default method."""
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class PythonReportEngine:
+    """Reference implementation, one loop over the groups per report."""
+    name = "python"
+
+    def prepare(self, batches: Iterable[list]) -> MaintenanceData:
+        garage_ids, days, services, counts = [], [], [], []
+        codes, ordinals = {}, DayOrdinals()
+        for batch in batches:
+            for garage_id, day, service_type, count in batch:
+                garage_ids.append(garage_id)
+                days.append(ordinals[day])
+                services.append(codes.setdefault(service_type, len(codes)))
+                counts.append(count)
+        return MaintenanceData(garage_ids, days, services, counts, list(codes))
+
+    def daily(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids: set | None = None) -> list[int]:
+        """Maintenances on every day of the range, of the given garages or of all of them."""
+        start, end = start_date.toordinal(), end_date.toordinal()
+        requests = [0] * (end - start + 1)
+        for garage_id, day, count in zip(data.garage_ids, data.days, data.counts):
+            if start <= day <= end and (garage_ids is None or garage_id in garage_ids):
+                requests[day - start] += count
+        return requests
+
+    def monthly(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids: set | None = None) -> list[int]:
+        """Maintenances per month of the range, only counting its days."""
+        requests = [0] * len(month_starts(start_date, end_date))
+        for month, count in zip(month_offsets(start_date, end_date), self.daily(data, start_date, end_date, garage_ids)):
+            requests[month] += count
+        return requests
+
+    def utilization(self, data: MaintenanceData, capacities: dict, start_date: date, end_date: date) -> dict:
+        """
+        The garage x month x service type counts of the garages in `capacities` (id -> capacity).
+
+        Returns their projections, in the order of the sorted garage ids and of data.service_types:
+        requests (garage x month), services (garage x service type), serviceRequests (service type x
+        month), and utilization (garage x month), the requests divided by the capacity of the days
+        of the month within the range, None for garages without capacity.
+        """
+        start, end = start_date.toordinal(), end_date.toordinal()
+        months = month_offsets(start_date, end_date)
+        month_count = len(month_starts(start_date, end_date))
+        service_count = len(data.service_types)
+        rows = {garage_id: position for position, garage_id in enumerate(sorted(capacities))}
+
+        requests = [[0] * month_count for _ in rows]
+        services = [[0] * service_count for _ in rows]
+        service_requests = [[0] * month_count for _ in range(service_count)]
+        for garage_id, day, service, count in zip(data.garage_ids, data.days, data.services, data.counts):
+            row = rows.get(garage_id)
+            if row is None or not start <= day <= end:
+                continue
+            month = months[day - start]
+            requests[row][month] += count
+            services[row][service] += count
+            service_requests[service][month] += count
+
+        days_per_month = [0] * month_count
+        for month in months:
+            days_per_month[month] += 1
+        utilization = []
+        for garage_id, garage_requests in zip(sorted(capacities), requests):
+            capacity = capacities[garage_id]
+            utilization.append([
+                count / (capacity * days) if capacity > 0 else None
+                for count, days in zip(garage_requests, days_per_month)
+            ])
+        return {
+            "requests": requests,
+            "services": services,
+            "serviceRequests": service_requests,
+            "utilization": utilization,
+            "daysPerMonth": days_per_month,
+        }
+
+    def utilization_percentiles(
+        self, data: MaintenanceData, capacities: dict, start_date: date, end_date: date, percentiles: Sequence[float]
+    ) -> dict:
+        """Percentiles of the garage utilization per month and over the whole range, garages without capacity left out."""
+        cube = self.utilization(data, capacities, start_date, end_date)
+        total_days = sum(cube["daysPerMonth"])
+        monthly, overall = [], []
+        used = [
+            (capacities[garage_id], requests, utilization)
+            for garage_id, requests, utilization in zip(sorted(capacities), cube["requests"], cube["utilization"])
+            if capacities[garage_id] > 0
+        ]
+        if used:
+            for month in range(len(cube["daysPerMonth"])):
+                values = sorted(utilization[month] for _, _, utilization in used)
+                monthly.append([percentile(values, q) for q in percentiles])
+            values = sorted(sum(requests) / (capacity * total_days) for capacity, requests, _ in used)
+            overall = [percentile(values, q) for q in percentiles]
+        return {"monthly": monthly, "overall": overall, "garages": len(used)}
+
+
+class NumpyReportEngine(PythonReportEngine):
+    """The same reports as PythonReportEngine, vectorized with bincount over compact arrays."""
+    name = "numpy"
+
+    def __init__(self):
+        if not load_numpy():
+            raise RuntimeError("The numpy report engine needs numpy, install it or set REPORT_ENGINE=python")
+
+    def prepare(self, batches: Iterable[list]) -> MaintenanceData:
+        columns = ([], [], [], [])
+        codes, ordinals = {}, DayOrdinals()
+        for batch in batches:
+            garage_ids, days, service_types, counts = zip(*batch)
+            columns[0].append(numpy.array(garage_ids, dtype=numpy.int32))
+            columns[1].append(numpy.array([ordinals[day] for day in days], dtype=numpy.int32))
+            columns[2].append(numpy.array([codes.setdefault(name, len(codes)) for name in service_types], dtype=numpy.int16))
+            columns[3].append(numpy.array(counts, dtype=numpy.int32))
+        dtypes = (numpy.int32, numpy.int32, numpy.int16, numpy.int32)
+        arrays = [numpy.concatenate(parts) if parts else numpy.zeros(0, dtype) for parts, dtype in zip(columns, dtypes)]
+        return MaintenanceData(*arrays, list(codes))
+
+    def _in_range(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids=None):
+        mask = (data.days >= start_date.toordinal()) & (data.days <= end_date.toordinal())
+        if garage_ids is not None:
+            mask &= numpy.isin(data.garage_ids, numpy.fromiter(garage_ids, dtype=numpy.int64))
+        return mask
+
+    def _month_offsets(self, start_date: date, end_date: date):
+        days = numpy.arange(numpy.datetime64(start_date), numpy.datetime64(end_date) + 1)
+        return (days.astype("datetime64[M]") - numpy.datetime64(start_date, "M")).astype(numpy.int64)
+
+    def _daily(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids=None):
+        mask = self._in_range(data, start_date, end_date, garage_ids)
+        length = (end_date - start_date).days + 1
+        # Float weights hold the sums exactly up to 2**53
+        return numpy.bincount(
+            data.days[mask] - start_date.toordinal(), weights=data.counts[mask], minlength=length
+        ).astype(numpy.int64)
+
+    def daily(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids: set | None = None) -> list[int]:
+        return self._daily(data, start_date, end_date, garage_ids).tolist()
+
+    def monthly(self, data: MaintenanceData, start_date: date, end_date: date, garage_ids: set | None = None) -> list[int]:
+        daily = self._daily(data, start_date, end_date, garage_ids)
+        months = self._month_offsets(start_date, end_date)
+        return numpy.bincount(months, weights=daily, minlength=months[-1] + 1).astype(numpy.int64).tolist()
+
+    def _cube(self, data: MaintenanceData, capacities: dict, start_date: date, end_date: date):
+        garage_ids = sorted(capacities)
+        # Row of every garage id in the cube, -1 for the garages that are not selected
+        size = max(garage_ids[-1] if garage_ids else 0, int(data.garage_ids.max()) if len(data.garage_ids) else 0) + 1
+        row_of = numpy.full(size, -1, dtype=numpy.int64)
+        row_of[garage_ids] = numpy.arange(len(garage_ids))
+        rows = row_of[data.garage_ids]
+        mask = self._in_range(data, start_date, end_date) & (rows >= 0)
+
+        months = self._month_offsets(start_date, end_date)
+        shape = (len(garage_ids), int(months[-1]) + 1, len(data.service_types))
+        index = (rows[mask] * shape[1] + months[data.days[mask] - start_date.toordinal()]) * shape[2] + data.services[mask]
+        cube = numpy.bincount(index, weights=data.counts[mask], minlength=math.prod(shape)).astype(numpy.int64)
+        days_per_month = numpy.bincount(months, minlength=shape[1])
+        capacity = numpy.array([capacities[garage_id] for garage_id in garage_ids], dtype=numpy.float64)
+        return cube.reshape(shape), days_per_month, capacity
+
+    def utilization(self, data: MaintenanceData, capacities: dict, start_date: date, end_date: date) -> dict:
+        cube, days_per_month, capacity = self._cube(data, capacities, start_date, end_date)
+        requests = cube.sum(axis=2)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            utilization = requests / (capacity[:, None] * days_per_month[None, :])
+        return {
+            "requests": requests.tolist(),
+            "services": cube.sum(axis=1).tolist(),
+            "serviceRequests": cube.sum(axis=0).T.tolist(),
+            "utilization": [
+                row if garage_capacity > 0 else [None] * len(row)
+                for row, garage_capacity in zip(utilization.tolist(), capacity.tolist())
+            ],
+            "daysPerMonth": days_per_month.tolist(),
+        }
+
+    def utilization_percentiles(
+        self, data: MaintenanceData, capacities: dict, start_date: date, end_date: date, percentiles: Sequence[float]
+    ) -> dict:
+        cube, days_per_month, capacity = self._cube(data, capacities, start_date, end_date)
+        used = capacity > 0
+        if not used.any():
+            return {"monthly": [], "overall": [], "garages": 0}
+        requests = cube.sum(axis=2)[used]
+        utilization = requests / (capacity[used, None] * days_per_month[None, :])
+        overall = requests.sum(axis=1) / (capacity[used] * days_per_month.sum())
+        return {
+            "monthly": numpy.percentile(utilization, percentiles, axis=0).T.tolist(),
+            "overall": numpy.percentile(overall, percentiles).tolist(),
+            "garages": int(used.sum()),
+        }
+
+
+ENGINES = {engine.name: engine for engine in (PythonReportEngine, NumpyReportEngine)}
+
+
+def report_engine(name: str = REPORT_ENGINE) -> PythonReportEngine:
+    """The configured engine, the Python one when numpy is not installed."""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown REPORT_ENGINE '{name}', use one of {list(ENGINES)}")
+    if name == "numpy" and not load_numpy():
+        logger.warning("numpy is not installed, using the python report engine")
+        name = "python"
+    return ENGINES[name]()
+
+
+class ReportSnapshot:
+    """
+    The MaintenanceData of an engine, reloaded when older than `ttl` seconds.
+
+    While one request reloads an expired snapshot, the others keep answering from the previous one.
+    Without `engine`, the configured one is created on first use.
+    """
+
+    def __init__(self, engine: PythonReportEngine | None, ttl: float):
+        self._engine = engine
+        self.ttl = ttl
+        self.data: MaintenanceData | None = None
+        self.loaded_at = 0.0
+        self._loading = threading.Lock()
+
+    @property
+    def engine(self) -> PythonReportEngine:
+        if self._engine is None:
+            self._engine = report_engine()
+        return self._engine
+
+    def get(self, db: Session) -> MaintenanceData:
+        data = self.data
+        if data is not None and time.monotonic() - self.loaded_at < self.ttl:
+            return data
+        if not self._loading.acquire(blocking=data is None):
+            return data
+        try:
+            if self.data is None or time.monotonic() - self.loaded_at >= self.ttl:
+                self.data = self.engine.prepare(load_maintenance_groups(db))
+                self.loaded_at = time.monotonic()
+            return self.data
+        finally:
+            self._loading.release()
+
+    def clear(self):
+        self.data = None
+
+
+report_snapshot = ReportSnapshot(None, REPORT_SNAPSHOT_TTL)
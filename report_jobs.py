@@ -0,0 +1,268 @@
+"""
+Report jobs: long reports built on a process pool instead of in a request, see POST /reports/jobs.
+
+A job is the daily or the monthly report of one garage, or a fleet report: the monthly report of
+every garage, or of the garages of a city. A fleet is split by garage into partitions which run in
+parallel on the pool of the worker that accepted the job, each in its own process with its own
+read connection and the builders of routes/reports.py. ReportJob holds the status and the
+partitions done, so every worker can answer the polls. The result is written to REPORT_JOB_DIR
+and served until REPORT_JOB_TTL seconds after the job finished.
+
+An identical request submitted while a job runs gets that job: ReportJob.activeKey holds the key
+of the request until the job ends, and its unique index makes a second insert fail.
+
+    python report_jobs.py prune
+    python report_jobs.py status
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from constants import (
+    REPORT_JOB_DIR, REPORT_JOB_MAX_ACTIVE, REPORT_JOB_PROCESSES, REPORT_JOB_TIMEOUT, REPORT_JOB_TTL, read_session,
+    session,
+)
+from models import Garage, ReportJob
+from routes.reports import AVAILABILITY_COLUMNS, AVAILABILITY_FIELDS, build_daily_report, build_monthly_report
+from serialization import dumps
+
+logger = logging.getLogger("carmanagement.report_jobs")
+
+DAILY = "daily"
+MONTHLY = "monthly"
+FLEET = "fleet"
+REPORTS = (DAILY, MONTHLY, FLEET)
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A fleet is cut into this many partitions per process, so the processes stay busy until the end
+# even when some garages have many more maintenances than others
+PARTITIONS_PER_PROCESS = 4
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """The pool of this worker, started on the first job."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: a forked child would inherit the worker's threads and open connections
+            _pool = ProcessPoolExecutor(REPORT_JOB_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def job_key(parameters: dict) -> str:
+    return hashlib.blake2b(json.dumps(parameters, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def result_path(job_id: str) -> str:
+    return os.path.join(REPORT_JOB_DIR, f"{job_id}.json")
+
+
+def select_report_garages(db: Session, garage_id: int | None, city: str | None) -> list[dict]:
+    """The garages a report covers, by id, deleted ones excluded."""
+    statement = select(*AVAILABILITY_COLUMNS).where(Garage.deletedAt.is_(None)).order_by(Garage.id)
+    if garage_id is not None:
+        statement = statement.where(Garage.id == garage_id)
+    if city:
+        statement = statement.where(Garage.city == city)
+    return [dict(zip(AVAILABILITY_FIELDS, row)) for row in db.execute(statement)]
+
+
+def partition(garages: list[dict]) -> list[list[dict]]:
+    """Consecutive slices of the garages, at most PARTITIONS_PER_PROCESS per process of the pool."""
+    count = min(len(garages), REPORT_JOB_PROCESSES * PARTITIONS_PER_PROCESS)
+    size = -(-len(garages) // count)
+    return [garages[start:start + size] for start in range(0, len(garages), size)]
+
+
+def run_partition(report: str, garages: list[dict], start_date: date, end_date: date) -> list:
+    """Runs in a process of the pool: the report of every garage of the partition, in order."""
+    with read_session() as db:
+        if report == DAILY:
+            return [build_daily_report(db, garage["id"], start_date, end_date, garage["capacity"]) for garage in garages]
+        return [build_monthly_report(db, garage["id"], start_date, end_date) for garage in garages]
+
+
+def find_active_job(db: Session, key: str) -> ReportJob | None:
+    return db.scalar(select(ReportJob).where(ReportJob.activeKey == key))
+
+
+def submit_job(db: Session, parameters: dict, garages: list[dict]) -> ReportJob:
+    """
+    Starts the report of `parameters` over `garages` on the pool, or returns the running identical job.
+
+    The caller checks is_full first, the limit is not enforced here.
+    """
+    key = job_key(parameters)
+    existing = find_active_job(db, key)
+    if existing is not None:
+        return existing
+
+    report = parameters["report"]
+    partitions = partition(garages) if report == FLEET else [garages]
+    job = ReportJob(
+        id=uuid.uuid4().hex, report=report, parameters=json.dumps(parameters), activeKey=key, status=RUNNING,
+        partitions=len(partitions), progress=0, createdAt=datetime.now(),
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Submitted concurrently, by this worker or another one
+        db.rollback()
+        return find_active_job(db, key) or submit_job(db, parameters, garages)
+
+    run = JobRun(job.id, report, partitions)
+    start_date, end_date = date.fromisoformat(parameters["startDate"]), date.fromisoformat(parameters["endDate"])
+    pool = process_pool()
+    for index, garages_of_partition in enumerate(partitions):
+        future = pool.submit(run_partition, report, garages_of_partition, start_date, end_date)
+        future.add_done_callback(partial(run.partition_done, index))
+    return job
+
+
+class JobRun:
+    """Collects the partitions of a job as the pool finishes them, then stores the result."""
+
+    def __init__(self, job_id: str, report: str, partitions: list[list[dict]]):
+        self.job_id = job_id
+        self.report = report
+        self.partitions = partitions
+        self.results = [None] * len(partitions)
+        self.remaining = len(partitions)
+        self.failed = False
+        self._lock = threading.Lock()
+
+    def partition_done(self, index: int, future: Future):
+        # Called by the pool's management thread, an exception here would be lost
+        try:
+            error = future.exception()
+            with self._lock:
+                if self.failed:
+                    return
+                if error is not None:
+                    self.failed = True
+                else:
+                    self.results[index] = future.result()
+                    self.remaining -= 1
+                finished = self.remaining == 0
+            if error is not None:
+                finish_job(self.job_id, FAILED, error=f"{type(error).__name__}: {error}")
+            elif finished:
+                save_result(self.job_id, self.merged())
+                finish_job(self.job_id, DONE)
+            else:
+                with session() as db:
+                    db.execute(update(ReportJob).where(ReportJob.id == self.job_id).values(progress=ReportJob.progress + 1))
+                    db.commit()
+        except Exception:
+            logger.exception("Report job %s failed", self.job_id)
+            finish_job(self.job_id, FAILED, error="Internal error")
+
+    def merged(self):
+        """The daily or monthly report as its GET endpoint returns it, or one entry per garage of a fleet."""
+        if self.report != FLEET:
+            return self.results[0][0]
+        return [
+            {**garage, "months": report}
+            for garages, reports in zip(self.partitions, self.results)
+            for garage, report in zip(garages, reports)
+        ]
+
+
+def save_result(job_id: str, content):
+    """Writes the result file under a temporary name first, a reader never sees half of it."""
+    os.makedirs(REPORT_JOB_DIR, exist_ok=True)
+    path = result_path(job_id)
+    with open(path + ".tmp", "wb") as output:
+        output.write(dumps(content))
+    os.replace(path + ".tmp", path)
+
+
+def finish_job(job_id: str, status: str, error: str | None = None):
+    now = datetime.now()
+    with session() as db:
+        values = {
+            "status": status, "activeKey": None, "error": error, "finishedAt": now,
+            "expiresAt": now + timedelta(seconds=REPORT_JOB_TTL),
+        }
+        if status == DONE:
+            values["progress"] = ReportJob.partitions
+        # A job given up by prune_jobs stays failed
+        db.execute(update(ReportJob).where(ReportJob.id == job_id, ReportJob.status == RUNNING).values(**values))
+        db.commit()
+
+
+def read_result(job_id: str) -> bytes | None:
+    try:
+        with open(result_path(job_id), "rb") as result:
+            return result.read()
+    except FileNotFoundError:
+        return None
+
+
+def prune_jobs(db: Session, now: datetime | None = None) -> tuple[int, int]:
+    """
+    Gives up the jobs running for longer than REPORT_JOB_TIMEOUT and deletes the expired ones with their results.
+
+    Returns how many jobs were given up and deleted.
+    """
+    now = now or datetime.now()
+    given_up = db.execute(
+        update(ReportJob)
+        .where(ReportJob.status == RUNNING, ReportJob.createdAt < now - timedelta(seconds=REPORT_JOB_TIMEOUT))
+        .values(
+            status=FAILED, activeKey=None, error="Timed out", finishedAt=now,
+            expiresAt=now + timedelta(seconds=REPORT_JOB_TTL),
+        )
+    ).rowcount
+    expired = db.scalars(select(ReportJob.id).where(ReportJob.expiresAt < now)).all()
+    if expired:
+        db.execute(delete(ReportJob).where(ReportJob.id.in_(expired)))
+    db.commit()
+    for job_id in expired:
+        try:
+            os.remove(result_path(job_id))
+        except FileNotFoundError:
+            pass
+    return given_up, len(expired)
+
+
+def is_full(db: Session) -> bool:
+    """Whether REPORT_JOB_MAX_ACTIVE jobs are running already, over all workers."""
+    return db.scalar(select(func.count()).where(ReportJob.status == RUNNING)) >= REPORT_JOB_MAX_ACTIVE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune or inspect the report jobs.")
+    parser.add_argument("command", choices=["prune", "status"])
+    args = parser.parse_args()
+
+    with session() as db:
+        if args.command == "prune":
+            given_up, deleted = prune_jobs(db)
+            print(f"Gave up {given_up} jobs, deleted {deleted} expired jobs")
+        else:
+            for status, count in db.execute(select(ReportJob.status, func.count()).group_by(ReportJob.status)):
+                print(f"{status}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import exists, select
+from sqlalchemy.orm import Session
+
+from constants import get_read_db
+from instrumentation import InstrumentedRoute
+from models import Garage
+from pydantic_models import (
+    DailyRequestsReport, GarageUtilizationReport, MaintenanceMonthlyRequestsReport, UtilizationPercentilesReport,
+)
+from report_engines import DEFAULT_PERCENTILES, month_starts, report_snapshot
+from routes.reports import AVAILABILITY_COLUMNS, AVAILABILITY_FIELDS, year_month
+from serialization import FastJSONResponse
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+MAX_REPORT_DAYS = 10 * 366
+UTILIZATION_DIGITS = 4
+
+# Like the availability endpoints, the reports are built to match their response models and
+# returned as FastJSONResponse without re-validating every value
+
+
+def check_range(start_date: date, end_date: date):
+    days = (end_date - start_date).days + 1
+    if days < 1:
+        raise HTTPException(status_code=400, detail="endDate must not be before startDate")
+    if days > MAX_REPORT_DAYS:
+        raise HTTPException(status_code=400, detail=f"The date range is limited to {MAX_REPORT_DAYS} days")
+
+
+def select_garages(db: Session, city: str | None, garage_id: int | None) -> dict:
+    """The garages of the filters by id, with their name, city and capacity."""
+    statement = select(*AVAILABILITY_COLUMNS).where(Garage.deletedAt.is_(None))
+    if city:
+        statement = statement.where(Garage.city == city)
+    if garage_id is not None:
+        statement = statement.where(Garage.id == garage_id)
+    garages = {row.id: dict(zip(AVAILABILITY_FIELDS, row)) for row in db.execute(statement)}
+    if not garages and (city or garage_id is not None):
+        raise HTTPException(status_code=404, detail="Garage not found")
+    return garages
+
+
+def filtered_garage_ids(db: Session, city: str | None, garage_id: int | None) -> set | None:
+    """The garage ids to count, None for the whole fleet."""
+    if not city and garage_id is None:
+        # The snapshot still holds the maintenances of soft deleted garages until they are purged
+        if db.scalar(select(exists().where(Garage.deletedAt.is_not(None)))) is False:
+            return None
+    return set(select_garages(db, city, garage_id))
+
+
+def month_labels(start_date: date, end_date: date) -> list[str]:
+    return [month.strftime("%Y-%m") for month in month_starts(start_date, end_date)]
+
+
+def round_utilization(value: float | None) -> float | None:
+    return None if value is None else round(value, UTILIZATION_DIGITS)
+
+
+@router.get("/daily", response_model=DailyRequestsReport)
+def daily_requests(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    garageId: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+    check_range(startDate, endDate)
+    garage_ids = filtered_garage_ids(db, city, garageId)
+    requests = report_snapshot.engine.daily(report_snapshot.get(db), startDate, endDate, garage_ids)
+    dates = [date.fromordinal(startDate.toordinal() + offset).isoformat() for offset in range(len(requests))]
+    return FastJSONResponse({"startDate": str(startDate), "endDate": str(endDate), "dates": dates, "requests": requests})
+
+
+@router.get("/monthly", response_model=list[MaintenanceMonthlyRequestsReport])
+def monthly_requests(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    garageId: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+    check_range(startDate, endDate)
+    garage_ids = filtered_garage_ids(db, city, garageId)
+    requests = report_snapshot.engine.monthly(report_snapshot.get(db), startDate, endDate, garage_ids)
+    return FastJSONResponse([
+        {"yearMonth": year_month(month.year, month.month), "requests": count}
+        for month, count in zip(month_starts(startDate, endDate), requests)
+    ])
+
+
+@router.get("/utilization", response_model=GarageUtilizationReport)
+def garage_utilization(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    garageId: int | None = None,
+    db: Session = Depends(get_read_db),
+):
+    check_range(startDate, endDate)
+    garages = select_garages(db, city, garageId)
+    data = report_snapshot.get(db)
+    capacities = {garage_id: garage["capacity"] for garage_id, garage in garages.items()}
+    cube = report_snapshot.engine.utilization(data, capacities, startDate, endDate)
+
+    # Service types in alphabetical order, the snapshot numbers them in the order it met them
+    order = sorted(range(len(data.service_types)), key=data.service_types.__getitem__)
+    rows = []
+    for garage_id, requests, services, utilization in zip(
+        sorted(garages), cube["requests"], cube["services"], cube["utilization"]
+    ):
+        rows.append({
+            **garages[garage_id],
+            "requests": requests,
+            "utilization": [round_utilization(value) for value in utilization],
+            "services": [services[service] for service in order],
+        })
+    return FastJSONResponse({
+        "months": month_labels(startDate, endDate),
+        "serviceTypes": [data.service_types[service] for service in order],
+        "garages": rows,
+        "serviceRequests": [
+            {"serviceType": data.service_types[service], "requests": cube["serviceRequests"][service]}
+            for service in order
+        ],
+    })
+
+
+@router.get("/utilizationPercentiles", response_model=UtilizationPercentilesReport)
+def utilization_percentiles(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    percentiles: list[float] = Query(list(DEFAULT_PERCENTILES)),
+    db: Session = Depends(get_read_db),
+):
+    check_range(startDate, endDate)
+    if any(not 0 <= value <= 100 for value in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    garages = select_garages(db, city, None)
+    capacities = {garage_id: garage["capacity"] for garage_id, garage in garages.items()}
+    result = report_snapshot.engine.utilization_percentiles(
+        report_snapshot.get(db), capacities, startDate, endDate, percentiles
+    )
+    return FastJSONResponse({
+        "percentiles": percentiles,
+        "garages": result["garages"],
+        "overall": [round_utilization(value) for value in result["overall"]],
+        "months": [
+            {"month": month, "values": [round_utilization(value) for value in values]}
+            for month, values in zip(month_labels(startDate, endDate), result["monthly"])
+        ],
+    })
@@ -0,0 +1,40 @@
+from fastapi import HTTPException
+
+from pydantic_models import BulkItemResult
+
+BULK_MAX_ITEMS = 50_000
+BULK_CHUNK_SIZE = 1_000
+# Kept below SQLite's limit on bound parameters per statement
+IN_CLAUSE_SIZE = 10_000
+
+
+def chunked(items: list, size: int):
+    """Yields consecutive slices of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def check_bulk_size(items: list):
+    if not items:
+        raise HTTPException(status_code=400, detail="No items were sent")
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} items can be sent at once")
+
+
+def select_in(db, statement, column, values) -> list:
+    """Runs `statement` filtered on `column IN values`, splitting very long IN lists."""
+    rows = []
+    for part in chunked(sorted(set(values)), IN_CLAUSE_SIZE):
+        rows.extend(db.execute(statement.where(column.in_(part))).all())
+    return rows
+
+
+def save_error(error: Exception) -> str:
+    """Per-item message for the items of a chunk whose transaction failed."""
+    return f"Could not be saved: {getattr(error, 'orig', None) or error}"
+
+
+def bulk_response(results: list[BulkItemResult]) -> dict:
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.error is not None)
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
@@ -1,111 +1,311 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from itertools import groupby
 
-from constants import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, selectinload
+
+from car_search import MIN_TERM_LENGTH, RANK_KEY, index_car, index_cars, is_ranked, match_cars, search_terms
+from cache import CacheValue, cached_response, car_tags, invalidate_car
+from changes import CAR, CREATED, UPDATED, record_change, record_changes
+from constants import FAST_SERIALIZATION, get_db, get_read_db
+from deletion import delete_car_rows
+from instrumentation import InstrumentedRoute
 from models import Car, Garage, Maintenance, GarageCar
-from pydantic_models import CarValidationPOST, CarValidationGET
+from pydantic_models import BulkItemResult, BulkResponse, CarValidationPOST, CarValidationGET
+from routes.bulk import BULK_CHUNK_SIZE, bulk_response, check_bulk_size, chunked, save_error, select_in
+from routes.export import export_response, stream_rows
+from routes.garages import GARAGE_COLUMNS, GARAGE_FIELDS
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_id, decode_cursor, fetch_page, fetch_rows
+from serialization import page_response
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+def plate_taken(license_plate: str) -> HTTPException:
+    return HTTPException(status_code=409, detail=f"License plate {license_plate} already exists")
+
 
-router = APIRouter()
+def flush_car(db: Session, license_plate: str):
+    """Flushes a new or changed car, ux_Car_licensePlate rejecting the plate becomes a 409."""
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise plate_taken(license_plate)
 
 
 @router.post("/", response_model=CarValidationGET)
 def create_car(car_data: CarValidationPOST, db: Session = Depends(get_db)):
     # Fetch garages by IDs
-    garages = db.query(Garage).filter(Garage.id.in_(car_data.garage_ids)).all()
+    garages = db.query(Garage).filter(Garage.id.in_(car_data.garageIds), Garage.deletedAt.is_(None)).all()
 
     # Validate that all provided garage IDs exist
-    if len(garages) != len(car_data.garage_ids):
+    if len(garages) != len(set(car_data.garageIds)):
         raise HTTPException(status_code=404, detail="Some garages were not found")
 
     # Create a new Car instance
     new_car = Car(
         make=car_data.make,
         model=car_data.model,
-        productionYear=car_data.production_year,
-        licensePlate=car_data.license_plate,
+        productionYear=car_data.productionYear,
+        licensePlate=car_data.licensePlate,
         garages=garages,
     )
 
     db.add(new_car)
+    flush_car(db, car_data.licensePlate)
+    index_car(db, new_car)
+    record_change(db, CAR, CREATED, new_car.id)
     db.commit()
     db.refresh(new_car)
     return new_car
 
 
+@router.post("/bulk", response_model=BulkResponse)
+def create_cars_bulk(cars: list[CarValidationPOST], db: Session = Depends(get_db)):
+    check_bulk_size(cars)
+
+    # Validate all referenced garages and license plates with one query each
+    garage_ids = set(
+        garage_id for (garage_id,) in select_in(db, select(Garage.id).where(Garage.deletedAt.is_(None)), Garage.id, [g for car in cars for g in car.garageIds])
+    )
+    taken_plates = set(
+        plate for (plate,) in select_in(db, select(Car.licensePlate), Car.licensePlate, [car.licensePlate for car in cars])
+    )
+
+    results = []
+    valid = []
+    for index, car in enumerate(cars):
+        if not set(car.garageIds) <= garage_ids:
+            results.append(BulkItemResult(index=index, error="Some garages were not found"))
+        elif car.licensePlate in taken_plates:
+            results.append(BulkItemResult(index=index, error=f"License plate {car.licensePlate} already exists"))
+        else:
+            taken_plates.add(car.licensePlate)
+            valid.append((index, car))
+
+    for chunk in chunked(valid, BULK_CHUNK_SIZE):
+        try:
+            new_ids = db.scalars(
+                insert(Car).returning(Car.id, sort_by_parameter_order=True),
+                [
+                    {"make": car.make, "model": car.model, "productionYear": car.productionYear, "licensePlate": car.licensePlate}
+                    for _, car in chunk
+                ],
+            ).all()
+            links = [
+                {"carId": car_id, "garageId": garage_id}
+                for (_, car), car_id in zip(chunk, new_ids) for garage_id in set(car.garageIds)
+            ]
+            if links:
+                db.execute(insert(GarageCar), links)
+            index_cars(db, [
+                {"id": car_id, "licensePlate": car.licensePlate, "make": car.make, "model": car.model}
+                for (_, car), car_id in zip(chunk, new_ids)
+            ])
+            record_changes(db, CAR, CREATED, new_ids)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            results.extend(BulkItemResult(index=index, error=save_error(e)) for index, _ in chunk)
+            continue
+        results.extend(BulkItemResult(index=index, id=car_id) for (index, _), car_id in zip(chunk, new_ids))
+
+    return bulk_response(results)
+
+
+# Columns of CarValidationGET, in the order of its fields
+CAR_COLUMNS = (Car.id, Car.make, Car.model, Car.productionYear, Car.licensePlate)
+
+
+def filter_cars(query, car_make: str | None, garage_id: int | None, from_year: int | None, to_year: int | None):
+    """The filters of list_cars, for a Query or a select()."""
+    query = query.filter(Car.deletedAt.is_(None))
+    if car_make:
+        query = query.filter(Car.make == car_make)
+
+    if from_year:
+        query = query.filter(Car.productionYear >= from_year)
+
+    if to_year:
+        query = query.filter(Car.productionYear <= to_year)
+
+    if garage_id:
+        query = query.join(GarageCar).filter(GarageCar.garageId == garage_id)
+    return query
+
+
+def add_garage_rows(db: Session, cars: list[dict]) -> list[dict]:
+    """Fills the garages of car rows with one query, the same one selectinload(Car.garages) sends."""
+    garages = {car["id"]: [] for car in cars}
+    if garages:
+        statement = (
+            select(GarageCar.carId, *GARAGE_COLUMNS)
+            .join(GarageCar, GarageCar.garageId == Garage.id)
+            .where(GarageCar.carId.in_(list(garages)))
+        )
+        for car_id, *garage in db.execute(statement):
+            garages[car_id].append(dict(zip(GARAGE_FIELDS, garage)))
+    for car in cars:
+        car["garages"] = garages[car["id"]]
+    return cars
+
+
+def list_car_rows(db: Session, statement, limit: int, response: Response) -> list[dict]:
+    """Fast path of list_cars, see FAST_SERIALIZATION."""
+    return add_garage_rows(db, fetch_rows(db, statement, limit, response, lambda car: (car["id"],)))
+
+
+CAR_EXPORT_COLUMNS = ["id", "make", "model", "productionYear", "licensePlate", "garageIds"]
+
+
+def car_export_rows(statement):
+    """Folds the one-row-per-garage result of `statement` (ordered by car id) into one row per car."""
+    for _, rows in groupby(stream_rows(statement), key=lambda row: row["id"]):
+        rows = list(rows)
+        yield {**rows[0], "garageIds": [row["garageId"] for row in rows if row["garageId"] is not None]}
+
+
+@router.get("/export")
+def export_cars(
+    car_make: str | None = None,
+    garage_id: int | None = None,
+    from_year: int | None = None,
+    to_year: int | None = None,
+    format: str = "ndjson",
+    gzip: bool = False,
+):
+    statement = (
+        select(Car.id, Car.make, Car.model, Car.productionYear, Car.licensePlate, GarageCar.garageId)
+        .outerjoin(GarageCar, GarageCar.carId == Car.id)
+        .where(Car.deletedAt.is_(None))
+        .order_by(Car.id, GarageCar.garageId)
+    )
+
+    if car_make:
+        statement = statement.filter(Car.make == car_make)
+    if from_year:
+        statement = statement.filter(Car.productionYear >= from_year)
+    if to_year:
+        statement = statement.filter(Car.productionYear <= to_year)
+    if garage_id:
+        # The car keeps all of its garageIds in the export, so the garage is filtered in a subquery
+        statement = statement.filter(Car.id.in_(select(GarageCar.carId).where(GarageCar.garageId == garage_id)))
+
+    return export_response(car_export_rows(statement), CAR_EXPORT_COLUMNS, format, gzip, "cars")
+
+
+SEARCH_PAGE_SIZE = 20
+
+
+def search_car_rows(db: Session, q: str, limit: int, after: str | None, response: Response) -> list[dict]:
+    """A page of the cars matching every term of `q`, see car_search.py for the order."""
+    terms = search_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail=f"Search terms must have at least {MIN_TERM_LENGTH} characters")
+    last = None
+    if after:
+        last = decode_cursor(after, 2)
+        if type(last[1]) is not int or not (last[0] is None or type(last[0]) in (int, float)):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    # The first page decides the order, the next ones keep it whatever the number of matches is now
+    ranked = last[0] is not None if last else is_ranked(db, terms)
+    statement = match_cars(db, select(*CAR_COLUMNS), terms, ranked, last)
+    rows = fetch_rows(db, statement, limit, response, lambda car: (car.get(RANK_KEY), car["id"]))
+    for row in rows:
+        row.pop(RANK_KEY, None)
+    return add_garage_rows(db, rows)
+
+
+@router.get("/search", response_model=list[CarValidationGET])
+def search_cars(
+    response: Response,
+    q: str = Query(min_length=MIN_TERM_LENGTH),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    return page_response(search_car_rows(db, q, limit, after, response), response)
+
+
 @router.put("/{car_id}", response_model=CarValidationGET)
 def update_car(car_id: int, car_data: CarValidationPOST, db: Session = Depends(get_db)):
     # Fetch the car by ID
-    db_car = db.query(Car).filter(Car.id == car_id).first()
+    db_car = db.query(Car).filter(Car.id == car_id, Car.deletedAt.is_(None)).first()
 
     if not db_car:
         raise HTTPException(status_code=404, detail="Car not found")
 
     # Fetch garages by IDs
-    garages = db.query(Garage).filter(Garage.id.in_(car_data.garage_ids)).all()
+    garages = db.query(Garage).filter(Garage.id.in_(car_data.garageIds), Garage.deletedAt.is_(None)).all()
 
-    if len(garages) != len(car_data.garage_ids):
+    if len(garages) != len(set(car_data.garageIds)):
         raise HTTPException(status_code=404, detail="Some garages were not found")
 
     # Update the car fields
     db_car.make = car_data.make
     db_car.model = car_data.model
-    db_car.productionYear = car_data.production_year
-    db_car.licensePlate = car_data.license_plate
+    db_car.productionYear = car_data.productionYear
+    db_car.licensePlate = car_data.licensePlate
     db_car.garages = garages
+    flush_car(db, car_data.licensePlate)
+    index_car(db, db_car)
+    record_change(db, CAR, UPDATED, car_id)
 
     db.commit()
+    invalidate_car(car_id)
     db.refresh(db_car)
     return db_car
 
 
 @router.get("/{car_id}", response_model=CarValidationGET)
-def retrieve_car(car_id: int, db: Session = Depends(get_db)):
-    # Fetch the car by ID
-    car = db.query(Car).filter(Car.id == car_id).first()
+def retrieve_car(car_id: int, request: Request, db: Session = Depends(get_read_db)):
+    def build():
+        # Fetch the car by ID together with its garages
+        car = db.query(Car).options(selectinload(Car.garages)).filter(Car.id == car_id, Car.deletedAt.is_(None)).first()
 
-    if not car:
-        raise HTTPException(status_code=404, detail=f"Car with id {car_id} not found")
+        if not car:
+            raise HTTPException(status_code=404, detail=f"Car with id {car_id} not found")
+
+        return CacheValue(CarValidationGET.model_validate(car).model_dump(mode="json"), car_tags(car))
 
-    return car
+    return cached_response(request, ("car", car_id), build)
 
 
 @router.get("/", response_model=list[CarValidationGET])
 def list_cars(
+    response: Response,
     car_make: str | None = None,
     garage_id: int | None = None,
     from_year: int | None = None,
     to_year: int | None = None,
-    db: Session = Depends(get_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
 ):
-    # Base query for cars
-    query = db.query(Car)
-
-    # Apply filters based on provided query parameters
-    if car_make:
-        query = query.filter(Car.make == car_make)
+    if FAST_SERIALIZATION:
+        statement = after_id(filter_cars(select(*CAR_COLUMNS), car_make, garage_id, from_year, to_year), Car.id, after)
+        return page_response(list_car_rows(db, statement, limit, response), response)
 
-    if from_year:
-        query = query.filter(Car.productionYear >= from_year)
+    # Base query for cars, garages are loaded in one extra query for the whole list
+    query = db.query(Car).options(selectinload(Car.garages))
 
-    if to_year:
-        query = query.filter(Car.productionYear <= to_year)
+    # Apply filters based on provided query parameters
+    query = filter_cars(query, car_make, garage_id, from_year, to_year)
 
-    if garage_id:
-        query = query.join(GarageCar).filter(GarageCar.garageId == garage_id)
-
-    cars = query.all()
-    return cars
+    # Keyset pagination on the id, the next page cursor is sent in the X-Next-Cursor header
+    query = after_id(query, Car.id, after)
+    return fetch_page(query, limit, response, lambda car: (car.id,))
 
 
 @router.delete("/{car_id}")
-def delete_car(car_id: int, db: Session = Depends(get_db)):
-    # Fetch the car by ID
-    db_car = db.query(Car).filter(Car.id == car_id).first()
+def delete_car(car_id: int, soft: bool = False, db: Session = Depends(get_db)):
+    db_car = db.get(Car, car_id)
 
-    if not db_car:
+    # A soft deleted car can still be purged
+    if not db_car or (soft and db_car.deletedAt is not None):
         raise HTTPException(status_code=404, detail=f"Car with id {car_id} not found")
 
-    # Delete the car
-    db.delete(db_car)
-    db.commit()
-    return {"message": f"Car with id {car_id} deleted successfully"}
\ No newline at end of file
+    affected = delete_car_rows(db, car_id, soft)
+    return {"message": f"Car with id {car_id} deleted successfully", "affectedRows": affected}
@@ -0,0 +1,142 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from car_search import MIN_TERM_LENGTH, index_car
+from cache import CacheValue, cached_response_async, car_tags, invalidate_car
+from changes import CAR, CREATED, UPDATED, record_change
+from constants import FAST_SERIALIZATION, get_async_db, get_async_read_db
+from deletion import delete_car_rows
+from instrumentation import InstrumentedRoute
+from models import Car, Garage
+from pydantic_models import CarValidationPOST, CarValidationGET
+from routes.cars import CAR_COLUMNS, SEARCH_PAGE_SIZE, filter_cars, list_car_rows, plate_taken, search_car_rows
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_id, fetch_page_async
+from serialization import page_response
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+async def get_car_with_garages(db: AsyncSession, car_id: int) -> Car | None:
+    # Lazy loading is not available with AsyncSession, so garages are always loaded up front
+    return await db.scalar(
+        select(Car).options(selectinload(Car.garages)).where(Car.id == car_id, Car.deletedAt.is_(None))
+    )
+
+
+async def get_garages(db: AsyncSession, garage_ids: list[int]) -> list[Garage]:
+    garages = (await db.scalars(select(Garage).where(Garage.id.in_(garage_ids), Garage.deletedAt.is_(None)))).all()
+
+    # Validate that all provided garage IDs exist
+    if len(garages) != len(set(garage_ids)):
+        raise HTTPException(status_code=404, detail="Some garages were not found")
+    return garages
+
+
+async def flush_car(db: AsyncSession, license_plate: str):
+    try:
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        raise plate_taken(license_plate)
+
+
+@router.post("/", response_model=CarValidationGET)
+async def create_car(car_data: CarValidationPOST, db: AsyncSession = Depends(get_async_db)):
+    garages = await get_garages(db, car_data.garageIds)
+
+    new_car = Car(
+        make=car_data.make,
+        model=car_data.model,
+        productionYear=car_data.productionYear,
+        licensePlate=car_data.licensePlate,
+        garages=garages,
+    )
+
+    db.add(new_car)
+    await flush_car(db, car_data.licensePlate)
+    await db.run_sync(index_car, new_car)
+    await db.run_sync(record_change, CAR, CREATED, new_car.id)
+    await db.commit()
+    return new_car
+
+
+@router.put("/{car_id}", response_model=CarValidationGET)
+async def update_car(car_id: int, car_data: CarValidationPOST, db: AsyncSession = Depends(get_async_db)):
+    db_car = await get_car_with_garages(db, car_id)
+
+    if not db_car:
+        raise HTTPException(status_code=404, detail="Car not found")
+
+    garages = await get_garages(db, car_data.garageIds)
+
+    db_car.make = car_data.make
+    db_car.model = car_data.model
+    db_car.productionYear = car_data.productionYear
+    db_car.licensePlate = car_data.licensePlate
+    db_car.garages = garages
+    await flush_car(db, car_data.licensePlate)
+    await db.run_sync(index_car, db_car)
+    await db.run_sync(record_change, CAR, UPDATED, car_id)
+
+    await db.commit()
+    invalidate_car(car_id)
+    return db_car
+
+
+@router.get("/search", response_model=list[CarValidationGET])
+async def search_cars(
+    response: Response,
+    q: str = Query(min_length=MIN_TERM_LENGTH),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    return page_response(await db.run_sync(search_car_rows, q, limit, after, response), response)
+
+
+@router.get("/{car_id}", response_model=CarValidationGET)
+async def retrieve_car(car_id: int, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    async def build():
+        car = await get_car_with_garages(db, car_id)
+
+        if not car:
+            raise HTTPException(status_code=404, detail=f"Car with id {car_id} not found")
+
+        return CacheValue(CarValidationGET.model_validate(car).model_dump(mode="json"), car_tags(car))
+
+    return await cached_response_async(request, ("car", car_id), build)
+
+
+@router.get("/", response_model=list[CarValidationGET])
+async def list_cars(
+    response: Response,
+    car_make: str | None = None,
+    garage_id: int | None = None,
+    from_year: int | None = None,
+    to_year: int | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    if FAST_SERIALIZATION:
+        statement = after_id(filter_cars(select(*CAR_COLUMNS), car_make, garage_id, from_year, to_year), Car.id, after)
+        return page_response(await db.run_sync(list_car_rows, statement, limit, response), response)
+
+    statement = select(Car).options(selectinload(Car.garages))
+    statement = filter_cars(statement, car_make, garage_id, from_year, to_year)
+    statement = after_id(statement, Car.id, after)
+    return await fetch_page_async(db, statement, limit, response, lambda car: (car.id,))
+
+
+@router.delete("/{car_id}")
+async def delete_car(car_id: int, soft: bool = False, db: AsyncSession = Depends(get_async_db)):
+    db_car = await db.get(Car, car_id)
+
+    if not db_car or (soft and db_car.deletedAt is not None):
+        raise HTTPException(status_code=404, detail=f"Car with id {car_id} not found")
+
+    affected = await db.run_sync(delete_car_rows, car_id, soft)
+    return {"message": f"Car with id {car_id} deleted successfully", "affectedRows": affected}
@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import Session
+
+from changes import CAR, DELETED, GARAGE, MAINTENANCE, latest_change, oldest_change
+from constants import get_read_db
+from instrumentation import InstrumentedRoute
+from models import Car, ChangeLog, Garage, Maintenance, MaintenanceArchive
+from pydantic_models import ChangeFeed
+from routes.cars import CAR_COLUMNS, add_garage_rows
+from routes.garages import GARAGE_COLUMNS
+from routes.maintenance import maintenance_rows
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from serialization import FastJSONResponse
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+def garage_rows(db: Session, ids: list[int]) -> list[dict]:
+    statement = select(*GARAGE_COLUMNS).where(Garage.id.in_(ids), Garage.deletedAt.is_(None))
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+
+def car_rows(db: Session, ids: list[int]) -> list[dict]:
+    statement = select(*CAR_COLUMNS).where(Car.id.in_(ids), Car.deletedAt.is_(None))
+    return add_garage_rows(db, [dict(row) for row in db.execute(statement).mappings()])
+
+
+def maintenance_rows_by_id(db: Session, ids: list[int]) -> list[dict]:
+    # A maintenance may have been archived since it changed
+    statement = union_all(*(maintenance_rows(model).where(model.id.in_(ids)) for model in (Maintenance, MaintenanceArchive)))
+    return [dict(row) for row in db.execute(statement).mappings()]
+
+
+ENTITY_ROWS = {GARAGE: garage_rows, CAR: car_rows, MAINTENANCE: maintenance_rows_by_id}
+
+
+def since_id(since: str) -> int:
+    (change_id,) = decode_cursor(since, 1)
+    if not isinstance(change_id, int):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return change_id
+
+
+@router.get("/", response_model=ChangeFeed)
+def get_changes(
+    since: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_read_db),
+):
+    """
+    The garages, cars and maintenances created, updated or deleted after the `since` cursor, in commit order.
+
+    Without `since` no changes are returned, only the cursor of the latest one: take it, list
+    everything, then poll with it. Each page holds the last change of every row changed within it,
+    with the row as it is now, or data null when it is deleted. Pass the returned cursor as `since`
+    to continue, hasMore says whether more changes are already waiting.
+    """
+    if since is None:
+        return FastJSONResponse({"changes": [], "cursor": encode_cursor(latest_change(db)), "hasMore": False})
+
+    after = since_id(since)
+    oldest = oldest_change(db)
+    if oldest is not None and after < oldest - 1:
+        raise HTTPException(status_code=410, detail="Changes after this cursor were pruned, list everything again")
+
+    changes = db.execute(
+        select(ChangeLog.id, ChangeLog.entity, ChangeLog.entityId, ChangeLog.operation)
+        .where(ChangeLog.id > after)
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # Last change per row, in the order of those last changes
+    last = {(entity, entity_id): (change_id, operation) for change_id, entity, entity_id, operation in changes}
+    ordered = sorted(last.items(), key=lambda item: item[1][0])
+    current = {}
+    for entity, fetch in ENTITY_ROWS.items():
+        ids = [entity_id for (changed, entity_id), (_, operation) in ordered if changed == entity and operation != DELETED]
+        if ids:
+            current.update(((entity, row["id"]), row) for row in fetch(db, ids))
+
+    feed = []
+    for key, (_, operation) in ordered:
+        data = current.get(key)
+        # A row that is gone by now was deleted by a later change, or soft deleted
+        feed.append({"entity": key[0], "id": key[1], "operation": operation if data else DELETED, "data": data})
+    cursor = encode_cursor(changes[-1][0] if changes else after)
+    return FastJSONResponse({"changes": feed, "cursor": cursor, "hasMore": has_more})
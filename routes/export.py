@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from constants import read_session
+
+EXPORT_BATCH_SIZE = 1_000
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def stream_rows(statement, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """
+    Yields the rows of `statement` as dicts, fetched `batch_size` at a time from a server-side cursor.
+
+    The session is opened here and not taken from get_db, because FastAPI closes dependencies
+    before a StreamingResponse body is sent.
+    """
+    with read_session() as db:
+        result = db.execute(statement.execution_options(yield_per=batch_size))
+        for partition in result.mappings().partitions():
+            yield from partition
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_ndjson(rows: Iterable[dict], columns: list[str]) -> Iterator[bytes]:
+    for batch in batched(rows, EXPORT_BATCH_SIZE):
+        lines = (
+            json.dumps({column: row[column] for column in columns}, default=str, separators=(",", ":"))
+            for row in batch
+        )
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def csv_cell(value):
+    # Lists (the garageIds of a car) go in one cell
+    return ";".join(map(str, value)) if isinstance(value, list) else value
+
+
+def encode_csv(rows: Iterable[dict], columns: list[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batched(rows, EXPORT_BATCH_SIZE):
+        writer.writerows([csv_cell(row[column]) for column in columns] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only, the export is empty
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes the gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_response(rows: Iterable[dict], columns: list[str], format: str, gzip: bool, name: str) -> StreamingResponse:
+    """Streams `rows` as NDJSON or CSV (optionally gzipped) without holding more than one batch in memory."""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown export format '{format}', use one of {list(EXPORT_MEDIA_TYPES)}")
+
+    encode = encode_csv if format == "csv" else encode_ndjson
+    chunks = encode(rows, columns)
+    filename = f"{name}.{format}"
+    media_type = EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        chunks, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,19 +1,41 @@
-from constants import get_db
-from fastapi import APIRouter, Depends, HTTPException
+from constants import ENTITY_CACHE_ENABLED, FAST_SERIALIZATION, get_db, get_read_db
+from instrumentation import InstrumentedRoute
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from datetime import date
-from fastapi.responses import JSONResponse
 
+from cache import CacheValue, cached_response, garage_tags, invalidate_garage, report_tags
+from changes import CREATED, GARAGE, UPDATED, record_change
+from deletion import delete_garage_rows
+from entity_cache import entity_cache
 from models import Car, Garage, Maintenance
-from pydantic_models import GarageValidation, GarageAvailabilityReport
-from routes.reports import build_daily_report
+from pydantic_models import GarageValidation, GarageAvailabilityReport, GarageAvailabilityMatrix, GarageNextAvailable
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_id, fetch_page, fetch_rows
+from routes.reports import (
+    MAX_AVAILABILITY_DAYS, build_availability_matrix, build_daily_report, find_next_available,
+)
+from serialization import FastJSONResponse, page_response
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
+
+# Columns of GarageValidation, in the order of its fields
+GARAGE_COLUMNS = (Garage.id, Garage.city, Garage.location, Garage.name, Garage.capacity)
+GARAGE_FIELDS = tuple(column.key for column in GARAGE_COLUMNS)
+
+def cached_garage(db: Session, garage_id: int):
+    """Name and capacity of a garage that is not deleted, from the entity cache when it is enabled."""
+    if ENTITY_CACHE_ENABLED:
+        garage = entity_cache.garage(db, garage_id)
+        return garage if garage and not garage.deleted else None
+    return db.query(Garage).filter(Garage.id == garage_id, Garage.deletedAt.is_(None)).first()
 
 @router.post("/", response_model=GarageValidation)
 def create_garage(garage: GarageValidation, db: Session = Depends(get_db)):
     new_garage = Garage(**garage.dict())
     db.add(new_garage)
+    db.flush()
+    record_change(db, GARAGE, CREATED, new_garage.id)
     db.commit()
     db.refresh(new_garage)
     return new_garage
@@ -23,59 +45,100 @@ def garage_report(
     garageId: int,
     startDate: date,
     endDate: date,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_read_db),
 ):
-    garage = db.query(Garage).filter(Garage.id == garageId).first()
-    if not garage:
-        raise HTTPException(status_code=404, detail="Garage not found")
+    def build():
+        garage = cached_garage(db, garageId)
+        if not garage:
+            raise HTTPException(status_code=404, detail="Garage not found")
+
+        report = build_daily_report(db, garageId, startDate, endDate, garage.capacity)
+        return CacheValue(report, report_tags(garageId, startDate, endDate))
+
+    return cached_response(request, ("dailyAvailabilityReport", garageId, startDate, endDate), build)
 
-    maintenances = (
-        db.query(Maintenance)
-        .filter(Maintenance.garageId == garageId)
-        .filter(Maintenance.scheduledDate >= startDate)
-        .filter(Maintenance.scheduledDate <= endDate)
-        .all()
-    )
+# The availability builders produce exactly the response models, returning them as FastJSONResponse
+# skips re-validating up to MAX_AVAILABILITY_DAYS values per garage
 
-    report = build_daily_report(maintenances, garage.capacity)
-    return JSONResponse(content=report, status_code=200)
+@router.get("/availabilityMatrix", response_model=GarageAvailabilityMatrix)
+def availability_matrix(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    matrix = build_availability_matrix(db, city, startDate, endDate)
+    if not matrix["garages"] and city:
+        raise HTTPException(status_code=404, detail=f"No garages found in city: {city}")
+    return FastJSONResponse(matrix)
+
+@router.get("/nextAvailable", response_model=list[GarageNextAvailable])
+def next_available(
+    startDate: date,
+    city: str | None = None,
+    garageId: int | None = None,
+    count: int = Query(3, ge=1, le=MAX_AVAILABILITY_DAYS),
+    horizonDays: int = Query(90, ge=1, le=MAX_AVAILABILITY_DAYS),
+    db: Session = Depends(get_read_db),
+):
+    garages = find_next_available(db, startDate, count, horizonDays, city, garageId)
+    if not garages and (city or garageId is not None):
+        raise HTTPException(status_code=404, detail="Garage not found")
+    return FastJSONResponse(garages)
 
 @router.get("/{garage_id}", response_model=GarageValidation)
-def retrieve_garage(garage_id: int, db: Session = Depends(get_db)):
-    garage = db.query(Garage).filter(Garage.id == garage_id).first()
-    if not garage:
-        raise HTTPException(status_code=404, detail=f"Garage with id: {garage_id} not found")
-    return garage
-
-@router.get("/")
-def list_garages(city: str | None = None, db: Session = Depends(get_db)):
-    query = db.query(Garage)
+def retrieve_garage(garage_id: int, request: Request, db: Session = Depends(get_read_db)):
+    def build():
+        garage = db.query(Garage).filter(Garage.id == garage_id, Garage.deletedAt.is_(None)).first()
+        if not garage:
+            raise HTTPException(status_code=404, detail=f"Garage with id: {garage_id} not found")
+        return CacheValue(GarageValidation.model_validate(garage).model_dump(mode="json"), garage_tags(garage))
+
+    return cached_response(request, ("garage", garage_id), build)
+
+@router.get("/", response_model=list[GarageValidation])
+def list_garages(
+    response: Response,
+    city: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    query = select(*GARAGE_COLUMNS) if FAST_SERIALIZATION else db.query(Garage)
+    query = query.filter(Garage.deletedAt.is_(None))
     if city:
         query = query.filter(Garage.city == city)
-    garages = query.all()
-    if not garages and city:
+    query = after_id(query, Garage.id, after)
+    if FAST_SERIALIZATION:
+        garages = fetch_rows(db, query, limit, response, lambda garage: (garage["id"],))
+    else:
+        garages = fetch_page(query, limit, response, lambda garage: (garage.id,))
+    if not garages and city and not after:
         raise HTTPException(status_code=404, detail=f"No garages found in city: {city}")
-    return garages
+    return page_response(garages, response) if FAST_SERIALIZATION else garages
 
 @router.put("/{garage_id}", response_model=GarageValidation)
 def update_garage(garage_id: int, garage: GarageValidation, db: Session = Depends(get_db)):
-    existing_garage = db.query(Garage).filter(Garage.id == garage_id).first()
+    existing_garage = db.query(Garage).filter(Garage.id == garage_id, Garage.deletedAt.is_(None)).first()
     if not existing_garage:
         raise HTTPException(status_code=404, detail="Garage not found")
 
-    for field, value in garage.dict().items():
+    for field, value in garage.dict(exclude={"id"}).items():
         setattr(existing_garage, field, value)
+    record_change(db, GARAGE, UPDATED, garage_id)
 
     db.commit()
+    invalidate_garage(garage_id)
     db.refresh(existing_garage)
     return existing_garage
 
 @router.delete("/{garage_id}")
-def remove_garage(garage_id: int, db: Session = Depends(get_db)):
-    garage_to_delete = db.query(Garage).filter(Garage.id == garage_id).first()
-    if not garage_to_delete:
+def remove_garage(garage_id: int, soft: bool = False, db: Session = Depends(get_db)):
+    garage_to_delete = db.get(Garage, garage_id)
+    # A soft deleted garage can still be purged
+    if not garage_to_delete or (soft and garage_to_delete.deletedAt is not None):
         raise HTTPException(status_code=404, detail="Garage not found")
 
-    db.delete(garage_to_delete)
-    db.commit()
-    return {"message": "Garage deleted successfully"}
\ No newline at end of file
+    affected = delete_garage_rows(db, garage_id, soft)
+    return {"message": "Garage deleted successfully", "affectedRows": affected}
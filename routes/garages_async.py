@@ -0,0 +1,129 @@
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import CacheValue, cached_response_async, garage_tags, invalidate_garage, report_tags
+from changes import CREATED, GARAGE, UPDATED, record_change
+from constants import FAST_SERIALIZATION, get_async_db, get_async_read_db
+from deletion import delete_garage_rows
+from instrumentation import InstrumentedRoute
+from models import Garage
+from pydantic_models import GarageValidation, GarageAvailabilityReport, GarageAvailabilityMatrix, GarageNextAvailable
+from routes.garages import GARAGE_COLUMNS, cached_garage
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_id, fetch_page_async, fetch_rows
+from routes.reports import (
+    MAX_AVAILABILITY_DAYS, build_availability_matrix, build_daily_report, find_next_available,
+)
+from serialization import FastJSONResponse, page_response
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+@router.post("/", response_model=GarageValidation)
+async def create_garage(garage: GarageValidation, db: AsyncSession = Depends(get_async_db)):
+    new_garage = Garage(**garage.dict())
+    db.add(new_garage)
+    await db.flush()
+    await db.run_sync(record_change, GARAGE, CREATED, new_garage.id)
+    await db.commit()
+    return new_garage
+
+@router.get("/dailyAvailabilityReport", response_model=GarageAvailabilityReport)
+async def garage_report(
+    garageId: int,
+    startDate: date,
+    endDate: date,
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    async def build():
+        garage = await db.run_sync(cached_garage, garageId)
+        if not garage:
+            raise HTTPException(status_code=404, detail="Garage not found")
+
+        # The report builders are shared with the sync routes, run_sync hands them a Session
+        report = await db.run_sync(build_daily_report, garageId, startDate, endDate, garage.capacity)
+        return CacheValue(report, report_tags(garageId, startDate, endDate))
+
+    return await cached_response_async(request, ("dailyAvailabilityReport", garageId, startDate, endDate), build)
+
+@router.get("/availabilityMatrix", response_model=GarageAvailabilityMatrix)
+async def availability_matrix(
+    startDate: date,
+    endDate: date,
+    city: str | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    matrix = await db.run_sync(build_availability_matrix, city, startDate, endDate)
+    if not matrix["garages"] and city:
+        raise HTTPException(status_code=404, detail=f"No garages found in city: {city}")
+    return FastJSONResponse(matrix)
+
+@router.get("/nextAvailable", response_model=list[GarageNextAvailable])
+async def next_available(
+    startDate: date,
+    city: str | None = None,
+    garageId: int | None = None,
+    count: int = Query(3, ge=1, le=MAX_AVAILABILITY_DAYS),
+    horizonDays: int = Query(90, ge=1, le=MAX_AVAILABILITY_DAYS),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    garages = await db.run_sync(find_next_available, startDate, count, horizonDays, city, garageId)
+    if not garages and (city or garageId is not None):
+        raise HTTPException(status_code=404, detail="Garage not found")
+    return FastJSONResponse(garages)
+
+@router.get("/{garage_id}", response_model=GarageValidation)
+async def retrieve_garage(garage_id: int, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    async def build():
+        garage = await db.get(Garage, garage_id)
+        if not garage or garage.deletedAt is not None:
+            raise HTTPException(status_code=404, detail=f"Garage with id: {garage_id} not found")
+        return CacheValue(GarageValidation.model_validate(garage).model_dump(mode="json"), garage_tags(garage))
+
+    return await cached_response_async(request, ("garage", garage_id), build)
+
+@router.get("/", response_model=list[GarageValidation])
+async def list_garages(
+    response: Response,
+    city: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    statement = select(*GARAGE_COLUMNS) if FAST_SERIALIZATION else select(Garage)
+    statement = statement.filter(Garage.deletedAt.is_(None))
+    if city:
+        statement = statement.filter(Garage.city == city)
+    statement = after_id(statement, Garage.id, after)
+    if FAST_SERIALIZATION:
+        garages = await db.run_sync(fetch_rows, statement, limit, response, lambda garage: (garage["id"],))
+    else:
+        garages = await fetch_page_async(db, statement, limit, response, lambda garage: (garage.id,))
+    if not garages and city and not after:
+        raise HTTPException(status_code=404, detail=f"No garages found in city: {city}")
+    return page_response(garages, response) if FAST_SERIALIZATION else garages
+
+@router.put("/{garage_id}", response_model=GarageValidation)
+async def update_garage(garage_id: int, garage: GarageValidation, db: AsyncSession = Depends(get_async_db)):
+    existing_garage = await db.get(Garage, garage_id)
+    if not existing_garage or existing_garage.deletedAt is not None:
+        raise HTTPException(status_code=404, detail="Garage not found")
+
+    for field, value in garage.dict(exclude={"id"}).items():
+        setattr(existing_garage, field, value)
+    await db.run_sync(record_change, GARAGE, UPDATED, garage_id)
+
+    await db.commit()
+    invalidate_garage(garage_id)
+    return existing_garage
+
+@router.delete("/{garage_id}")
+async def remove_garage(garage_id: int, soft: bool = False, db: AsyncSession = Depends(get_async_db)):
+    garage_to_delete = await db.get(Garage, garage_id)
+    if not garage_to_delete or (soft and garage_to_delete.deletedAt is not None):
+        raise HTTPException(status_code=404, detail="Garage not found")
+
+    affected = await db.run_sync(delete_garage_rows, garage_id, soft)
+    return {"message": "Garage deleted successfully", "affectedRows": affected}
@@ -1,53 +1,372 @@
 import calendar
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+import heapq
+from collections import Counter, defaultdict
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import bindparam, delete, exists, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
 from datetime import datetime, date
 
-from constants import get_db
-from models import Car, Garage, Maintenance
-from pydantic_models import MaintenanceValidationGET, MaintenanceValidationPOST, MaintenanceMonthlyRequestsReport
+from archive import is_archived, reaches_archive
+from cache import (
+    CacheValue, cached_response, invalidate_maintenance, invalidate_occupancy, invalidate_occupancy_days,
+    maintenance_tags, report_tags,
+)
+from changes import CREATED, DELETED, MAINTENANCE, UPDATED, record_change, record_changes
+from constants import ENTITY_CACHE_ENABLED, FAST_SERIALIZATION, get_db, get_read_db
+from entity_cache import entity_cache
+from instrumentation import InstrumentedRoute
+from models import Car, Garage, GarageCar, Maintenance, MaintenanceArchive
+from occupancy import apply_occupancy_deltas, change_occupancy, move_booking, reserve_capacity, reserve_capacity_for_items
+from pydantic_models import (
+    BulkItemResult, BulkResponse, MaintenanceValidationBulkPUT, MaintenanceValidationGET, MaintenanceValidationPOST,
+    MaintenanceMonthlyRequestsReport,
+)
+from routes.bulk import BULK_CHUNK_SIZE, bulk_response, check_bulk_size, chunked, save_error, select_in
+from routes.export import export_response, stream_rows
+from routes.garages import cached_garage
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_date_and_id, fetch_page, fetch_rows, trim_page
 from routes.reports import build_monthly_report
+from serialization import page_response
 
-router = APIRouter()
+router = APIRouter(route_class=InstrumentedRoute)
 
+# garageName and carName are read from these relationships, load them in the same query
+MAINTENANCE_RELATIONS = (joinedload(Maintenance.garage), joinedload(Maintenance.car))
 
-def get_car_and_garage(db: Session, car_id: int, garage_id: int):
-    db_car = db.get(Car, car_id)
-    db_garage = db.get(Garage, garage_id)
 
-    if not db_car:
+def booking_check(car_id: int, garage_id: int):
+    """Car model, garage name and whether the car is registered at the garage, in one query."""
+    return select(
+        select(Car.model).where(Car.id == car_id, Car.deletedAt.is_(None)).scalar_subquery(),
+        select(Garage.name).where(Garage.id == garage_id, Garage.deletedAt.is_(None)).scalar_subquery(),
+        exists().where(GarageCar.carId == car_id, GarageCar.garageId == garage_id),
+    )
+
+
+def check_booking(row) -> str:
+    """Raises the error of an invalid booking_check result, returns the garage name."""
+    car_model, garage_name, registered = row
+    if car_model is None:
         raise HTTPException(status_code=404, detail="Car not found")
-    if not db_garage:
+    if garage_name is None:
         raise HTTPException(status_code=404, detail="Garage not found")
+    if not registered:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The selected car '{car_model}' does not belong to the selected garage '{garage_name}'"
+        )
+    return garage_name
 
-    return db_car, db_garage
 
+def cached_booking_check(db: Session, car_id: int, garage_id: int) -> tuple:
+    """The booking_check row built from the entity cache, the database is only read on a miss."""
+    car, garage = entity_cache.booking(db, car_id, garage_id)
+    car_model = car.model if car and not car.deleted else None
+    garage_name = garage.name if garage and not garage.deleted else None
+    return car_model, garage_name, car is not None and garage_id in car.garageIds
 
-def validate_car_belongs_to_garage(db_car, db_garage, selected_garage_id: int):
-    selected_car_garage_ids = [garage.id for garage in db_car.garages]
-    if selected_garage_id not in selected_car_garage_ids:
-        raise HTTPException(
-            status_code=400,
-            detail=f"The selected car '{db_car.model}' does not belong to the selected garage '{db_garage.name}'"
+
+def validate_booking(db: Session, car_id: int, garage_id: int) -> str:
+    if ENTITY_CACHE_ENABLED:
+        return check_booking(cached_booking_check(db, car_id, garage_id))
+    return check_booking(db.execute(booking_check(car_id, garage_id)).one())
+
+
+def fully_booked(garage_name: str, day: date) -> HTTPException:
+    return HTTPException(status_code=409, detail=f"Garage '{garage_name}' is fully booked on {day}")
+
+
+FULLY_BOOKED_ITEM = "The garage is fully booked on this day"
+CHANGED_CONCURRENTLY = "The maintenance was changed by another request, retry"
+
+
+def update_if_unchanged(maintenance_id: int, old_garage_id: int, old_date: date, maintenance: MaintenanceValidationPOST):
+    """
+    UPDATE of a maintenance that only matches while it still has the garage and day it was read with.
+
+    Its booking is moved from that day, so of two concurrent updates of one maintenance only the
+    first may go through, the second one updates no row.
+    """
+    return (
+        update(Maintenance)
+        .where(
+            Maintenance.id == maintenance_id,
+            Maintenance.garageId == old_garage_id,
+            Maintenance.scheduledDate == old_date,
         )
+        .values(**maintenance_values(maintenance))
+    )
+
+
+def delete_returning_booking(maintenance_id: int):
+    """DELETE of a maintenance returning the (garageId, scheduledDate) it held, read and deleted atomically."""
+    return (
+        delete(Maintenance)
+        .where(Maintenance.id == maintenance_id)
+        .returning(Maintenance.garageId, Maintenance.scheduledDate)
+    )
+
+
+def validate_bulk_maintenances(db: Session, maintenances: list[MaintenanceValidationPOST]) -> dict[int, str]:
+    """
+    Bulk version of validate_booking.
+
+    Cars, garages and GarageCar links are fetched with one set-based query each,
+    returns the error message of every invalid item by its index.
+    """
+    car_models = dict(select_in(
+        db, select(Car.id, Car.model).where(Car.deletedAt.is_(None)), Car.id, [m.carId for m in maintenances]
+    ))
+    garage_names = dict(select_in(
+        db, select(Garage.id, Garage.name).where(Garage.deletedAt.is_(None)), Garage.id, [m.garageId for m in maintenances]
+    ))
+    links = {
+        (car_id, garage_id)
+        for car_id, garage_id in select_in(db, select(GarageCar.carId, GarageCar.garageId), GarageCar.carId, car_models)
+    }
+
+    errors = {}
+    for index, maintenance in enumerate(maintenances):
+        if maintenance.carId not in car_models:
+            errors[index] = "Car not found"
+        elif maintenance.garageId not in garage_names:
+            errors[index] = "Garage not found"
+        elif (maintenance.carId, maintenance.garageId) not in links:
+            errors[index] = (
+                f"The selected car '{car_models[maintenance.carId]}' does not belong to the selected garage "
+                f"'{garage_names[maintenance.garageId]}'"
+            )
+    return errors
+
+
+def filter_maintenances(
+    query, carId: int | None, garageId: int | None, startDate: date | None, endDate: date | None, model=Maintenance
+):
+    """The filters of get_maintenances, for a Query or a select() of `model`, Maintenance or MaintenanceArchive."""
+    if startDate and endDate and startDate > endDate:
+        raise HTTPException(status_code=400, detail="startDate cannot be after endDate")
+
+    if carId:
+        query = query.filter(model.carId == carId)
+    if garageId:
+        query = query.filter(model.garageId == garageId)
+    if startDate:
+        query = query.filter(model.scheduledDate >= startDate)
+    if endDate:
+        query = query.filter(model.scheduledDate <= endDate)
+    return query
+
+
+def maintenance_rows(model=Maintenance):
+    """
+    Plain rows shaped like MaintenanceValidationGET, with the car and garage names joined in.
+
+    Used by the export, the fast path of get_maintenances and the archive, no ORM objects are built.
+    The + 0 keeps SQLite from starting at Car or Garage and looking the maintenances up by their
+    carId or garageId index, then sorting them all. It picked that plan for a MaintenanceArchive
+    without statistics.
+    """
+    return (
+        select(
+            model.id,
+            model.carId,
+            Car.model.label("carName"),
+            model.serviceType,
+            model.scheduledDate,
+            model.garageId,
+            Garage.name.label("garageName"),
+        )
+        .join(Car, Car.id == model.carId + 0)
+        .join(Garage, Garage.id == model.garageId + 0)
+    )
+
+
+def maintenance_page_rows(model, carId, garageId, startDate, endDate, after: str | None):
+    """
+    maintenance_rows of `model` matching the filters, after the cursor, in (scheduledDate, id) order.
+
+    Each table is paged on its own indexes, Maintenance and MaintenanceArchive have the same ones.
+    """
+    statement = filter_maintenances(maintenance_rows(model), carId, garageId, startDate, endDate, model)
+    return after_date_and_id(statement, model.scheduledDate, model.id, after)
+
+
+def maintenance_key(maintenance: dict) -> tuple:
+    return maintenance["scheduledDate"], maintenance["id"]
+
+
+def archived_maintenance_page(
+    db: Session, carId, garageId, startDate, endDate, limit: int, after: str | None, response: Response
+) -> list[dict]:
+    """
+    get_maintenances over both tables, for ranges that reach the archive.
+
+    Each table returns its own next limit + 1 rows, a union sorted as a whole would sort the whole
+    archive for every page. The two short lists are merged in key order.
+    """
+    pages = [
+        [dict(row) for row in db.execute(
+            maintenance_page_rows(model, carId, garageId, startDate, endDate, after).limit(limit + 1)
+        ).mappings()]
+        for model in (Maintenance, MaintenanceArchive)
+    ]
+    return trim_page(list(heapq.merge(*pages, key=maintenance_key))[:limit + 1], limit, response, maintenance_key)
+
+
+def get_archived_maintenance(db: Session, maintenance_id: int):
+    """The maintenance_rows row of an archived maintenance, None when there is none."""
+    return db.execute(maintenance_rows(MaintenanceArchive).where(MaintenanceArchive.id == maintenance_id)).first()
+
+
+def archived_or_missing(db: Session, maintenance_id: int, not_found: str) -> HTTPException:
+    """The error for a write to a maintenance that is not in the hot table, `not_found` is the 404 detail."""
+    if is_archived(db, maintenance_id):
+        return HTTPException(status_code=409, detail=f"Maintenance with id: {maintenance_id} is archived and read-only")
+    return HTTPException(status_code=404, detail=not_found)
+
+
+def maintenance_values(maintenance: MaintenanceValidationPOST) -> dict:
+    return {
+        "carId": maintenance.carId,
+        "garageId": maintenance.garageId,
+        "serviceType": maintenance.serviceType,
+        "scheduledDate": maintenance.scheduledDate,
+    }
+
+
+@router.post("/bulk", response_model=BulkResponse)
+def post_maintenances_bulk(maintenances: list[MaintenanceValidationPOST], db: Session = Depends(get_db)):
+    check_bulk_size(maintenances)
+    errors = validate_bulk_maintenances(db, maintenances)
+    results = [BulkItemResult(index=index, error=error) for index, error in errors.items()]
+    valid = [(index, maintenance) for index, maintenance in enumerate(maintenances) if index not in errors]
+
+    # Each chunk reserves capacity per (garage, day), then inserts the items that fit with one
+    # executemany INSERT ... RETURNING, committed together
+    for chunk in chunked(valid, BULK_CHUNK_SIZE):
+        by_day = defaultdict(list)
+        for index, maintenance in chunk:
+            by_day[(maintenance.garageId, maintenance.scheduledDate)].append(index)
+        try:
+            full = reserve_capacity_for_items(db, by_day)
+            booked = [(index, maintenance) for index, maintenance in chunk if index not in full]
+            new_ids = db.scalars(
+                insert(Maintenance).returning(Maintenance.id, sort_by_parameter_order=True),
+                [maintenance_values(maintenance) for _, maintenance in booked],
+            ).all() if booked else []
+            record_changes(db, MAINTENANCE, CREATED, new_ids)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            results.extend(BulkItemResult(index=index, error=save_error(e)) for index, _ in chunk)
+            continue
+        invalidate_occupancy_days(by_day)
+        results.extend(BulkItemResult(index=index, error=FULLY_BOOKED_ITEM) for index in full)
+        results.extend(BulkItemResult(index=index, id=new_id) for (index, _), new_id in zip(booked, new_ids))
+
+    return bulk_response(results)
+
+
+@router.put("/bulk", response_model=BulkResponse)
+def update_maintenances_bulk(maintenances: list[MaintenanceValidationBulkPUT], db: Session = Depends(get_db)):
+    check_bulk_size(maintenances)
+    errors = validate_bulk_maintenances(db, maintenances)
+
+    existing = {
+        maintenance_id: (garage_id, scheduled_date)
+        for maintenance_id, garage_id, scheduled_date in select_in(
+            db,
+            select(Maintenance.id, Maintenance.garageId, Maintenance.scheduledDate),
+            Maintenance.id,
+            [m.id for m in maintenances],
+        )
+    }
+    seen_ids = set()
+    for index, maintenance in enumerate(maintenances):
+        if maintenance.id not in existing:
+            errors[index] = "Maintenance not found"
+        elif maintenance.id in seen_ids:
+            errors[index] = "The same maintenance is updated more than once"
+        seen_ids.add(maintenance.id)
+
+    results = [BulkItemResult(index=index, error=error) for index, error in errors.items()]
+    valid = [(index, maintenance) for index, maintenance in enumerate(maintenances) if index not in errors]
+
+    for chunk in chunked(valid, BULK_CHUNK_SIZE):
+        # Only items that change garage or day move a booking, their old places are freed first
+        moving = [(index, m) for index, m in chunk if existing[m.id] != (m.garageId, m.scheduledDate)]
+        by_day = defaultdict(list)
+        for index, maintenance in moving:
+            by_day[(maintenance.garageId, maintenance.scheduledDate)].append(index)
+        try:
+            released = Counter(existing[m.id] for _, m in moving)
+            apply_occupancy_deltas(db, {key: -count for key, count in released.items()})
+            full = reserve_capacity_for_items(db, by_day)
+            # Items whose new day is full keep their old booking
+            apply_occupancy_deltas(db, Counter(existing[m.id] for index, m in moving if index in full))
+            updated = [(index, maintenance) for index, maintenance in chunk if index not in full]
+            if updated:
+                # One executemany UPDATE, each row only matches if it still has the garage and day it was
+                # read with, otherwise its booking was moved by someone else and the chunk is retried
+                table = Maintenance.__table__
+                result = db.execute(
+                    update(table).where(
+                        table.c.id == bindparam("b_id"),
+                        table.c.garageId == bindparam("b_garageId"),
+                        table.c.scheduledDate == bindparam("b_scheduledDate"),
+                    ),
+                    [
+                        {
+                            "b_id": maintenance.id,
+                            "b_garageId": existing[maintenance.id][0],
+                            "b_scheduledDate": existing[maintenance.id][1],
+                            **maintenance_values(maintenance),
+                        }
+                        for _, maintenance in updated
+                    ],
+                )
+                if result.rowcount != len(updated):
+                    db.rollback()
+                    results.extend(BulkItemResult(index=index, error=CHANGED_CONCURRENTLY) for index, _ in chunk)
+                    continue
+                record_changes(db, MAINTENANCE, UPDATED, [maintenance.id for _, maintenance in updated])
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            results.extend(BulkItemResult(index=index, error=save_error(e)) for index, _ in chunk)
+            continue
+        invalidate_occupancy_days(by_day)
+        invalidate_occupancy_days(released)
+        for _, maintenance in updated:
+            invalidate_maintenance(maintenance.id)
+        results.extend(BulkItemResult(index=index, error=FULLY_BOOKED_ITEM) for index in full)
+        results.extend(BulkItemResult(index=index, id=maintenance.id) for index, maintenance in updated)
+
+    return bulk_response(results)
 
 
 @router.post("/", response_model=MaintenanceValidationGET)
 def post_maintenance(maintenance: MaintenanceValidationPOST, db: Session = Depends(get_db)):
-    db_car, db_garage = get_car_and_garage(db, maintenance.carId, maintenance.garageId)
+    garage_name = validate_booking(db, maintenance.carId, maintenance.garageId)
 
-    validate_car_belongs_to_garage(db_car, db_garage, maintenance.garageId)
+    # The reservation and the insert are one short transaction, a full day changes nothing
+    if not reserve_capacity(db, maintenance.garageId, maintenance.scheduledDate):
+        db.rollback()
+        raise fully_booked(garage_name, maintenance.scheduledDate)
 
     new_maintenance = Maintenance(
-        carId=db_car.id,
-        garageId=db_garage.id,
+        carId=maintenance.carId,
+        garageId=maintenance.garageId,
         serviceType=maintenance.serviceType,
         scheduledDate=maintenance.scheduledDate,
     )
 
     db.add(new_maintenance)
+    db.flush()
+    record_change(db, MAINTENANCE, CREATED, new_maintenance.id)
     db.commit()
+    invalidate_occupancy(maintenance.garageId, maintenance.scheduledDate)
     db.refresh(new_maintenance)
 
     return new_maintenance
@@ -58,91 +377,129 @@ def garage_report(
     garageId: int,
     startMonth: str,
     endMonth: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(get_read_db),
 ):
-    db_garage = db.get(Garage, garageId)
-    if not db_garage:
-        raise HTTPException(status_code=404, detail="Garage not found")
+    def build():
+        if not cached_garage(db, garageId):
+            raise HTTPException(status_code=404, detail="Garage not found")
+
+        try:
+            start_date = datetime.strptime(f"{startMonth}-01", "%Y-%m-%d")
+            end_date = datetime.strptime(f"{endMonth}-{calendar.monthrange(int(endMonth[:4]), int(endMonth[5:7]))[1]}", "%Y-%m-%d")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid date format passed. It should adhere to 'yyyy-mm':\n{e}")
+
+        response = build_monthly_report(db, garageId, start_date.date(), end_date.date())
+        return CacheValue(response, report_tags(garageId, start_date.date(), end_date.date()))
 
-    try:
-        start_date = datetime.strptime(f"{startMonth}-01", "%Y-%m-%d")
-        end_date = datetime.strptime(f"{endMonth}-{calendar.monthrange(int(endMonth[:4]), int(endMonth[5:7]))[1]}", "%Y-%m-%d")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid date format passed. It should adhere to 'yyyy-mm':\n{e}")
+    return cached_response(request, ("monthlyRequestsReport", garageId, startMonth, endMonth), build)
 
-    maintenances = db.query(Maintenance).filter(
-        Maintenance.garageId == garageId,
-        Maintenance.scheduledDate >= start_date,
-        Maintenance.scheduledDate <= end_date
-    ).all()
 
-    response = build_monthly_report(maintenances, start_date.year, end_date.year)
-    return JSONResponse(content=response, status_code=200)
+MAINTENANCE_EXPORT_COLUMNS = ["id", "carId", "carName", "serviceType", "scheduledDate", "garageId", "garageName"]
+
+
+@router.get("/export")
+def export_maintenances(
+    carId: int | None = None,
+    garageId: int | None = None,
+    startDate: date | None = None,
+    endDate: date | None = None,
+    format: str = "ndjson",
+    gzip: bool = False,
+):
+    # The hot and the archived rows are streamed in key order side by side and merged, rows flow at once
+    statements = [
+        maintenance_page_rows(model, carId, garageId, startDate, endDate, None)
+        for model in (Maintenance, MaintenanceArchive)
+    ]
+    rows = heapq.merge(*(stream_rows(statement) for statement in statements), key=maintenance_key)
+
+    return export_response(rows, MAINTENANCE_EXPORT_COLUMNS, format, gzip, "maintenances")
 
 
 @router.put("/{maintenance_id}", response_model=MaintenanceValidationGET)
 def update_maintenance(maintenance_id: int, maintenance: MaintenanceValidationPOST, db: Session = Depends(get_db)):
-    db_car, db_garage = get_car_and_garage(db, maintenance.carId, maintenance.garageId)
+    garage_name = validate_booking(db, maintenance.carId, maintenance.garageId)
 
     db_maintenance = db.get(Maintenance, maintenance_id)
     if not db_maintenance:
-        raise HTTPException(status_code=404, detail="Maintenance not found")
-
-    validate_car_belongs_to_garage(db_car, db_garage, maintenance.garageId)
+        raise archived_or_missing(db, maintenance_id, "Maintenance not found")
 
-    db_maintenance.carId = maintenance.carId
-    db_maintenance.garageId = maintenance.garageId
-    db_maintenance.serviceType = maintenance.serviceType
-    db_maintenance.scheduledDate = maintenance.scheduledDate
+    old_garage_id, old_date = db_maintenance.garageId, db_maintenance.scheduledDate
+    if db.execute(update_if_unchanged(maintenance_id, old_garage_id, old_date, maintenance)).rowcount != 1:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=CHANGED_CONCURRENTLY)
+    if not move_booking(db, old_garage_id, old_date, maintenance.garageId, maintenance.scheduledDate):
+        db.rollback()
+        raise fully_booked(garage_name, maintenance.scheduledDate)
+    record_change(db, MAINTENANCE, UPDATED, maintenance_id)
 
     db.commit()
+    invalidate_maintenance(maintenance_id)
+    invalidate_occupancy(old_garage_id, old_date)
+    invalidate_occupancy(maintenance.garageId, maintenance.scheduledDate)
     db.refresh(db_maintenance)
 
     return db_maintenance
 
 
 @router.get("/{maintenance_id}", response_model=MaintenanceValidationGET)
-def get_maintenance(maintenance_id: int, db: Session = Depends(get_db)):
-    db_maintenance = db.get(Maintenance, maintenance_id)
-    if not db_maintenance:
-        raise HTTPException(status_code=404, detail=f"Maintenance with id: {maintenance_id} not found")
+def get_maintenance(maintenance_id: int, request: Request, db: Session = Depends(get_read_db)):
+    def build():
+        db_maintenance = db.get(Maintenance, maintenance_id, options=MAINTENANCE_RELATIONS)
+        if not db_maintenance:
+            db_maintenance = get_archived_maintenance(db, maintenance_id)
+        if not db_maintenance:
+            raise HTTPException(status_code=404, detail=f"Maintenance with id: {maintenance_id} not found")
 
-    return db_maintenance
+        content = MaintenanceValidationGET.model_validate(db_maintenance).model_dump(mode="json")
+        return CacheValue(content, maintenance_tags(db_maintenance))
+
+    return cached_response(request, ("maintenance", maintenance_id), build)
 
 
 @router.get("/", response_model=list[MaintenanceValidationGET])
 def get_maintenances(
+    response: Response,
     carId: int | None = None,
     garageId: int | None = None,
     startDate: date | None = None,
     endDate: date | None = None,
-    db: Session = Depends(get_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: Session = Depends(get_read_db),
 ):
-    query = db.query(Maintenance)
+    if reaches_archive(db, startDate):
+        rows = archived_maintenance_page(db, carId, garageId, startDate, endDate, limit, after, response)
+        return page_response(rows, response)
 
-    if startDate and endDate and startDate > endDate:
-        raise HTTPException(status_code=400, detail="startDate cannot be after endDate")
+    if FAST_SERIALIZATION:
+        statement = filter_maintenances(maintenance_rows(), carId, garageId, startDate, endDate)
+        statement = after_date_and_id(statement, Maintenance.scheduledDate, Maintenance.id, after)
+        rows = fetch_rows(db, statement, limit, response, lambda m: (m["scheduledDate"], m["id"]))
+        return page_response(rows, response)
 
-    if carId:
-        query = query.filter(Maintenance.carId == carId)
-    if garageId:
-        query = query.filter(Maintenance.garageId == garageId)
-    if startDate:
-        query = query.filter(Maintenance.scheduledDate >= startDate)
-    if endDate:
-        query = query.filter(Maintenance.scheduledDate <= endDate)
+    query = db.query(Maintenance).options(*MAINTENANCE_RELATIONS)
+    query = filter_maintenances(query, carId, garageId, startDate, endDate)
 
-    return query.all()
+    # Keyset pagination on (scheduledDate, id), the next page cursor is sent in the X-Next-Cursor header
+    query = after_date_and_id(query, Maintenance.scheduledDate, Maintenance.id, after)
+    return fetch_page(query, limit, response, lambda m: (m.scheduledDate, m.id))
 
 
 @router.delete("/{maintenance_id}")
 def delete_maintenance(maintenance_id: int, db: Session = Depends(get_db)):
-    db_maintenance = db.get(Maintenance, maintenance_id)
+    deleted = db.execute(delete_returning_booking(maintenance_id)).first()
 
-    if not db_maintenance:
-        raise HTTPException(status_code=404, detail=f"Maintenance with id: {maintenance_id} not found")
+    if not deleted:
+        raise archived_or_missing(db, maintenance_id, f"Maintenance with id: {maintenance_id} not found")
 
-    db.delete(db_maintenance)
+    garage_id, scheduled_date = deleted
+    change_occupancy(db, garage_id, scheduled_date, -1)
+    record_change(db, MAINTENANCE, DELETED, maintenance_id)
     db.commit()
+    invalidate_maintenance(maintenance_id)
+    invalidate_occupancy(garage_id, scheduled_date)
 
     return {"message": "Maintenance deleted successfully"}
\ No newline at end of file
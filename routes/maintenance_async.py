@@ -0,0 +1,176 @@
+import calendar
+from datetime import datetime, date
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from archive import reaches_archive
+from cache import (
+    CacheValue, cached_response_async, invalidate_maintenance, invalidate_occupancy, maintenance_tags, report_tags,
+)
+from changes import CREATED, DELETED, MAINTENANCE, UPDATED, record_change
+from constants import ENTITY_CACHE_ENABLED, FAST_SERIALIZATION, get_async_db, get_async_read_db
+from instrumentation import InstrumentedRoute
+from models import Maintenance
+from occupancy import change_occupancy, move_booking, reserve_capacity
+from pydantic_models import MaintenanceValidationGET, MaintenanceValidationPOST, MaintenanceMonthlyRequestsReport
+from routes.maintenance import (
+    CHANGED_CONCURRENTLY, MAINTENANCE_RELATIONS, archived_maintenance_page, archived_or_missing, booking_check,
+    cached_booking_check, check_booking, delete_returning_booking, filter_maintenances, fully_booked,
+    get_archived_maintenance, maintenance_rows, update_if_unchanged,
+)
+from routes.garages import cached_garage
+from routes.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, after_date_and_id, fetch_page_async, fetch_rows
+from routes.reports import build_monthly_report
+from serialization import page_response
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+async def validate_booking(db: AsyncSession, car_id: int, garage_id: int) -> str:
+    if ENTITY_CACHE_ENABLED:
+        return check_booking(await db.run_sync(cached_booking_check, car_id, garage_id))
+    return check_booking((await db.execute(booking_check(car_id, garage_id))).one())
+
+
+async def load_relations(db: AsyncSession, db_maintenance: Maintenance) -> Maintenance:
+    # garageName and carName read these relationships, which cannot be lazy loaded here
+    await db.refresh(db_maintenance, attribute_names=["garage", "car"])
+    return db_maintenance
+
+
+@router.post("/", response_model=MaintenanceValidationGET)
+async def post_maintenance(maintenance: MaintenanceValidationPOST, db: AsyncSession = Depends(get_async_db)):
+    garage_name = await validate_booking(db, maintenance.carId, maintenance.garageId)
+
+    if not await db.run_sync(reserve_capacity, maintenance.garageId, maintenance.scheduledDate):
+        await db.rollback()
+        raise fully_booked(garage_name, maintenance.scheduledDate)
+
+    new_maintenance = Maintenance(
+        carId=maintenance.carId,
+        garageId=maintenance.garageId,
+        serviceType=maintenance.serviceType,
+        scheduledDate=maintenance.scheduledDate,
+    )
+
+    db.add(new_maintenance)
+    await db.flush()
+    await db.run_sync(record_change, MAINTENANCE, CREATED, new_maintenance.id)
+    await db.commit()
+    invalidate_occupancy(maintenance.garageId, maintenance.scheduledDate)
+
+    return await load_relations(db, new_maintenance)
+
+
+@router.get("/monthlyRequestsReport", response_model=list[MaintenanceMonthlyRequestsReport])
+async def garage_report(
+    garageId: int,
+    startMonth: str,
+    endMonth: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    async def build():
+        if not await db.run_sync(cached_garage, garageId):
+            raise HTTPException(status_code=404, detail="Garage not found")
+
+        try:
+            start_date = datetime.strptime(f"{startMonth}-01", "%Y-%m-%d")
+            end_date = datetime.strptime(f"{endMonth}-{calendar.monthrange(int(endMonth[:4]), int(endMonth[5:7]))[1]}", "%Y-%m-%d")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid date format passed. It should adhere to 'yyyy-mm':\n{e}")
+
+        response = await db.run_sync(build_monthly_report, garageId, start_date.date(), end_date.date())
+        return CacheValue(response, report_tags(garageId, start_date.date(), end_date.date()))
+
+    return await cached_response_async(request, ("monthlyRequestsReport", garageId, startMonth, endMonth), build)
+
+
+@router.put("/{maintenance_id}", response_model=MaintenanceValidationGET)
+async def update_maintenance(
+    maintenance_id: int, maintenance: MaintenanceValidationPOST, db: AsyncSession = Depends(get_async_db)
+):
+    garage_name = await validate_booking(db, maintenance.carId, maintenance.garageId)
+
+    db_maintenance = await db.get(Maintenance, maintenance_id)
+    if not db_maintenance:
+        raise await db.run_sync(archived_or_missing, maintenance_id, "Maintenance not found")
+
+    old_garage_id, old_date = db_maintenance.garageId, db_maintenance.scheduledDate
+    if (await db.execute(update_if_unchanged(maintenance_id, old_garage_id, old_date, maintenance))).rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=CHANGED_CONCURRENTLY)
+    moved = await db.run_sync(move_booking, old_garage_id, old_date, maintenance.garageId, maintenance.scheduledDate)
+    if not moved:
+        await db.rollback()
+        raise fully_booked(garage_name, maintenance.scheduledDate)
+    await db.run_sync(record_change, MAINTENANCE, UPDATED, maintenance_id)
+
+    await db.commit()
+    invalidate_maintenance(maintenance_id)
+    invalidate_occupancy(old_garage_id, old_date)
+    invalidate_occupancy(maintenance.garageId, maintenance.scheduledDate)
+
+    return await load_relations(db, db_maintenance)
+
+
+@router.get("/{maintenance_id}", response_model=MaintenanceValidationGET)
+async def get_maintenance(maintenance_id: int, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    async def build():
+        db_maintenance = await db.get(Maintenance, maintenance_id, options=MAINTENANCE_RELATIONS)
+        if not db_maintenance:
+            db_maintenance = await db.run_sync(get_archived_maintenance, maintenance_id)
+        if not db_maintenance:
+            raise HTTPException(status_code=404, detail=f"Maintenance with id: {maintenance_id} not found")
+
+        content = MaintenanceValidationGET.model_validate(db_maintenance).model_dump(mode="json")
+        return CacheValue(content, maintenance_tags(db_maintenance))
+
+    return await cached_response_async(request, ("maintenance", maintenance_id), build)
+
+
+@router.get("/", response_model=list[MaintenanceValidationGET])
+async def get_maintenances(
+    response: Response,
+    carId: int | None = None,
+    garageId: int | None = None,
+    startDate: date | None = None,
+    endDate: date | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    if await db.run_sync(reaches_archive, startDate):
+        rows = await db.run_sync(archived_maintenance_page, carId, garageId, startDate, endDate, limit, after, response)
+        return page_response(rows, response)
+
+    if FAST_SERIALIZATION:
+        statement = filter_maintenances(maintenance_rows(), carId, garageId, startDate, endDate)
+        statement = after_date_and_id(statement, Maintenance.scheduledDate, Maintenance.id, after)
+        rows = await db.run_sync(fetch_rows, statement, limit, response, lambda m: (m["scheduledDate"], m["id"]))
+        return page_response(rows, response)
+
+    statement = select(Maintenance).options(*MAINTENANCE_RELATIONS)
+    statement = filter_maintenances(statement, carId, garageId, startDate, endDate)
+
+    statement = after_date_and_id(statement, Maintenance.scheduledDate, Maintenance.id, after)
+    return await fetch_page_async(db, statement, limit, response, lambda m: (m.scheduledDate, m.id))
+
+
+@router.delete("/{maintenance_id}")
+async def delete_maintenance(maintenance_id: int, db: AsyncSession = Depends(get_async_db)):
+    deleted = (await db.execute(delete_returning_booking(maintenance_id))).first()
+
+    if not deleted:
+        raise await db.run_sync(archived_or_missing, maintenance_id, f"Maintenance with id: {maintenance_id} not found")
+
+    garage_id, scheduled_date = deleted
+    await db.run_sync(change_occupancy, garage_id, scheduled_date, -1)
+    await db.run_sync(record_change, MAINTENANCE, DELETED, maintenance_id)
+    await db.commit()
+    invalidate_maintenance(maintenance_id)
+    invalidate_occupancy(garage_id, scheduled_date)
+
+    return {"message": "Maintenance deleted successfully"}
@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import date
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    """Encodes the sort key of the last returned row as an opaque cursor."""
+    raw = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decodes a cursor produced by encode_cursor, raising 400 if it was tampered with."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("unexpected cursor size")
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def after_id(query, id_column, cursor: str | None):
+    """Keyset page on a single id column."""
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+        query = query.filter(id_column > last_id)
+    return query.order_by(id_column)
+
+
+def after_date_and_id(query, date_column, id_column, cursor: str | None):
+    """Keyset page on (date, id), equivalent to (date, id) > (last_date, last_id)."""
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, 2)
+        try:
+            last_date = date.fromisoformat(last_date)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+        if not isinstance(last_id, int):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+        # The redundant lower bound lets SQLite seek the date index, with the OR alone it may plan the
+        # joined maintenance pages as a scan of every garage and a sort
+        query = query.filter(
+            date_column >= last_date,
+            or_(date_column > last_date, and_(date_column == last_date, id_column > last_id)),
+        )
+    return query.order_by(date_column, id_column)
+
+
+def fetch_page(query, limit: int, response: Response, cursor_key) -> list:
+    """
+    Fetches at most `limit` rows of an ordered keyset query.
+
+    One extra row is requested to know if there is a next page, in that case its cursor is
+    returned in the X-Next-Cursor header.
+    """
+    rows = query.limit(limit + 1).all()
+    return trim_page(rows, limit, response, cursor_key)
+
+
+def fetch_rows(db, statement, limit: int, response: Response, cursor_key) -> list[dict]:
+    """fetch_page for a select() of plain columns, the rows are returned as dicts."""
+    rows = [dict(row) for row in db.execute(statement.limit(limit + 1)).mappings()]
+    return trim_page(rows, limit, response, cursor_key)
+
+
+async def fetch_page_async(db, statement, limit: int, response: Response, cursor_key) -> list:
+    """fetch_page for a select() statement executed on an AsyncSession."""
+    rows = (await db.scalars(statement.limit(limit + 1))).all()
+    return trim_page(rows, limit, response, cursor_key)
+
+
+def trim_page(rows: list, limit: int, response: Response, cursor_key) -> list:
+    """Drops the look-ahead row and sets the X-Next-Cursor header when there is one."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*cursor_key(rows[-1]))
+    return rows
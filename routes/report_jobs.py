@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.orm import Session
+
+from constants import get_db, get_read_db
+from instrumentation import InstrumentedRoute
+from models import ReportJob
+from pydantic_models import ReportJobRequest, ReportJobStatus
+from report_jobs import (
+    DONE, FLEET, RUNNING, find_active_job, is_full, job_key, prune_jobs, read_result, select_report_garages, submit_job,
+)
+from routes.analytics import check_range
+
+router = APIRouter(route_class=InstrumentedRoute)
+
+
+def job_status(job: ReportJob) -> dict:
+    return {
+        "id": job.id, "report": job.report, "parameters": json.loads(job.parameters), "status": job.status,
+        "progress": job.progress, "partitions": job.partitions, "error": job.error,
+        "createdAt": job.createdAt, "finishedAt": job.finishedAt, "expiresAt": job.expiresAt,
+    }
+
+
+def get_job(db: Session, job_id: str) -> ReportJob:
+    job = db.get(ReportJob, job_id)
+    if job is None or (job.expiresAt is not None and job.expiresAt < datetime.now()):
+        raise HTTPException(status_code=404, detail="Report job not found, or its result expired")
+    return job
+
+
+@router.post("/", response_model=ReportJobStatus, status_code=202)
+def create_report_job(job: ReportJobRequest, db: Session = Depends(get_db)):
+    """
+    Starts a daily or monthly report of garageId, or a fleet report: the monthly report of every garage, or of those of city.
+
+    Poll GET /reports/jobs/{id} until its status is done, then fetch GET /reports/jobs/{id}/result.
+    While a job runs, submitting the same request again returns that job.
+    """
+    check_range(job.startDate, job.endDate)
+    if job.report == FLEET:
+        parameters = {"report": job.report, "startDate": str(job.startDate), "endDate": str(job.endDate), "city": job.city}
+        garages = select_report_garages(db, None, job.city)
+    else:
+        if job.garageId is None:
+            raise HTTPException(status_code=400, detail=f"A {job.report} report needs a garageId")
+        parameters = {
+            "report": job.report, "startDate": str(job.startDate), "endDate": str(job.endDate), "garageId": job.garageId,
+        }
+        garages = select_report_garages(db, job.garageId, None)
+    if not garages:
+        raise HTTPException(status_code=404, detail="Garage not found")
+
+    prune_jobs(db)
+    running = find_active_job(db, job_key(parameters))
+    if running is not None:
+        return job_status(running)
+    if is_full(db):
+        raise HTTPException(status_code=503, detail="Too many report jobs are running, retry later")
+    return job_status(submit_job(db, parameters, garages))
+
+
+@router.get("/{job_id}", response_model=ReportJobStatus)
+def get_report_job(job_id: str, db: Session = Depends(get_read_db)):
+    return job_status(get_job(db, job_id))
+
+
+@router.get("/{job_id}/result")
+def get_report_job_result(job_id: str, db: Session = Depends(get_read_db)):
+    """
+    The result of a finished job.
+
+    A daily or monthly report is returned as GET /garages/dailyAvailabilityReport and GET
+    /maintenance/monthlyRequestsReport return it, a fleet report as one entry per garage with its
+    id, name, city, capacity and months, the monthly report.
+    """
+    job = get_job(db, job_id)
+    if job.status == RUNNING:
+        raise HTTPException(status_code=409, detail=f"The report job is still running, {job.progress} of {job.partitions} partitions done")
+    if job.status != DONE:
+        raise HTTPException(status_code=409, detail=f"The report job failed: {job.error}")
+    content = read_result(job.id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Report job not found, or its result expired")
+    return Response(content=content, media_type="application/json")
@@ -1,21 +1,43 @@
 import calendar
+from datetime import date, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import Date, Integer, Text, and_, cast, extract, func, literal, select
+from sqlalchemy.orm import Session
+
 from constants import MONTHS
-from models import Maintenance
+from models import Garage, GarageOccupancy
+
+# Longest date window of the multi-garage availability endpoints
+MAX_AVAILABILITY_DAYS = 366
+# Garage columns of the availability endpoints, in the order of GarageAvailabilityRow
+AVAILABILITY_COLUMNS = (Garage.id, Garage.name, Garage.city, Garage.capacity)
+AVAILABILITY_FIELDS = tuple(column.key for column in AVAILABILITY_COLUMNS)
 
 
-def build_daily_report(available_maintenances: list[Maintenance], capacity: int) -> list[dict]:
+def build_daily_report(db: Session, garage_id: int, start_date: date, end_date: date, capacity: int) -> list[dict]:
     """Build the daily report for the Garage availability."""
-    date_count = count_maintenance_by_date(available_maintenances)
+    date_count = count_maintenance_by_date(db, garage_id, start_date, end_date)
     return generate_daily_report(date_count, capacity)
 
 
-def count_maintenance_by_date(available_maintenances: list[Maintenance]) -> dict:
+def daily_counts_query(garage_id: int, start_date: date, end_date: date):
+    """Requests per day for one garage and date range, read from the GarageOccupancy rollup."""
+    return (
+        select(GarageOccupancy.date, GarageOccupancy.requests)
+        .where(
+            GarageOccupancy.garageId == garage_id,
+            GarageOccupancy.date >= start_date,
+            GarageOccupancy.date <= end_date,
+        )
+        .order_by(GarageOccupancy.date)
+    )
+
+
+def count_maintenance_by_date(db: Session, garage_id: int, start_date: date, end_date: date) -> dict:
     """Counts the number of maintenance requests per day."""
-    date_count = {}
-    for maintenance in available_maintenances:
-        scheduled_date = maintenance.scheduledDate
-        date_count[scheduled_date] = date_count.get(scheduled_date, 0) + 1
-    return date_count
+    rows = db.execute(daily_counts_query(garage_id, start_date, end_date))
+    return {scheduled_date: requests for scheduled_date, requests in rows}
 
 
 def generate_daily_report(date_count: dict, capacity: int) -> list[dict]:
@@ -31,10 +53,10 @@ def generate_daily_report(date_count: dict, capacity: int) -> list[dict]:
     return response
 
 
-def build_monthly_report(available_maintenances: list[Maintenance], start_year: int, end_year: int):
+def build_monthly_report(db: Session, garage_id: int, start_date: date, end_date: date):
     """Builds the monthly report for the given range of years."""
-    date_counts = build_year_month_obj(available_maintenances, start_year, end_year)
-    return generate_monthly_report(date_counts, start_year, end_year)
+    date_counts = build_year_month_obj(db, garage_id, start_date, end_date)
+    return generate_monthly_report(date_counts, start_date.year, end_date.year)
 
 
 def generate_monthly_report(date_counts: dict, start_year: int, end_year: int) -> list[dict]:
@@ -42,22 +64,19 @@ def generate_monthly_report(date_counts: dict, start_year: int, end_year: int) -
     report = []
     for year in range(start_year, end_year + 1):
         for month in range(1, 13):
-            report.append({
-                "yearMonth": {
-                    "year": year,
-                    "month": MONTHS[month],
-                    "leapYear": calendar.isleap(year),
-                    "monthValue": month
-                },
-                "requests": date_counts[year].get(month, 0),
-            })
+            report.append({"yearMonth": year_month(year, month), "requests": date_counts[year].get(month, 0)})
     return report
 
 
-def build_year_month_obj(available_maintenances: list[Maintenance], start_year: int, end_year: int):
+def year_month(year: int, month: int) -> dict:
+    """The YearMonth of a monthly report row."""
+    return {"year": year, "month": MONTHS[month], "leapYear": calendar.isleap(year), "monthValue": month}
+
+
+def build_year_month_obj(db: Session, garage_id: int, start_date: date, end_date: date):
     """Builds a dictionary to count maintenance requests per year and month."""
-    date_count = initialize_year_month_dict(start_year, end_year)
-    count_maintenance_by_year_and_month(available_maintenances, date_count)
+    date_count = initialize_year_month_dict(start_date.year, end_date.year)
+    count_maintenance_by_year_and_month(db, garage_id, start_date, end_date, date_count)
     return date_count
 
 
@@ -66,9 +85,125 @@ def initialize_year_month_dict(start_year: int, end_year: int) -> dict:
     return {year: {month: 0 for month in range(1, 13)} for year in range(start_year, end_year + 1)}
 
 
-def count_maintenance_by_year_and_month(available_maintenances: list[Maintenance], date_count: dict):
+def monthly_counts_query(garage_id: int, start_date: date, end_date: date):
+    """SELECT year, month, SUM(requests) over the GarageOccupancy rollup for one garage and date range."""
+    year = extract("year", GarageOccupancy.date)
+    month = extract("month", GarageOccupancy.date)
+    return (
+        select(year, month, func.sum(GarageOccupancy.requests))
+        .where(
+            GarageOccupancy.garageId == garage_id,
+            GarageOccupancy.date >= start_date,
+            GarageOccupancy.date <= end_date,
+        )
+        .group_by(year, month)
+    )
+
+
+def count_maintenance_by_year_and_month(db: Session, garage_id: int, start_date: date, end_date: date, date_count: dict):
     """Counts the maintenance requests per year and month."""
-    for maintenance in available_maintenances:
-        year = maintenance.scheduledDate.year
-        month = maintenance.scheduledDate.month
-        date_count[year][month] += 1
\ No newline at end of file
+    for year, month, requests in db.execute(monthly_counts_query(garage_id, start_date, end_date)):
+        date_count[int(year)][int(month)] += requests
+
+
+def availability_window(start_date: date, end_date: date) -> list[date]:
+    """Every day from start_date to end_date, rejecting empty and overlong windows."""
+    days = (end_date - start_date).days + 1
+    if days < 1:
+        raise HTTPException(status_code=400, detail="endDate must not be before startDate")
+    if days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"The date range is limited to {MAX_AVAILABILITY_DAYS} days")
+    return [start_date + timedelta(days=offset) for offset in range(days)]
+
+
+def _sqlite_booked_days(start_date: date):
+    offset = cast(func.julianday(GarageOccupancy.date) - func.julianday(start_date), Integer)
+    return func.group_concat(offset), func.group_concat(GarageOccupancy.requests)
+
+
+def _postgresql_booked_days(start_date: date):
+    offset = GarageOccupancy.date - literal(start_date, Date)  # date - date is a number of days
+    return func.string_agg(cast(offset, Text), ","), func.string_agg(cast(GarageOccupancy.requests, Text), ",")
+
+
+# Per garage, the day offsets from the start date and the requests of its booked days as two
+# comma separated lists in the same order. One row per garage instead of one per booked day
+# keeps the Python work off the hot path, other dialects fall back to the plain rows.
+BOOKED_DAYS_DIALECTS = {"sqlite": _sqlite_booked_days, "postgresql": _postgresql_booked_days}
+
+
+def availability_query(
+    start_date: date, end_date: date, city: str | None = None, garage_id: int | None = None, dialect: str | None = None
+):
+    """
+    Every selected garage with its GarageOccupancy rows in the date range, in one LEFT JOIN.
+
+    With a BOOKED_DAYS_DIALECTS dialect the rows are aggregated per garage, otherwise a garage
+    comes back once per booked day (once with a NULL date without bookings).
+    """
+    booked_days = BOOKED_DAYS_DIALECTS.get(dialect)
+    if booked_days is not None:
+        statement = select(*AVAILABILITY_COLUMNS, *booked_days(start_date)).group_by(*AVAILABILITY_COLUMNS)
+    else:
+        statement = select(*AVAILABILITY_COLUMNS, GarageOccupancy.date, GarageOccupancy.requests)
+    statement = statement.outerjoin(GarageOccupancy, and_(
+        GarageOccupancy.garageId == Garage.id,
+        GarageOccupancy.date >= start_date,
+        GarageOccupancy.date <= end_date,
+    )).where(Garage.deletedAt.is_(None)).order_by(Garage.id)
+    if city:
+        statement = statement.where(Garage.city == city)
+    if garage_id is not None:
+        statement = statement.where(Garage.id == garage_id)
+    return statement
+
+
+def garage_occupancy(db: Session, start_date: date, end_date: date, city: str | None, garage_id: int | None) -> list:
+    """The selected garages with their requests per booked day: [(garage, {day offset: requests})]."""
+    dialect = db.get_bind().dialect.name
+    rows = db.execute(availability_query(start_date, end_date, city, garage_id, dialect))
+    garages = []
+    if dialect in BOOKED_DAYS_DIALECTS:
+        for *garage, offsets, requests in rows:
+            booked = dict(zip(map(int, offsets.split(",")), map(int, requests.split(",")))) if offsets else {}
+            garages.append((dict(zip(AVAILABILITY_FIELDS, garage)), booked))
+        return garages
+
+    for *garage, day, requests in rows:
+        if not garages or garages[-1][0]["id"] != garage[0]:
+            garages.append((dict(zip(AVAILABILITY_FIELDS, garage)), {}))
+        if day is not None:
+            garages[-1][1][(day - start_date).days] = requests
+    return garages
+
+
+def build_availability_matrix(db: Session, city: str | None, start_date: date, end_date: date) -> dict:
+    """Available capacity of every garage (of the city) on every day of the range, booked or not."""
+    days = availability_window(start_date, end_date)
+    rows = []
+    for garage, booked in garage_occupancy(db, start_date, end_date, city, None):
+        available = [garage["capacity"]] * len(days)
+        for offset, requests in booked.items():
+            available[offset] -= requests
+        garage["availableCapacity"] = available
+        rows.append(garage)
+    return {"startDate": str(start_date), "endDate": str(end_date), "dates": [str(day) for day in days], "garages": rows}
+
+
+def find_next_available(
+    db: Session, start_date: date, count: int, horizon_days: int, city: str | None, garage_id: int | None
+) -> list[dict]:
+    """The first `count` days from start_date with free capacity, per garage, looking `horizon_days` ahead."""
+    end_date = start_date + timedelta(days=horizon_days - 1)
+    days = availability_window(start_date, end_date)
+    result = []
+    for garage, booked in garage_occupancy(db, start_date, end_date, city, garage_id):
+        garage["slots"] = []
+        for offset, day in enumerate(days):
+            available = garage["capacity"] - booked.get(offset, 0)
+            if available > 0:
+                garage["slots"].append({"date": str(day), "availableCapacity": available})
+                if len(garage["slots"]) == count:
+                    break
+        result.append(garage)
+    return result
@@ -0,0 +1,54 @@
+import json
+import logging
+from datetime import date
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+from routes.pagination import NEXT_CURSOR_HEADER
+
+logger = logging.getLogger("carmanagement.serialization")
+
+try:
+    import orjson
+except ImportError:  # the json module gives the same bytes, only slower
+    orjson = None
+    # Logged once, when a worker imports the app
+    logger.warning("orjson is not installed, JSON is rendered with the json module and FAST_SERIALIZATION gains little")
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Renders content to the exact bytes FastAPI's JSONResponse produces for the same data.
+
+    Dates are written in ISO format, like the pydantic models do.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def page_response(rows: list[dict], response: Response) -> FastJSONResponse:
+    """
+    Returns a page built by the fast path as is, without response_model validation.
+
+    Headers set on the injected `response` are not applied to a returned Response, so the
+    X-Next-Cursor header is copied over.
+    """
+    headers = {}
+    if NEXT_CURSOR_HEADER in response.headers:
+        headers[NEXT_CURSOR_HEADER] = response.headers[NEXT_CURSOR_HEADER]
+    return FastJSONResponse(rows, headers=headers)
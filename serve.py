@@ -0,0 +1,58 @@
+"""
+Production entry point.
+
+    python serve.py --workers 4
+    python serve.py --reload
+
+The pre-start step brings the schema up to date once, in this process, before uvicorn starts the
+workers. The workers only import main:app, which opens no connection and creates no table, so they
+start fast and never race each other on the schema.
+"""
+import argparse
+import logging
+import time
+
+import uvicorn
+
+from constants import SERVER_HOST, SERVER_PORT, SERVER_WORKERS
+
+logger = logging.getLogger("carmanagement.serve")
+
+
+def prestart():
+    """Applies the pending migrations, see migrations.py."""
+    from constants import engine
+    from migrations import MIGRATIONS, MigrationError, run_migrations
+
+    started = time.perf_counter()
+    try:
+        applied = run_migrations(engine)
+    except MigrationError as error:
+        # Not a crash: the message says what to fix in the data before starting again
+        raise SystemExit(f"Pre-start migration stopped: {error}")
+    engine.dispose()
+    for migration in applied:
+        logger.info("Applied migration %s: %s", migration.version, migration.description)
+    logger.info("Database at version %s, checked in %.2fs", MIGRATIONS[-1].version, time.perf_counter() - started)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Worker processes, SERVER_WORKERS")
+    parser.add_argument("--reload", action="store_true", help="Development mode, one worker restarted on code changes")
+    parser.add_argument("--skip-prestart", action="store_true", help="The migrations were applied separately")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.skip_prestart:
+        prestart()
+    if args.reload:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, reload=False)
+
+
+if __name__ == "__main__":
+    main()